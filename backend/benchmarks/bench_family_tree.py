@@ -0,0 +1,163 @@
+'''
+Benchmark of get_family_tree_async: per-lineage queries vs. a single family-scoped query.
+
+The triple store is simulated by replacing the SPARQL functions used by logic_layer
+with functions that return synthetic bindings after a fixed round-trip latency,
+so the numbers show how the query count drives the latency as the number of
+branches (lineages) in a family grows.
+
+Usage (from backend/): python benchmarks/bench_family_tree.py [--latency-ms 5] [--nodes-per-branch 3]
+'''
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import numpy as np
+
+import logic_layer
+from tools import operation_validator
+
+
+def literal(value):
+    '''
+    Returns a SPARQL JSON literal term
+    '''
+    return {'type': 'literal', 'value': value}
+
+
+def synthetic_family(branches:int, nodes_per_branch:int) -> list:
+    '''
+    Returns family tree bindings: a root lineage plus branches splitting off the root
+    '''
+    bindings = []
+    second = 0
+    for branch in range(branches):
+        previous = 'root' if branch > 0 else None
+        for node in range(nodes_per_branch):
+            uuid = 'root' if branch == 0 and node == 0 else 'b%d-n%d' % (branch, node)
+            binding = {
+                'id': literal(uuid),
+                'lineageId': literal('lineage-%03d' % branch),
+                'title': literal('dataset'),
+                'operationDescription': literal('update:changed' if previous else 'create'),
+                'operationBy': literal('user1'),
+                'associatedUserGroup': literal('group1'),
+                'timestamp': literal('2024-09-05 %02d:%02d:%02d' % (second // 3600, second // 60 % 60, second % 60)),
+            }
+            if previous is not None:
+                binding['previousUUID'] = literal(previous)
+            bindings.append(binding)
+            previous = uuid
+            second += 1
+    return bindings
+
+
+class SimulatedStore:
+    '''
+    Answers the SPARQL functions used by both family tree implementations with synthetic bindings
+    '''
+    def __init__(self, bindings:list, latency:float):
+        self.bindings = bindings
+        self.latency = latency
+        self.queries = 0
+
+    def respond(self, bindings:list) -> dict:
+        '''
+        Counts the query and answers it after the simulated latency
+        '''
+        self.queries += 1
+        time.sleep(self.latency)
+        return {'results': {'bindings': bindings}}
+
+    async def respond_async(self, bindings:list) -> dict:
+        '''
+        Awaitable version of respond
+        '''
+        self.queries += 1
+        await asyncio.sleep(self.latency)
+        return {'results': {'bindings': bindings}}
+
+    def metadata(self, uuid:str) -> list:
+        return [{
+            'operationFrom': literal('operation-' + uuid),
+            'name': literal('dataset'),
+            'lineageId': literal('lineage-000'),
+            'familyId': literal('family'),
+        }]
+
+    def get_dataset_metadata_SPARQL(self, uuid):
+        return self.respond(self.metadata(uuid))
+
+    async def get_dataset_metadata_SPARQL_async(self, uuid):
+        return await self.respond_async(self.metadata(uuid))
+
+    def get_lineage_id_by_family_id_SPARQL(self, family_id):
+        return self.respond([{'lineageId': binding['lineageId']} for binding in self.bindings])
+
+    def select_lineage_by_lineage_id_SPARQL(self, lineage_id):
+        return self.respond([binding for binding in self.bindings if binding['lineageId']['value'] == lineage_id])
+
+    async def select_family_tree_by_family_id_SPARQL_async(self, family_id):
+        return await self.respond_async(self.bindings)
+
+
+def legacy_get_family_tree(uuid:str) -> dict:
+    '''
+    Previous implementation: one query for the family_id, one for its lineage_ids and one per lineage
+    '''
+    family_id = operation_validator.get_family_id(uuid)
+    lineage_ids = np.unique(operation_validator.get_lineage_ids_by_family_id(family_id))
+    return {lineage_id: logic_layer.get_lineage_by_lineage_id(lineage_id) for lineage_id in lineage_ids}
+
+
+def single_get_family_tree(uuid:str) -> dict:
+    '''
+    Current implementation: one query for the family_id and one for the whole family
+    '''
+    return asyncio.run(logic_layer.get_family_tree_async(uuid))
+
+
+def run(implementation, store:SimulatedStore, repeat:int=3):
+    '''
+    Returns the query count and the best latency (ms) of implementation
+    '''
+    operation_validator.get_dataset_metadata_SPARQL = store.get_dataset_metadata_SPARQL
+    operation_validator.get_dataset_metadata_SPARQL_async = store.get_dataset_metadata_SPARQL_async
+    operation_validator.get_lineage_id_by_family_id_SPARQL = store.get_lineage_id_by_family_id_SPARQL
+    logic_layer.select_lineage_by_lineage_id_SPARQL = store.select_lineage_by_lineage_id_SPARQL
+    logic_layer.select_family_tree_by_family_id_SPARQL_async = store.select_family_tree_by_family_id_SPARQL_async
+
+    timings = []
+    for _ in range(repeat):
+        store.queries = 0
+        # Every run resolves the family_id from the store, as on a cold metadata cache
+        operation_validator.metadata_cache.clear()
+        start = time.perf_counter()
+        result = implementation('root')
+        timings.append((time.perf_counter() - start) * 1000)
+    return store.queries, min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='simulated round-trip latency per query')
+    parser.add_argument('--nodes-per-branch', type=int, default=3)
+    parser.add_argument('--branches', type=int, nargs='+', default=[1, 5, 10, 25, 50, 100])
+    args = parser.parse_args()
+
+    print('%8s | %14s %12s | %14s %12s' % ('branches', 'legacy queries', 'legacy ms', 'single queries', 'single ms'))
+    for branches in args.branches:
+        store = SimulatedStore(synthetic_family(branches, args.nodes_per_branch), args.latency_ms / 1000)
+        legacy_queries, legacy_ms, legacy_result = run(legacy_get_family_tree, store)
+        single_queries, single_ms, single_result = run(single_get_family_tree, store)
+        assert legacy_result == single_result
+        print('%8d | %14d %12.1f | %14d %12.1f' % (branches, legacy_queries, legacy_ms, single_queries, single_ms))
+
+
+if __name__ == '__main__':
+    main()
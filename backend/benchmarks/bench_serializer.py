@@ -0,0 +1,80 @@
+'''
+Microbenchmark of the write-path serialization: prov.ProvDocument + regex rewriting
+vs. the direct triple serializer.
+
+Both paths turn one update operation into the INSERT DATA statement sent to the store.
+
+Usage (from backend/): python benchmarks/bench_serializer.py [--seconds 2]
+'''
+
+import argparse
+import os
+import re
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from tools.rdf.graph_builder import namespaces, Dataset, Document, Operation, User
+from tools.rdf.triple_builder import TripleDocument, to_insert_data
+from tools.sparql.groundlevel_tools.regex_query_builder import re_convert_insert
+
+INSERT_PATTERN = r'(?s)((@prefix)( \S+: <\S+> ).(\n+))+?(\{.*\})?'
+
+
+def operation_objects():
+    '''
+    Returns the objects of one update operation
+    '''
+    user = User(name='user1', group='group1')
+    dataset = Dataset('uuid-2', 'dataset', 'lineage-1', 'family-1')
+    dataset_prev = Dataset('uuid-1', 'dataset', 'lineage-1', 'family-1')
+    operation = Operation(type_='update', involved_dataset=dataset, involved_user=user, description='cleaned')
+    return user, dataset, operation, dataset_prev
+
+
+def prov_insert():
+    '''
+    Previous write path: prov document, PROV RDF serialization and regex rewriting
+    '''
+    document = Document(namespaces, *operation_objects())
+    return re.sub(INSERT_PATTERN, re_convert_insert, document.get_serialized_rdf_graph())
+
+
+def direct_insert():
+    '''
+    Current write path: triples written straight into INSERT DATA
+    '''
+    return to_insert_data(TripleDocument(*operation_objects()).get_triples())
+
+
+def ops_per_second(function, seconds:float) -> float:
+    '''
+    Runs function repeatedly for the given duration and returns its throughput
+    '''
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        function()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=2.0, help='duration of each measurement')
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore', DeprecationWarning)
+    prov_ops = ops_per_second(prov_insert, args.seconds)
+    direct_ops = ops_per_second(direct_insert, args.seconds)
+
+    print('%-28s %12s' % ('serializer', 'ops/sec'))
+    print('%-28s %12.0f' % ('prov + regex', prov_ops))
+    print('%-28s %12.0f' % ('direct triples', direct_ops))
+    print('speedup: %.1fx' % (direct_ops / prov_ops))
+
+
+if __name__ == '__main__':
+    main()
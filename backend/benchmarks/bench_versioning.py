@@ -0,0 +1,155 @@
+'''
+Benchmark of add_versioning: labelling a synthetic family tree of n datasets.
+
+Each dataset is derived from a randomly chosen earlier one, which gives a mix of
+long chains and wide fan-outs. The previous engine (one object per dataset,
+list-sliced BFS queue, timestamps parsed in every sort, list membership checks
+per edge) is measured as well, up to --legacy-max nodes since it grows
+quadratically. Memory is what the built tree holds on top of the json.
+
+Usage (from backend/): python benchmarks/bench_versioning.py [--nodes 1000 10000 100000] [--legacy-max 20000]
+'''
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import versioning
+
+
+def synthetic_family(num_nodes:int, seed:int=0) -> dict:
+    '''
+    Returns a family tree json of num_nodes datasets, some of them created in the same second
+    '''
+    rng = random.Random(seed)
+    start = datetime(2024, 9, 5)
+    ft = {}
+    for i in range(num_nodes):
+        derived_from = 'd%d' % rng.randrange(i) if i > 0 else None
+        ft.setdefault('lineage-%03d' % (i % 100), {})['d%d' % i] = {
+            'username': 'user1',
+            'user_group': 'group1',
+            'dataset_name': 'dataset',
+            'derived_from': derived_from,
+            'operation_description': 'update:changed' if derived_from else 'create',
+            'timestamp': (start + timedelta(seconds=i // 2)).strftime('%Y-%m-%d %H:%M:%S'),
+        }
+    return ft
+
+
+class LegacyNode:
+    '''
+    Dataset of the previous implementation: one object per dataset, compared by identity
+    '''
+    def __init__(self, dataset_id, username, user_group, dataset_name, derived_from, operation_description, timestamp):
+        self.dataset_id = dataset_id
+        self.username = username
+        self.user_group = user_group
+        self.dataset_name = dataset_name
+        self.derived_from = derived_from
+        self.operation_description = operation_description
+        self.timestamp = timestamp
+        self.version = None
+        self.parents = []
+        self.children = []
+
+
+def legacy_create_family_tree(ft:dict) -> dict:
+    '''
+    Previous implementation, kept here for comparison: returns the labelled LegacyNodes by dataset_id
+    '''
+    nodes = {}
+    for lineage_id in ft:
+        for dataset_id, dataset in ft[lineage_id].items():
+            nodes[dataset_id] = LegacyNode(
+                dataset_id, dataset['username'], dataset['user_group'], dataset['dataset_name'],
+                dataset['derived_from'], dataset['operation_description'], dataset['timestamp']
+            )
+
+    root = None
+    for dataset_id, node in nodes.items():
+        if node.derived_from is None:
+            root = node
+            continue
+        parent = nodes[node.derived_from]
+        if parent not in node.parents:
+            node.parents.append(parent)
+        if node not in parent.children:
+            parent.children.append(node)
+
+    root.version = versioning.ROOT_VERSION
+    q = [root]
+    while len(q) > 0:
+        parent = q[0]
+        q = q[1:]
+        children = sorted(parent.children, key=lambda obj: datetime.strptime(obj.timestamp, '%Y-%m-%d %H:%M:%S'))
+        for child in children:
+            q.append(child)
+        for i, child in enumerate(children):
+            child.version = versioning.child_version(parent.version, i, len(children))
+    return nodes
+
+
+def legacy_add_versioning(ft:dict) -> dict:
+    '''
+    Previous implementation of add_versioning
+    '''
+    nodes = legacy_create_family_tree(ft)
+    for lineage_id in ft:
+        for dataset_id in ft[lineage_id]:
+            ft[lineage_id][dataset_id]['version'] = nodes[dataset_id].version
+    return ft
+
+
+def retained_bytes(build, ft:dict) -> int:
+    '''
+    Returns the memory (bytes) held by the structure build(ft) returns, apart from ft itself
+    '''
+    ft = copy.deepcopy(ft)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    structure = build(ft)
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del structure
+    return retained
+
+
+def run(implementation, ft:dict) -> tuple:
+    '''
+    Returns the latency (ms) and result of implementation on a copy of ft
+    '''
+    ft = copy.deepcopy(ft)
+    start = time.perf_counter()
+    result = implementation(ft)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--legacy-max', type=int, default=20000, help='largest family the previous engine is timed on')
+    args = parser.parse_args()
+
+    print('%8s | %12s %12s | %12s %12s' % ('nodes', 'legacy ms', 'legacy MB', 'current ms', 'current MB'))
+    for num_nodes in args.nodes:
+        ft = synthetic_family(num_nodes)
+        current_ms, current_result = run(versioning.add_versioning, ft)
+        current_mb = retained_bytes(versioning.create_family_tree, ft) / 2 ** 20
+        if num_nodes <= args.legacy_max:
+            legacy_ms, legacy_result = run(legacy_add_versioning, ft)
+            legacy_mb = retained_bytes(legacy_create_family_tree, ft) / 2 ** 20
+            assert legacy_result == current_result
+            print('%8d | %12.1f %12.1f | %12.1f %12.1f' % (num_nodes, legacy_ms, legacy_mb, current_ms, current_mb))
+        else:
+            print('%8d | %12s %12s | %12.1f %12.1f' % (num_nodes, '-', '-', current_ms, current_mb))
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
+import hashlib
 import logging
 import os
+import threading
 from config import Config
-from flask import Blueprint, Flask, jsonify, request, make_response, send_from_directory
+from flask import Blueprint, Flask, Response, jsonify, request, make_response, send_from_directory
 from importlib.metadata import distribution, metadata, version
 from flask_swagger_ui import get_swaggerui_blueprint
 from flask_cors import CORS
@@ -11,10 +13,14 @@ from flask_restx import Api
 from flask_restx.apidoc import apidoc
 from json import dumps, loads
 
-from identity_manager import IdentityManager, IdentityManagerApi
-from logic_layer import create, read, update, delete, delete_family_tree, get_history_dataset, get_num_operations_dataset, get_history_user, get_lineage_by_uuid, get_family_tree, get_diff_datasets
-from tools.error_handler import CustomError
-from versioning import add_versioning
+from identity_manager import IdentityManager, IdentityManagerApi, authorization_cache
+from logic_layer import create, read, update, delete, delete_family_tree, get_history_user, stream_history_user, get_lineage_by_uuid, \
+    get_history_dataset_async, get_num_operations_dataset_async, get_versioned_family_tree_async, get_diff_datasets_async, get_metrics, \
+    get_dataset_history_revision_async, get_lineage_revision, get_family_tree_revision_async, is_derived_from_async, \
+    get_common_ancestor_async, get_dataset_descendants_async
+from tools.deadline import DeadlineExceeded, with_deadline
+from tools.error_handler import CustomError, ServiceUnavailableError
+from tools.operation_validator import load_known_datasets
 
 FDS_API_URL = 'https://develop.pistis-market.eu/srv/factory-data-storage'
 FDS_API_KEY = os.getenv('FDS_API_KEY', '')
@@ -22,6 +28,11 @@ LT_API_KEY = os.getenv('LT_API_KEY', '')
 CLIENT_ID = os.getenv('CLIENT_ID', '')
 CLIENT_SECRET = os.getenv('CLIENT_SECRET', '')
 
+# Time budgets in seconds for all store and Factory Data Storage calls made by a request
+REQUEST_DEADLINE_WRITE = float(os.getenv('REQUEST_DEADLINE_WRITE', '30'))
+REQUEST_DEADLINE_READ = float(os.getenv('REQUEST_DEADLINE_READ', '30'))
+REQUEST_DEADLINE_BULK = float(os.getenv('REQUEST_DEADLINE_BULK', '120'))
+
 logger = logging.getLogger('api')
 
 app = Flask(__name__)
@@ -90,19 +101,32 @@ dictConfig({
 
 @app.errorhandler(CustomError)
 def handleError(e):
-    return make_response(jsonify(e.__dict__), e.status_code)
+    response = make_response(jsonify(e.__dict__), e.status_code)
+    if isinstance(e, ServiceUnavailableError):
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.errorhandler(DeadlineExceeded)
+def handleDeadlineExceeded(e):
+    return handleError(CustomError(
+        'The request did not complete within its deadline.',
+        'Lineage Tracker Backend',
+        504
+    ))
 
 # API Key specification
 def token_required(f):
     '''decorator function to check tokens in header'''
     @wraps(f)
     def wrapped(*args, **kwargs):
+        # ensure_sync runs async views to completion, so both kinds of views can be wrapped
+        view = app.ensure_sync(f)
         token = request.headers.get("Authorization", None)
         app.logger.info("TOKEN: %s", token)
         app.logger.info("LT_API_KEY: %s", LT_API_KEY)
         if token and not token.startswith("Bearer"):
             if token == LT_API_KEY:
-                return f(*args,**kwargs)
+                return view(*args, **kwargs)
             else:
                 raise CustomError(
                     'Unauthorized access.',
@@ -114,14 +138,13 @@ def token_required(f):
             # TODO: IdentityManager permission will likely have datasetId in future, but not ready yet
             identity_object = IdentityManager('application/x-www-form-urlencoded', 'urn:ietf:params:oauth:grant-type:uma-ticket', '')
             bearer_token = token.split(' ')[1]
-            response = IdentityManagerApi().user_account_authorize(identity_object, bearer_token)
-            if response.status_code != 200:
+            if not IdentityManagerApi().is_authorized(identity_object, bearer_token):
                 raise CustomError(
                     'Unauthorized access.',
                     'Lineage Tracker Backend',
                     401
                 )
-            return f(*args,**kwargs)
+            return view(*args, **kwargs)
         else:
             raise CustomError(
                 'API Key or token is missing, authentication failed.',
@@ -130,8 +153,61 @@ def token_required(f):
             )
     return wrapped
 
+def make_etag(revision:str) -> str:
+    '''
+    Returns the ETag of the response to the current request, given the revision of the data it shows
+    The query string is included, as it selects the representation (e.g., user_group or a page)
+    '''
+    if revision is None:
+        return None
+    return hashlib.sha256((request.full_path + '\n' + revision).encode('utf-8')).hexdigest()
+
+def not_modified(etag:str) -> Response:
+    '''
+    Returns a 304 response if the client already holds the representation with etag, else None
+    '''
+    if etag is None or not request.if_none_match.contains(etag):
+        return None
+    return with_etag(Response(status=304), etag)
+
+def with_etag(response:Response, etag:str) -> Response:
+    '''
+    Sets the ETag of a response and makes clients revalidate it before reuse
+    '''
+    if etag is not None:
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        response.cache_control.private = True
+    return response
+
+def get_page_args(endpoint:str) -> tuple:
+    '''
+    Returns the limit and cursor query parameters of a paginated endpoint
+    '''
+    limit = request.args.get('limit', None)
+    cursor = request.args.get('cursor', None)
+
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+
+    if (limit is not None and limit < 1) or (cursor is not None and limit is None):
+        app.logger.error(
+            'ERROR - %s - The shape of the provided arguments is faulty!', endpoint
+        )
+        raise CustomError(
+            'The shape of the provided arguments is faulty!',
+            'Lineage Tracker Backend',
+            400
+        )
+
+    return limit, cursor
+
 @app.route('/create_dataset', methods=['POST'])
 @token_required
+@with_deadline(REQUEST_DEADLINE_WRITE)
 def create_dataset():
     '''
     Document the creation of a new dataset in the Lineage Information Store.
@@ -156,6 +232,7 @@ def create_dataset():
 
 @app.route('/read_dataset', methods=['POST'])
 @token_required
+@with_deadline(REQUEST_DEADLINE_WRITE)
 def read_dataset():
     '''
     Document the reading of an existing dataset in the Lineage Information Store.
@@ -179,6 +256,7 @@ def read_dataset():
 
 @app.route('/update_dataset', methods=['POST'])
 @token_required
+@with_deadline(REQUEST_DEADLINE_WRITE)
 def update_dataset():
     '''
     Document the updating of an existing dataset in the Lineage Information Store.
@@ -203,6 +281,7 @@ def update_dataset():
 
 @app.route('/delete_dataset', methods=['POST'])
 @token_required
+@with_deadline(REQUEST_DEADLINE_WRITE)
 def delete_dataset():
     '''
     Document the deletion of an existing dataset in the Lineage Information Store.
@@ -227,6 +306,7 @@ def delete_dataset():
 
 @app.route('/delete_family_tree', methods=['POST'])
 @token_required
+@with_deadline(REQUEST_DEADLINE_BULK)
 def delete_ft():
     '''
     Document the deletion of the entire family tree of an existing dataset in the Lineage Information Store.
@@ -251,15 +331,22 @@ def delete_ft():
 
 @app.route('/get_dataset_history', methods=['GET'])
 @token_required
-def get_dataset_history():
+@with_deadline(REQUEST_DEADLINE_READ)
+async def get_dataset_history():
     '''
     Get the complete operation history associated with a dataset from the Lineage Information Store.
     '''
     uuid = request.args.get('uuid', None)
     user_group = request.args.get('user_group', None)
+    limit, cursor = get_page_args('GET_DATASET_HISTORY')
 
     if uuid is not None:
-        result = get_history_dataset(uuid, user_group)
+        etag = make_etag(await get_dataset_history_revision_async(uuid))
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+
+        result = await get_history_dataset_async(uuid, user_group, limit=limit, cursor=cursor)
         app.logger.info(
             'SUCCESS - GET_DATASET_HISTORY'
             )
@@ -273,17 +360,23 @@ def get_dataset_history():
             400
         )
 
-    return jsonify(result)
+    return with_etag(jsonify(result), etag)
 
 @app.route('/get_user_history', methods=['GET'])
 @token_required
+@with_deadline(REQUEST_DEADLINE_READ)
 def get_user_history():
     '''
     Get the complete history of performed operations associated with a user from the Lineage Information Store.
     '''
     username = request.args.get('username')
+    limit, cursor = get_page_args('GET_USER_HISTORY')
     if username is not None:
-        result = get_history_user(username)
+        if limit is not None:
+            result = jsonify(get_history_user(username, limit, cursor))
+        else:
+            # The full history is streamed, as heavy users can have hundreds of thousands of operations
+            result = Response(stream_history_user(username), mimetype='application/json')
         app.logger.info(
             'SUCCESS - GET_USER_HISTORY'
         )
@@ -297,17 +390,18 @@ def get_user_history():
             400
         )
 
-    return jsonify(result)
+    return result
 
 @app.route('/get_dataset_status', methods=['GET'])
 @token_required
-def get_dataset_status():
+@with_deadline(REQUEST_DEADLINE_READ)
+async def get_dataset_status():
     '''
     Get the last operation performed on dataset from the Lineage Information Store.
     '''
     uuid = request.args.get('uuid')
     if uuid is not None:
-        result = get_history_dataset(uuid, only_status=True)
+        result = await get_history_dataset_async(uuid, only_status=True)
         app.logger.info(
             'SUCCESS - GET_DATASET_STATUS'
             )
@@ -324,14 +418,15 @@ def get_dataset_status():
 
 @app.route('/get_dataset_num_operations', methods=['GET'])
 @token_required
-def get_dataset_num_operations():
+@with_deadline(REQUEST_DEADLINE_READ)
+async def get_dataset_num_operations():
     '''
     Count the number of create, read, update, and delete operations performed on a dataset 
     from the Lineage Information Store.
     '''
     uuid = request.args.get('uuid')
     if uuid is not None:
-        result = get_num_operations_dataset(uuid)
+        result = await get_num_operations_dataset_async(uuid)
         app.logger.info(
             'SUCCESS - GET_DATASET_NUM_OPERATIONS'
             )
@@ -348,12 +443,18 @@ def get_dataset_num_operations():
 
 @app.route('/get_dataset_lineage', methods=['GET'])
 @token_required
+@with_deadline(REQUEST_DEADLINE_READ)
 def get_dataset_lineage():
     '''
     Get the complete lineage of a dataset from the Lineage Information Store.
     '''
     uuid = request.args.get('uuid')
     if uuid is not None:
+        etag = make_etag(get_lineage_revision(uuid))
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+
         result = get_lineage_by_uuid(uuid)
         app.logger.info(
             'SUCCESS - GET_DATASET_LINEAGE'
@@ -368,21 +469,26 @@ def get_dataset_lineage():
             400
         )
 
-    return jsonify(result)
+    return with_etag(jsonify(result), etag)
 
 @app.route('/get_dataset_family_tree', methods=['GET'])
 @token_required
-def get_dataset_family_tree():
+@with_deadline(REQUEST_DEADLINE_READ)
+async def get_dataset_family_tree():
     '''
     Get the complete family tree of a dataset from the Lineage Information Store.
     '''
     uuid = request.args.get('uuid')
     if uuid is not None:
-        ft = get_family_tree(uuid)
-        app.logger.info(
-            'GET_DATASET_FAMILY_TREE - WITHOUT VERSIONS: %s', ft
-            )
-        ft_versions = add_versioning(ft)
+        revision = await get_family_tree_revision_async(uuid)
+        etag = make_etag(revision)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+
+        # Versioned trees are cached per family together with their revision, so the body
+        # is never older than the ETag, even if another process wrote to the family
+        ft_versions = await get_versioned_family_tree_async(uuid, revision)
         app.logger.info(
             'GET_DATASET_FAMILY_TREE - WITH VERSIONS: %s', ft_versions
             )
@@ -399,11 +505,100 @@ def get_dataset_family_tree():
             400
         )
     
-    return jsonify(ft_versions)
+    return with_etag(jsonify(ft_versions), etag)
+
+@app.route('/get_dataset_descendants', methods=['GET'])
+@token_required
+@with_deadline(REQUEST_DEADLINE_READ)
+async def get_dataset_descendants():
+    '''
+    Get the datasets derived, directly or transitively, from a dataset from the Lineage Information Store.
+    '''
+    uuid = request.args.get('uuid')
+    max_depth = request.args.get('max_depth', None)
+    if max_depth is not None:
+        try:
+            max_depth = int(max_depth)
+        except ValueError:
+            max_depth = 0
+
+    if uuid is not None and (max_depth is None or max_depth >= 1):
+        result = await get_dataset_descendants_async(uuid, max_depth)
+        app.logger.info(
+            'SUCCESS - GET_DATASET_DESCENDANTS'
+            )
+    else:
+        app.logger.error(
+            'ERROR - GET_DATASET_DESCENDANTS - The shape of the provided arguments is faulty!'
+        )
+        raise CustomError(
+            'The shape of the provided arguments is faulty!',
+            'Lineage Tracker Backend',
+            400
+        )
+
+    return jsonify(result)
+
+@app.route('/is_derived_from', methods=['GET'])
+@token_required
+@with_deadline(REQUEST_DEADLINE_READ)
+async def is_derived_from():
+    '''
+    Check whether a dataset was derived, directly or transitively, from another dataset.
+    '''
+    ancestor = request.args.get('ancestor')
+    descendant = request.args.get('descendant')
+    if ancestor is not None and descendant is not None:
+        result = {
+            'ancestor': ancestor,
+            'descendant': descendant,
+            'is_derived_from': await is_derived_from_async(ancestor, descendant)
+        }
+        app.logger.info(
+            'SUCCESS - IS_DERIVED_FROM'
+            )
+    else:
+        app.logger.error(
+            'ERROR - IS_DERIVED_FROM - The shape of the provided arguments is faulty!'
+        )
+        raise CustomError(
+            'The shape of the provided arguments is faulty!',
+            'Lineage Tracker Backend',
+            400
+        )
+
+    return jsonify(result)
+
+@app.route('/get_common_ancestor', methods=['GET'])
+@token_required
+@with_deadline(REQUEST_DEADLINE_READ)
+async def get_common_ancestor():
+    '''
+    Get the nearest dataset two datasets were both derived from.
+    '''
+    uuid_1 = request.args.get('uuid_1')
+    uuid_2 = request.args.get('uuid_2')
+    if uuid_1 is not None and uuid_2 is not None:
+        result = await get_common_ancestor_async(uuid_1, uuid_2)
+        app.logger.info(
+            'SUCCESS - GET_COMMON_ANCESTOR'
+            )
+    else:
+        app.logger.error(
+            'ERROR - GET_COMMON_ANCESTOR - The shape of the provided arguments is faulty!'
+        )
+        raise CustomError(
+            'The shape of the provided arguments is faulty!',
+            'Lineage Tracker Backend',
+            400
+        )
+
+    return jsonify(result)
 
 @app.route('/get_datasets_diff', methods=['GET'])
 @token_required
-def get_datasets_diff():
+@with_deadline(REQUEST_DEADLINE_BULK)
+async def get_datasets_diff():
     '''
     Get the diff of two datasets from the Factory Data Storage.
     '''
@@ -411,7 +606,7 @@ def get_datasets_diff():
     uuid_2 = request.args.get('uuid_2')
     if uuid_1 is not None and uuid_2 is not None:
         
-        result = get_diff_datasets(uuid_1, uuid_2)
+        result = await get_diff_datasets_async(uuid_1, uuid_2)
 
         app.logger.info(
             'SUCCESS - GET_DATASETS_DIFF - %s', result
@@ -428,5 +623,33 @@ def get_datasets_diff():
     
     return jsonify(result)
 
+@app.route('/get_metrics', methods=['GET'])
+@token_required
+def get_service_metrics():
+    '''
+    Get the hit/miss counters of the Lineage Tracker's caches.
+    '''
+    result = get_metrics()
+    result['authorization_cache'] = authorization_cache.stats()
+    app.logger.info(
+        'SUCCESS - GET_METRICS'
+    )
+
+    return jsonify(result)
+
+def warm_known_datasets():
+    '''
+    Loads the identifiers of all datasets into the filter used by create validation
+    Until it succeeds, create validation queries the store for every dataset
+    '''
+    try:
+        load_known_datasets()
+    except CustomError as e:
+        logger.error(
+            'ERROR - LOAD_KNOWN_DATASETS - %s', e.message
+        )
+
 if __name__ == '__main__':
+    # Loaded in the background, so the service answers requests while the store is scanned
+    threading.Thread(target=warm_known_datasets, daemon=True).start()
     app.run(debug=True, host='0.0.0.0', port=8080)
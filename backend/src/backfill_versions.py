@@ -0,0 +1,53 @@
+'''
+One-off backfill of the version labels of datasets written before labels were stored.
+
+Every family is relabelled with versioning.add_versioning, and only labels that are
+missing or differ are written, so the command can be re-run safely.
+
+Usage (from backend/src/): python backfill_versions.py [--page-size 1000]
+'''
+
+import argparse
+import logging
+
+from logic_layer import relabel_family
+from tools.error_handler import CustomError
+from tools.sparql.wrapper import select_family_ids_SPARQL_rows
+
+logger = logging.getLogger('backfill_versions')
+
+
+def family_ids(page_size:int):
+    '''
+    Yields all family ids in the store, page_size at a time
+    '''
+    after = ''
+    while True:
+        page = [row['familyId'] for row in select_family_ids_SPARQL_rows(page_size, after)]
+        yield from page
+        if len(page) < page_size:
+            return
+        after = page[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page-size', type=int, default=1000, help='family ids read per query')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    families = 0
+    labels = 0
+    for family_id in family_ids(args.page_size):
+        try:
+            labels += relabel_family(family_id)
+        except CustomError as e:
+            logger.error('%s - %s', family_id, e.message)
+            continue
+        families += 1
+
+    print(f'{families} families checked, {labels} version labels written')
+
+
+if __name__ == '__main__':
+    main()
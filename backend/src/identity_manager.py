@@ -2,11 +2,13 @@
 
 import logging
 
-import uuid, requests,json, os
+import uuid, requests,json, os, hashlib, time
 from flask import make_response,jsonify
 from functools import lru_cache
 from dataclasses import dataclass
 import jwt
+from tools.cache import LRUCache
+from tools.error_handler import CustomError
 
 logger = logging.getLogger('identity_manager')
 
@@ -14,6 +16,24 @@ KEYCLOAK_URL = os.getenv('KEYCLOAK', 'https://auth.pistis-market.eu/auth/realms/
 AUTHENTICATION_ID = os.getenv('LINEAGE_TRACKER_ID', 'pistis-test-only')
 AUTHENTICATION_SECRET = os.getenv('LINEAGE_TRACKER_SECRET', 'DYuAlXn8kC1SVzFiYgApfjcodZhdxreL')
 
+AUTHORIZATION_CACHE_SIZE = int(os.getenv('AUTHORIZATION_CACHE_SIZE', '10000'))
+# Upper bound on how long a granted token is trusted without asking Keycloak again (e.g. after a revocation)
+AUTHORIZATION_CACHE_MAX_TTL = float(os.getenv('AUTHORIZATION_CACHE_MAX_TTL', '300'))
+
+# sha256 of the access token -> True, for tokens Keycloak authorized, until the token expires
+authorization_cache = LRUCache(AUTHORIZATION_CACHE_SIZE)
+
+# 'keycloak' asks Keycloak to authorize every token, 'local' verifies tokens in-process against the realm's JWKS
+TOKEN_VERIFICATION = os.getenv('TOKEN_VERIFICATION', 'keycloak')
+KEYCLOAK_JWKS_URL = os.getenv('KEYCLOAK_JWKS_URL', KEYCLOAK_URL.rsplit('/', 1)[0] + '/certs')
+KEYCLOAK_ISSUER = os.getenv('KEYCLOAK_ISSUER', KEYCLOAK_URL.split('/protocol/')[0])
+KEYCLOAK_AUDIENCE = os.getenv('KEYCLOAK_AUDIENCE', 'resource-server')
+JWKS_CACHE_LIFESPAN = int(os.getenv('JWKS_CACHE_LIFESPAN', '3600'))
+
+# The key set is fetched on first use and kept for JWKS_CACHE_LIFESPAN seconds;
+# a token signed with an unknown kid triggers one refetch, so rotated keys are picked up
+jwks_client = jwt.PyJWKClient(KEYCLOAK_JWKS_URL, cache_jwk_set=True, lifespan=JWKS_CACHE_LIFESPAN)
+
 @dataclass
 class IdentityManager():
     content_type: str
@@ -83,4 +103,62 @@ class IdentityManagerApi():
             
             ## TODO: Check for ids in authorization and check if the permission matches 
         
-        return response
\ No newline at end of file
+        return response
+
+    def is_authorized(self, keycloak_object, access_token) -> bool:
+        '''
+        Returns whether Keycloak authorizes the access token
+        Granted tokens are cached until their exp claim, for at most AUTHORIZATION_CACHE_MAX_TTL seconds
+        In 'local' TOKEN_VERIFICATION mode the token is verified in-process instead
+        '''
+        if TOKEN_VERIFICATION == 'local':
+            return self.verify_token(access_token)
+
+        key = hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+        if authorization_cache.get(key):
+            return True
+
+        response = self.user_account_authorize(keycloak_object, access_token)
+        if response.status_code != 200:
+            return False
+
+        ttl = min(token_lifetime(access_token), AUTHORIZATION_CACHE_MAX_TTL)
+        if ttl > 0:
+            authorization_cache.set(key, True, ttl=ttl)
+        return True
+
+    def verify_token(self, access_token) -> bool:
+        '''
+        Verifies signature, issuer, audience and expiry of the access token against the realm's JWKS
+        '''
+        try:
+            signing_key = jwks_client.get_signing_key_from_jwt(access_token)
+            jwt.decode(
+                access_token,
+                signing_key.key,
+                algorithms=['RS256'],
+                audience=KEYCLOAK_AUDIENCE,
+                issuer=KEYCLOAK_ISSUER,
+                options={'require': ['exp', 'iss', 'aud']}
+            )
+        except jwt.PyJWKClientConnectionError as e:
+            logger.error("JWKS could not be fetched - %s", e)
+            raise CustomError(
+                'Token verification keys are unavailable.',
+                'Lineage Tracker Backend',
+                503
+            )
+        except jwt.PyJWTError as e:
+            logger.debug("Token rejected - %s", e)
+            return False
+        return True
+
+def token_lifetime(access_token) -> float:
+    '''
+    Returns the seconds until the exp claim of the access token (0 if it has none or cannot be decoded)
+    '''
+    try:
+        claims = jwt.decode(access_token, options={"verify_signature": False})
+        return float(claims['exp']) - time.time()
+    except (jwt.PyJWTError, KeyError, TypeError, ValueError):
+        return 0
@@ -2,36 +2,88 @@
 This 
 '''
 
+import asyncio
+import io
 import logging
-import numpy as np
 import os
 import pandas as pd
-import time
+import tempfile
 import uuid as uuid_generator
 from csv_diff import load_csv, compare
-from datetime import datetime
 from flask import jsonify
 from json import dumps, loads
 import requests
 
 from collections import Counter
+from tools.cache import LRUCache
+from tools.deadline import DeadlineExceeded, check_deadline, current_deadline, deadline_at, deadline_timeout
+from tools.disk_cache import DiskCache
 from tools.error_handler import CustomError
-from tools.rdf.graph_builder import namespaces, Dataset, Operation, User, Document
-
-from tools.sparql.wrapper import insert_SPARQL, select_lineage_by_lineage_id_SPARQL, \
-    select_dataset_history_by_uuid_SPARQL, select_user_history_by_uuid_SPARQL
+from tools.pagination import decode_cursor, paginate
+from tools.single_flight import SingleFlight
+from tools.rdf.graph_builder import Dataset, Operation, User
+from tools.rdf.triple_builder import TripleDocument
+from versioning import ROOT_VERSION, FamilyTree, add_versioning, child_version, create_family_structure
+
+from tools.sparql.wrapper import async_client, insert_SPARQL, insert_batch_SPARQL, select_lineage_by_lineage_id_SPARQL, \
+    select_user_history_by_uuid_SPARQL_rows, select_family_tree_by_family_id_SPARQL, \
+    select_dataset_history_by_uuid_SPARQL_async, select_family_tree_by_family_id_SPARQL_async, replace_versions_SPARQL, \
+    get_dataset_history_revision_SPARQL_async, get_lineage_revision_SPARQL, get_family_revision_SPARQL_async, \
+    select_descendants_by_uuid_SPARQL_async
 from tools.operation_validator import validate_update, validate_create, validate_read, \
-    validate_delete, validate_delete_family_tree, check_lineage_node, get_lineage_id_by_uuid, get_family_id, \
-    get_lineage_ids_by_family_id, get_name_by_uuid, get_family_uuids_by_uuid
+    validate_delete, validate_delete_family_tree, get_lineage_id_by_uuid, \
+    get_family_metadata_by_uuid, get_dataset_metadata, validate_create_async, get_family_id_async, \
+    cache_dataset_metadata, metadata_cache, add_known_dataset, known_datasets_stats
 
 FDS_API_URL = 'https://develop.pistis-market.eu/srv/factory-data-storage'
 FDS_API_KEY = os.getenv('FDS_API_KEY', '')
 LT_API_KEY = os.getenv('LT_API_KEY', '')
 CLIENT_ID = os.getenv('CLIENT_ID', 'client_id')
 CLIENT_SECRET = os.getenv('CLIENT_SECRET', 'client_secret')
+# Maximum number of delete operations sent in one INSERT DATA request by delete_family_tree
+DELETE_FAMILY_TREE_CHUNK_SIZE = int(os.getenv('DELETE_FAMILY_TREE_CHUNK_SIZE', '250'))
+
+FAMILY_TREE_CACHE_SIZE = int(os.getenv('FAMILY_TREE_CACHE_SIZE', '1000'))
+FAMILY_TREE_CACHE_TTL = float(os.getenv('FAMILY_TREE_CACHE_TTL', '300'))
+
+FDS_TABLE_CACHE_DIR = os.getenv('FDS_TABLE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'lineage-tracker-fds-tables'))
+FDS_TABLE_CACHE_MAX_BYTES = int(os.getenv('FDS_TABLE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+DIFF_CACHE_DIR = os.getenv('DIFF_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'lineage-tracker-diffs'))
+DIFF_CACHE_MAX_BYTES = int(os.getenv('DIFF_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+# Number of values in the keyset pagination sort keys (see dataset_history_key and user_history_key)
+DATASET_HISTORY_KEY_SIZE = 3
+USER_HISTORY_KEY_SIZE = 2
 
 logger = logging.getLogger('logic_layer')
 
+# family_id -> (revision the tree was read at, versioned family tree)
+# Entries are invalidated by the writes of this process; the ttl bounds how long
+# writes made through other processes can go unnoticed
+family_tree_cache = LRUCache(FAMILY_TREE_CACHE_SIZE, ttl=FAMILY_TREE_CACHE_TTL)
+# Incremented on every invalidation, so a tree computed concurrently with a write is not cached
+family_tree_cache_generation = 0
+# family_id -> FamilyTree of the versioned family tree, indexed for ancestry queries (see versioning.FamilyTree)
+# Entries are invalidated together with family_tree_cache
+family_structure_cache = LRUCache(FAMILY_TREE_CACHE_SIZE, ttl=FAMILY_TREE_CACHE_TTL)
+
+# asset uuid -> Factory Data Storage table response, used by get_diff_datasets_async
+fds_table_cache = DiskCache(FDS_TABLE_CACHE_DIR, FDS_TABLE_CACHE_MAX_BYTES)
+# JSON [uuid_1, uuid_2] -> result of get_diff_datasets_async; dataset versions are immutable, so diffs never change
+diff_cache = DiskCache(DIFF_CACHE_DIR, DIFF_CACHE_MAX_BYTES)
+
+# Identical concurrent calls of the read functions behind the GET endpoints share one computation
+read_flights = SingleFlight()
+
+def invalidate_family_tree(family_id:str):
+    '''
+    Removes the cached family tree of family_id, after one of its datasets was written
+    '''
+    global family_tree_cache_generation
+    family_tree_cache_generation += 1
+    family_tree_cache.delete(family_id)
+    family_structure_cache.delete(family_id)
+
 def create(username:str, user_group:str, uuid:str, dataset_name:str) -> str:
     '''
     Validates create action and appends to rdf graph
@@ -40,7 +92,7 @@ def create(username:str, user_group:str, uuid:str, dataset_name:str) -> str:
     family_id = str(uuid_generator.uuid4())
     
     # checking if the dataset does not already exist
-    if validate_create(uuid):
+    if validate_create(uuid, use_known_datasets=True):
         logger.info(
             'CREATE - CONDITION FULFILLED'
         )
@@ -56,8 +108,10 @@ def create(username:str, user_group:str, uuid:str, dataset_name:str) -> str:
         # Abstract document object, which is being independently created for each CRUD operation. 
         # It can be seen as a sub-graph,
         # which is subsequently being extended to the overarching RDF graph
-        document = Document(namespaces, user, dataset, operation)
+        document = TripleDocument(user, dataset, operation, version=ROOT_VERSION)
         insert_SPARQL(document)
+        add_known_dataset(uuid)
+        cache_dataset_metadata(uuid, dataset_name, lineage_id, family_id)
 
         return 'Creation of the dataset successfully documented.'
     else:
@@ -75,15 +129,16 @@ def read(username:str, user_group:str, uuid:str) -> str:
     Validates read action and appends to rdf graph
     '''
     # Checks if uuid exists and is not deleted
-    update_conditions = validate_read(uuid)
+    metadata = get_dataset_metadata(uuid, with_children=False)
+    update_conditions = validate_read(uuid, metadata)
     if sum(list(update_conditions.values())) == 2:
         logger.info(
             'READ - CONDITIONS FULFILLED'
         )
         
-        dataset_name = get_name_by_uuid(uuid)
-        lineage_id = get_lineage_id_by_uuid(uuid)
-        family_id = get_family_id(uuid)
+        dataset_name = metadata['name']
+        lineage_id = metadata['lineage_id']
+        family_id = metadata['family_id']
 
         logger.debug(
             'READ - LINEAGE_ID: %s', lineage_id
@@ -105,7 +160,7 @@ def read(username:str, user_group:str, uuid:str) -> str:
             involved_user=user
         )
 
-        document = Document(namespaces, user, dataset, operation)
+        document = TripleDocument(user, dataset, operation)
         
         insert_SPARQL(document)
 
@@ -136,19 +191,21 @@ def update(username:str, user_group:str, uuid:str, uuid_prev:str, update_descrip
     Validates update action and appends to rdf graph
     '''
     # Checks if uuid_prev exists and is not deleted
-    update_conditions = validate_update(uuid_prev)
+    metadata = get_dataset_metadata(uuid_prev)
+    update_conditions = validate_update(uuid_prev, metadata)
     if sum(list(update_conditions.values())) == 2:
         logger.info(
             'UPDATE - CONDITIONS FULFILLED'
             )
         
-        dataset_name = get_name_by_uuid(uuid_prev)
-        lineage_id_prev = get_lineage_id_by_uuid(uuid_prev)
-        family_id = get_family_id(uuid_prev)
+        dataset_name = metadata['name']
+        lineage_id_prev = metadata['lineage_id']
+        family_id = metadata['family_id']
         
         # checking if the family tree of the dataset splits
+        # (i.e., a dataset already wasDerivedFrom uuid_prev)
         # If yes, a new lineage_id is being assigned
-        if check_lineage_node(uuid_prev):
+        if metadata['has_children']:
             logger.info(
                 'UPDATE - LINEAGE SPLIT DETECTED'
             )
@@ -180,8 +237,30 @@ def update(username:str, user_group:str, uuid:str, uuid_prev:str, update_descrip
             involved_dataset=dataset, 
             involved_user=user
         )
-        document = Document(namespaces, user, dataset, operation, dataset_prev)
+        # Siblings are ordered by timestamp, so the new dataset is the last child of uuid_prev
+        # Unlabelled (not yet backfilled) families stay unlabelled and are versioned when read
+        version = None
+        if metadata['version'] is not None:
+            version = child_version(metadata['version'], metadata['num_children'], metadata['num_children'] + 1)
+
+        document = TripleDocument(user, dataset, operation, dataset_prev, version=version)
         insert_SPARQL(document)
+        add_known_dataset(uuid)
+        cache_dataset_metadata(uuid, dataset_name, lineage_id, family_id)
+
+        # An only child becomes the first of two siblings, which changes the labels of its subtree
+        # The update is documented at this point, so a failed relabel must not fail it; the stored
+        # labels are then no valid labelling (see consistent_versions) and reads compute them instead,
+        # until the family is relabelled
+        try:
+            if version is not None and metadata['num_children'] == 1:
+                relabel_family(family_id)
+        except Exception as e:
+            logger.error(
+                'UPDATE - RELABEL_FAMILY FAILED - %s:\n\n%s', family_id, e
+            )
+        finally:
+            invalidate_family_tree(family_id)
 
         return 'updating the dataset successfully documented.'
 
@@ -214,16 +293,17 @@ def delete(username:str, user_group:str, uuid:str) -> str:
     
     # Checks if uuid exists, is not deleted, and 
     # no other dataset wasDerivedFrom this one
-    delete_conditions = validate_delete(uuid)
+    metadata = get_dataset_metadata(uuid)
+    delete_conditions = validate_delete(uuid, metadata)
     if sum(list(delete_conditions.values())) == 3:
 
         logger.info(
             'DELETE - CONDITIONS FULFILLED'
         )
 
-        dataset_name = get_name_by_uuid(uuid)
-        lineage_id = get_lineage_id_by_uuid(uuid)
-        family_id = get_family_id(uuid)
+        dataset_name = metadata['name']
+        lineage_id = metadata['lineage_id']
+        family_id = metadata['family_id']
 
         logger.debug(
             'DELETE - LINEAGE_ID: %s', lineage_id
@@ -240,9 +320,10 @@ def delete(username:str, user_group:str, uuid:str) -> str:
             involved_user=user
         )
 
-        document = Document(namespaces, user, dataset, operation)
+        document = TripleDocument(user, dataset, operation)
 
         insert_SPARQL(document)
+        invalidate_family_tree(family_id)
 
         return 'Dataset successfully deleted.'
     else:
@@ -297,36 +378,37 @@ def delete_family_tree(username:str, user_group:str, uuid:str) -> str:
             'DELETE_FAMILY_TREE - CONDITIONS FULFILLED'
         )
         
-        # Get all uuid's for that family tree
-        uuids = get_family_uuids_by_uuid(uuid)
+        # Get metadata of every dataset in that family tree with a single query
+        family = get_family_metadata_by_uuid(uuid)
+        user = User(name=username, group=user_group)
 
         # Delete every uuid in the family tree
-        for this_uuid in uuids:
-            dataset_name = get_name_by_uuid(this_uuid)
-            lineage_id = get_lineage_id_by_uuid(this_uuid)
-            family_id = get_family_id(this_uuid)
-
+        documents = []
+        for this_dataset in family:
             logger.debug(
-                'DELETE_FAMILY_TREE - FAMILY_ID: %s', family_id
+                'DELETE_FAMILY_TREE - FAMILY_ID: %s', this_dataset['family_id']
             )
             logger.debug(
-                'DELETE_FAMILY_TREE - LINEAGE_ID: %s', lineage_id
+                'DELETE_FAMILY_TREE - LINEAGE_ID: %s', this_dataset['lineage_id']
             )
             logger.debug(
-                'DELETE_FAMILY_TREE - DATASET_UUID: %s', this_uuid
+                'DELETE_FAMILY_TREE - DATASET_UUID: %s', this_dataset['uuid']
             )
 
-            dataset = Dataset(this_uuid, dataset_name, lineage_id, family_id)
-            user = User(name=username, group=user_group)
+            dataset = Dataset(this_dataset['uuid'], this_dataset['name'], this_dataset['lineage_id'], this_dataset['family_id'])
             operation = Operation(
                 type_='delete', 
                 involved_dataset=dataset, 
                 involved_user=user
             )
 
-            document = Document(namespaces, user, dataset, operation)
+            documents.append(TripleDocument(user, dataset, operation))
 
-            insert_SPARQL(document)
+        # All delete operations are inserted with one request per chunk
+        for start in range(0, len(documents), DELETE_FAMILY_TREE_CHUNK_SIZE):
+            insert_batch_SPARQL(documents[start:start + DELETE_FAMILY_TREE_CHUNK_SIZE])
+        for family_id in {this_dataset['family_id'] for this_dataset in family}:
+            invalidate_family_tree(family_id)
 
         return 'Dataset family tree successfully deleted.'
     else:
@@ -358,227 +440,368 @@ def delete_family_tree(username:str, user_group:str, uuid:str) -> str:
                         412
                     )  
 
-def get_history_dataset(uuid:str, user_group=None, only_status=False) -> dict:
+@read_flights.coalesced
+async def get_history_dataset_async(uuid:str, user_group=None, only_status=False, limit=None, cursor=None) -> dict:
     '''
     Returns the history of a dataset given its uuid
     The history refers to all operations performed on a dataset
+    If limit is provided, only the page of limit operations after cursor is returned,
+    together with the cursor of the next page
+    The existence check and the history query run concurrently
     '''
     logger.debug(
         'GET_HISTORY_DATASET - ONLY_STATUS:\n\n%s', only_status
     )
-    
+    after = decode_cursor(cursor, DATASET_HISTORY_KEY_SIZE) if limit is not None else None
+
+    not_exists, ret = await asyncio.gather(
+        validate_create_async(uuid),
+        select_dataset_history_by_uuid_SPARQL_async(uuid, user_group, page_size(limit), after)
+    )
+
     # inverse create condition -> dataset has to exist
-    if not validate_create(uuid):
+    if not not_exists:
+        return history_dataset_from_result(uuid, ret, only_status, limit)
+    else:
+        raise history_dataset_not_found(only_status)
 
-        logger.info(
-            'GET_HISTORY_DATASET - CONDITION FULFILLED'
-        )
+def history_dataset_from_result(uuid:str, ret:dict, only_status=False, limit=None) -> dict:
+    '''
+    Builds the dataset history response from the result of select_dataset_history_by_uuid_SPARQL
+    The result is already in chronological order
+    '''
+    logger.info(
+        'GET_HISTORY_DATASET - CONDITION FULFILLED'
+    )
 
-        # retrieving all the needed information with help of the SPARQL-wrapper,
-        # which is querying the PIS
-        ret = select_dataset_history_by_uuid_SPARQL(uuid, user_group)
+    logger.debug(
+        'GET_HISTORY_DATASET - RESULT:\n\n%s', ret['results']['bindings']
+    )
 
+    bindings = ret['results']['bindings']
+    next_cursor = None
+    if limit is not None:
+        bindings, next_cursor = paginate(bindings, limit, dataset_history_key)
 
-        logger.debug(
-            'GET_HISTORY_DATASET - RESULT:\n\n%s', ret['results']['bindings']
-        )
+    # creating the dictionary like response object out of the wrapper-result
+    history = []
+    for object_ in bindings:
+        entry = {
+                'operation_description': object_['operationDescription']['value'],
+                'username': object_['associatedUser']['value'],
+                'user_group': object_['associatedUserGroup']['value'],
+                'timestamp':object_['timestamp']['value']
+            }
+        
+        if 'update' in entry['operation_description']:
+            if 'previousUUID' in object_:
+                entry['from_uuid'] = object_['previousUUID']['value']
+            if 'nextUUID' in object_:
+                entry['to_uuid'] = object_['nextUUID']['value']
+            operation_description_list = entry['operation_description'].split(':')
+            if len(operation_description_list) == 2:
+                entry['operation_description'] = operation_description_list[0]
+                entry['update_description'] = operation_description_list[1]
 
-        # creating the dictionary like response object out of the wrapper-result
-        history = []
-        for object_ in ret['results']['bindings']:
-            entry = {
-                    'operation_description': object_['operationDescription']['value'],
-                    'username': object_['associatedUser']['value'],
-                    'user_group': object_['associatedUserGroup']['value'],
-                    'timestamp':object_['timestamp']['value']
-                }
-            
-            if 'update' in entry['operation_description']:
-                if 'previousUUID' in object_:
-                    entry['from_uuid'] = object_['previousUUID']['value']
-                if 'nextUUID' in object_:
-                    entry['to_uuid'] = object_['nextUUID']['value']
-                operation_description_list = entry['operation_description'].split(':')
-                if len(operation_description_list) == 2:
-                    entry['operation_description'] = operation_description_list[0]
-                    entry['update_description'] = operation_description_list[1]
-
-            history.append(entry)
-
-        # sorting the collected events by date to make them chronological
-        timestamps = [time.mktime(datetime.strptime(entry['timestamp'], '%Y-%m-%d %H:%M:%S').timetuple()) for entry in history]
-        chronology = np.argsort(timestamps)
-        history = np.array(history)[chronology].tolist()
+        history.append(entry)
 
-        logger.debug(
-            'GET_HISTORY_DATASET - HISTORY:\n\n%s', history
-        )
+    logger.debug(
+        'GET_HISTORY_DATASET - HISTORY:\n\n%s', history
+    )
 
-        if only_status:
-            last_operation = history[-1:][0]
-            
-            return {
-                uuid: last_operation
-            }
+    if only_status:
+        last_operation = history[-1:][0]
         
-        else:
-            return {
-                uuid: history
-                }
+        return {
+            uuid: last_operation
+        }
     
+    elif limit is not None:
+        return {
+            uuid: history,
+            'next_cursor': next_cursor
+            }
+
     else:
-        if only_status:
-            raise CustomError(
-                'Dataset status cannot be shown, because the specified dataset does not exist.',
-                'Lineage Tracker Backend',
-                412
-            )
-        else:
-            raise CustomError(
-                'Dataset history cannot be shown, because the specified dataset does not exist.',
-                'Lineage Tracker Backend',
-                412
-            )
+        return {
+            uuid: history
+            }
 
-def get_num_operations_dataset(uuid:str) -> dict:
+def dataset_history_key(binding:dict) -> list:
+    '''
+    Returns the sort key (timestamp, operation, nextUUID) of a dataset history binding
+    '''
+    return [
+        binding['timestamp']['value'],
+        binding['operation']['value'],
+        binding['nextUUID']['value'] if 'nextUUID' in binding else ''
+    ]
+
+def page_size(limit):
+    '''
+    Returns the number of rows to query for a page of limit rows
+    One extra row is queried to find out whether there is a next page
+    '''
+    return limit + 1 if limit is not None else None
+
+def history_dataset_not_found(only_status=False) -> CustomError:
+    '''
+    Returns the error raised when the history of a non-existing dataset is requested
+    '''
+    if only_status:
+        return CustomError(
+            'Dataset status cannot be shown, because the specified dataset does not exist.',
+            'Lineage Tracker Backend',
+            412
+        )
+    else:
+        return CustomError(
+            'Dataset history cannot be shown, because the specified dataset does not exist.',
+            'Lineage Tracker Backend',
+            412
+        )
+
+async def get_num_operations_dataset_async(uuid:str) -> dict:
     '''
     Returns the number of create, read, update, and delete operations 
     performed on a dataset given its uuid
+    The existence check and the history query run concurrently
     '''
+    not_exists, ret = await asyncio.gather(
+        validate_create_async(uuid),
+        select_dataset_history_by_uuid_SPARQL_async(uuid)
+    )
+
     # inverse create condition -> dataset has to exist
-    if not validate_create(uuid):
+    if not not_exists:
 
         logger.info(
             'GET_NUM_OPERATIONS_DATASET - CONDITION FULFILLED'
         )
 
-        # Get the dataset history
-        result = get_history_dataset(uuid)
+        result = history_dataset_from_result(uuid, ret)
+        return num_operations_from_history(uuid, result)
 
-        logger.info(
-            'GET_NUM_OPERATIONS_DATASET - DATASET HISTORY - RESULT: \n%s', result
-        )
+    else:
+        raise num_operations_not_found()
 
-        logger.info(
-            'GET_NUM_OPERATIONS_DATASET - DATASET HISTORY - RESULT[UUID]: \n%s', result[uuid]
-        )
+def num_operations_from_history(uuid:str, result:dict) -> dict:
+    '''
+    Counts the create, read, update and delete operations of a dataset history
+    '''
+    logger.info(
+        'GET_NUM_OPERATIONS_DATASET - DATASET HISTORY - RESULT: \n%s', result
+    )
 
-        # Get the number of operations for create, read, update, delete
-        operation_descriptions = [r['operation_description'] for r in result[uuid]]
-        counts = loads(dumps(Counter(operation_descriptions)))
-        
-        # Ensure create, read, update, delete are in counts
-        for operation in ['create', 'read', 'update', 'delete']:
-            if counts.get(operation) is None:
-                counts[operation] = 0
+    logger.info(
+        'GET_NUM_OPERATIONS_DATASET - DATASET HISTORY - RESULT[UUID]: \n%s', result[uuid]
+    )
 
-        logger.debug(
-            'GET_NUM_OPERATIONS_DATASET - COUNTS:\n\n%s', counts
-        )
+    # Get the number of operations for create, read, update, delete
+    operation_descriptions = [r['operation_description'] for r in result[uuid]]
+    counts = loads(dumps(Counter(operation_descriptions)))
+    
+    # Ensure create, read, update, delete are in counts
+    for operation in ['create', 'read', 'update', 'delete']:
+        if counts.get(operation) is None:
+            counts[operation] = 0
 
-        return {
-            uuid: counts
-            }
+    logger.debug(
+        'GET_NUM_OPERATIONS_DATASET - COUNTS:\n\n%s', counts
+    )
 
-    else:
-        raise CustomError(
-            "Dataset's number of operations cannot be shown, because the specified dataset does not exist.",
-            "Lineage Tracker Backend",
-            412
-        )
+    return {
+        uuid: counts
+        }
 
-def get_diff_datasets(uuid_1:str, uuid_2:str) -> dict:
+def num_operations_not_found() -> CustomError:
+    '''
+    Returns the error raised when the operations of a non-existing dataset are counted
+    '''
+    return CustomError(
+        "Dataset's number of operations cannot be shown, because the specified dataset does not exist.",
+        "Lineage Tracker Backend",
+        412
+    )
+
+async def get_diff_datasets_async(uuid_1:str, uuid_2:str) -> dict:
     '''
     Returns the datasets uuid_1, uuid_2, and 
     the diff between the two datasets
+    Both existence checks and both Factory Data Storage downloads run concurrently
     '''
+    cached = cached_diff(uuid_1, uuid_2)
+    downloads = () if cached is not None else (
+        async_client.run(fetch_dataset, uuid_1, 'dataset 1'),
+        async_client.run(fetch_dataset, uuid_2, 'dataset 2'),
+    )
+    not_exists_1, not_exists_2, *datasets = await asyncio.gather(
+        validate_create_async(uuid_1),
+        validate_create_async(uuid_2),
+        *downloads,
+        return_exceptions=True
+    )
+
+    # Store errors take precedence, then the existence conditions, then download errors
+    for result in (not_exists_1, not_exists_2):
+        if isinstance(result, BaseException):
+            raise result
+
     # inverse create condition -> datasets have to exist
-    if not validate_create(uuid_1) and not validate_create(uuid_2):
+    if not not_exists_1 and not not_exists_2:
 
         logger.info(
             'GET_DIFF_DATASETS - CONDITION FULFILLED'
         )
 
-        # Retrieve datasets from factory data storage, save to csv
-        headers = {'Authorization': FDS_API_KEY}
+        if cached is not None:
+            return cached
 
-        # Dataset 1
-        data = {
-            "asset_uuid": uuid_1,
-            "JSON_output": True
-        }
-        response = requests.get(f'{FDS_API_URL}/api/tables/get_table', params=data, headers=headers)
-        if response.status_code != 200:
-            logger.error(
-                'GET_DATASETS_DIFF - Error retrieving dataset 1 - %s', response.text
-            )
-            raise CustomError(
-                "Failed to retrieve dataset 1.",
-                "Lineage Tracker Backend",
-                response.status_code
-            )
+        for result in datasets:
+            if isinstance(result, BaseException):
+                raise result
 
-        dataset_1 = loads(response.text)
-        dataset_1_key = dataset_to_csv(dataset_1, 'diff_csv/dataset_1.csv')
-        logger.info(
-            'GET_DATASETS_DIFF - dataset_1 - %s', dataset_1
-        )
+        result = diff_datasets(*datasets)
+        cache_diff(uuid_1, uuid_2, result)
+        return result
 
-        # Dataset 2
-        data = {
-            "asset_uuid": uuid_2,
-            "JSON_output": True
-        }
-        response = requests.get(f'{FDS_API_URL}/api/tables/get_table', params=data, headers=headers)
-        if response.status_code != 200:
-            logger.error(
-                'GET_DATASETS_DIFF - Error retrieving dataset 2 - %s', response.text
-            )
-            raise CustomError(
-                "Failed to retrieve dataset 2.",
-                "Lineage Tracker Backend",
-                response.status_code
-            )
-        logger.info(
-            'GET_DATASETS_DIFF - response_2 - %s', response
-        )
-        dataset_2 = loads(response.text)
-        dataset_2_key = dataset_to_csv(dataset_2, 'diff_csv/dataset_2.csv')
-        logger.info(
-            'GET_DATASETS_DIFF - dataset_2 - %s', dataset_2
-        )
+    else:
+        raise diff_datasets_not_found()
 
-        # Calculate diff of two datasets
-        diff = compare(
-            load_csv(open("diff_csv/dataset_1.csv"), key=dataset_1_key),
-            load_csv(open("diff_csv/dataset_2.csv"), key=dataset_2_key)
-        )
+def cached_diff(uuid_1:str, uuid_2:str) -> dict:
+    '''
+    Returns the cached result of get_diff_datasets_async for uuid_1 and uuid_2, or None if there is none
+    The result of the reversed pair is inverted if only that one is cached
+    '''
+    cached = diff_cache.get(dumps([uuid_1, uuid_2]))
+    if cached is not None:
+        return loads(cached)
 
-        # Delete from csv
-        os.remove("diff_csv/dataset_1.csv")
-        os.remove("diff_csv/dataset_2.csv")
+    cached = diff_cache.get(dumps([uuid_2, uuid_1]))
+    if cached is not None:
+        return invert_diff(loads(cached))
 
-        result = {
-            'dataset_1': dataset_1,
-            'dataset_2': dataset_2,
-            'diff': diff,
-        }
-        logger.info(
-            'GET_DATASETS_DIFF - result - %s', result
-        )
+    return None
 
-        return result
+def cache_diff(uuid_1:str, uuid_2:str, result:dict):
+    '''
+    Caches the result of get_diff_datasets_async for uuid_1 and uuid_2
+    '''
+    diff_cache.set(dumps([uuid_1, uuid_2]), dumps(result).encode('utf-8'))
 
-    else:
+def invert_diff(result:dict) -> dict:
+    '''
+    Turns the diff of dataset_1 to dataset_2 into the diff of dataset_2 to dataset_1
+    '''
+    diff = result['diff']
+    return {
+        'dataset_1': result['dataset_2'],
+        'dataset_2': result['dataset_1'],
+        'diff': {
+            'added': diff['removed'],
+            'removed': diff['added'],
+            'changed': [
+                {
+                    'key': change['key'],
+                    'changes': {field: [current, previous] for field, (previous, current) in change['changes'].items()}
+                }
+                for change in diff['changed']
+            ],
+            'columns_added': diff['columns_removed'],
+            'columns_removed': diff['columns_added'],
+        },
+    }
+
+def fetch_dataset(uuid:str, label:str) -> list:
+    '''
+    Retrieves a dataset table from the factory data storage
+    label (e.g., 'dataset 1') is used in logs and errors
+    '''
+    # The table of an asset uuid never changes, so downloads are kept on disk
+    cached = fds_table_cache.get(uuid)
+    if cached is not None:
+        logger.info(
+            'GET_DATASETS_DIFF - %s - read from table cache', label
+        )
+        return loads(cached)
+
+    headers = {'Authorization': FDS_API_KEY}
+    data = {
+        "asset_uuid": uuid,
+        "JSON_output": True
+    }
+    try:
+        response = requests.get(f'{FDS_API_URL}/api/tables/get_table', params=data, headers=headers,
+                                timeout=deadline_timeout(None))
+    except (DeadlineExceeded, requests.Timeout) as e:
+        logger.error(
+            'GET_DATASETS_DIFF - Timeout retrieving %s - %s', label, str(e)
+        )
         raise CustomError(
-            "Datasets' diff cannot be shown, because the specified datasets do not exist.",
+            f"Failed to retrieve {label} within the deadline of the request.",
             "Lineage Tracker Backend",
-            412
+            504
+        )
+    if response.status_code != 200:
+        logger.error(
+            'GET_DATASETS_DIFF - Error retrieving %s - %s', label, response.text
+        )
+        raise CustomError(
+            f"Failed to retrieve {label}.",
+            "Lineage Tracker Backend",
+            response.status_code
         )
 
+    dataset = loads(response.text)
+    fds_table_cache.set(uuid, response.content)
+    logger.info(
+        'GET_DATASETS_DIFF - %s - %s', label, dataset
+    )
+    return dataset
+
+def diff_datasets(dataset_1:list, dataset_2:list) -> dict:
+    '''
+    Calculates the diff between two dataset tables
+    The csv files are kept in memory, so concurrent diffs do not share any file
+    '''
+    # Save datasets to csv
+    csv_1 = io.StringIO()
+    csv_2 = io.StringIO()
+    dataset_1_key = dataset_to_csv(dataset_1, csv_1)
+    dataset_2_key = dataset_to_csv(dataset_2, csv_2)
+    csv_1.seek(0)
+    csv_2.seek(0)
+
+    # Calculate diff of two datasets
+    diff = compare(
+        load_csv(csv_1, key=dataset_1_key),
+        load_csv(csv_2, key=dataset_2_key)
+    )
+
+    result = {
+        'dataset_1': dataset_1,
+        'dataset_2': dataset_2,
+        'diff': diff,
+    }
+    logger.info(
+        'GET_DATASETS_DIFF - result - %s', result
+    )
+
+    return result
+
+def diff_datasets_not_found() -> CustomError:
+    '''
+    Returns the error raised when the diff of non-existing datasets is requested
+    '''
+    return CustomError(
+        "Datasets' diff cannot be shown, because the specified datasets do not exist.",
+        "Lineage Tracker Backend",
+        412
+    )
+
 def dataset_to_csv(dataset, filename):
     '''
-    Converts dataset to csv file
+    Converts dataset to csv file (filename can also be a text buffer)
     Returns name of index column
     '''
     # Check if data_model is present
@@ -603,61 +826,176 @@ def dataset_to_csv(dataset, filename):
 
     return columns[0]
 
-def get_history_user(username:str) -> dict:
+def get_history_user(username:str, limit=None, cursor=None) -> dict:
     '''
     Returns the history of a user given its username
     The user history refers to all operations performed by a user on a dataset
+    If limit is provided, only the page of limit operations after cursor is returned,
+    together with the cursor of the next page
     '''
-    ret = select_user_history_by_uuid_SPARQL(username)
-
-    logger.debug(
-        'GET_HISTORY_USER - RESULT:\n\n%s', ret['results']['bindings']
-    )
-
-    history = []
-    for object_ in ret['results']['bindings']:
-        entry = {
-                'user_group': object_['associatedUserGroup']['value'],
-                'operation_description': object_['operationDescription']['value'],
-                'dataset_uuid': object_['datasetUUID']['value'],
-                'dataset_name': object_['datasetTitle']['value'],
-                'timestamp': object_['timestamp']['value']
-            } 
-        if 'update' in entry['operation_description']:
-            entry['uuid_prev'] = object_['previousUUID']['value']
-            operation_description_list = entry['operation_description'].split(':')
-            if len(operation_description_list) == 2:
-                entry['operation_description'] = operation_description_list[0]
-                entry['update_description'] = operation_description_list[1]
-
-        history.append(entry)
-
-    timestamps = [time.mktime(datetime.strptime(entry['timestamp'], '%Y-%m-%d %H:%M:%S').timetuple()) for entry in history]
-    chronology = np.argsort(timestamps)
-    history = np.array(history)[chronology].tolist()
+    if limit is not None:
+        after = decode_cursor(cursor, USER_HISTORY_KEY_SIZE)
+        rows = list(select_user_history_by_uuid_SPARQL_rows(username, page_size(limit), after))
+        rows, next_cursor = paginate(rows, limit, user_history_key)
+        history = [history_user_entry(row) for row in rows]
+    else:
+        history = list(iter_history_user(username))
 
     logger.debug(
         'GET_HISTORY_USER - HISTORY:\n\n%s', history
     )
     
-    if len(history) == 0:
-        raise CustomError(
-            'User history cannot be shown, because the specified user does not exist.',
-            'Lineage Tracker Backend',
-            412
-        )
+    # Pages after the first one may be empty, the first page of an existing user is not
+    if len(history) == 0 and cursor is None:
+        raise user_history_not_found()
     
+    if limit is not None:
+        return {
+            username: history,
+            'next_cursor': next_cursor
+            }
+
     return {
         username: history
         }
 
+def stream_history_user(username:str):
+    '''
+    Returns the history of a user as an iterator over chunks of its JSON document
+    Operations are decoded and serialized one at a time, so the history is never held in memory
+    The first operation is retrieved eagerly, so an unknown user raises before any chunk is sent
+    The remaining chunks are produced within the deadline of the calling request
+    '''
+    history = iter_history_user(username)
+    first_entry = next(history, None)
+    if first_entry is None:
+        raise user_history_not_found()
+
+    return history_user_chunks(username, first_entry, history, current_deadline.get())
+
+def history_user_chunks(username:str, first_entry:dict, history, expires_at=None):
+    '''
+    Serializes a user history as the JSON document {username: [entries]}, chunk by chunk
+    The chunks are produced after the view returned, so the deadline expires_at is resumed here
+    As the status was already sent, a failure midway closes the document with an "error" member
+    (formatted like an error response) instead of truncating it
+    '''
+    yield '{' + dumps(username) + ': [' + dumps(first_entry, sort_keys=True)
+    try:
+        with deadline_at(expires_at):
+            for entry in history:
+                check_deadline()
+                yield ', ' + dumps(entry, sort_keys=True)
+    except Exception as e:
+        logger.error(
+            'GET_USER_HISTORY - STREAM FAILED - %s:\n\n%s', username, e
+        )
+        yield '], "error": ' + dumps(user_history_stream_error(e).__dict__, sort_keys=True) + '}'
+        return
+    yield ']}'
+
+def user_history_stream_error(e:Exception) -> CustomError:
+    '''
+    Returns the error reported at the end of a user history stream that failed with e
+    '''
+    if isinstance(e, CustomError):
+        return e
+    if isinstance(e, DeadlineExceeded):
+        return CustomError(
+            'The request did not complete within its deadline.',
+            'Lineage Tracker Backend',
+            504
+        )
+    return CustomError(
+        'User history could not be completed.',
+        'Lineage Tracker Backend',
+        500
+    )
+
+def iter_history_user(username:str):
+    '''
+    Yields the operations performed by a user in chronological order, one at a time
+    '''
+    for row in select_user_history_by_uuid_SPARQL_rows(username):
+        yield history_user_entry(row)
+
+def history_user_entry(row:dict) -> dict:
+    '''
+    Converts a user history row into a user history entry
+    '''
+    entry = {
+            'user_group': row['associatedUserGroup'],
+            'operation_description': row['operationDescription'],
+            'dataset_uuid': row['datasetUUID'],
+            'dataset_name': row['datasetTitle'],
+            'timestamp': row['timestamp']
+        } 
+    if 'update' in entry['operation_description']:
+        entry['uuid_prev'] = row['previousUUID']
+        operation_description_list = entry['operation_description'].split(':')
+        if len(operation_description_list) == 2:
+            entry['operation_description'] = operation_description_list[0]
+            entry['update_description'] = operation_description_list[1]
+
+    return entry
+
+def user_history_key(row:dict) -> list:
+    '''
+    Returns the sort key (timestamp, operation) of a user history row
+    '''
+    return [row['timestamp'], row['operation']]
+
+def user_history_not_found() -> CustomError:
+    '''
+    Returns the error raised when the history of a non-existing user is requested
+    '''
+    return CustomError(
+        'User history cannot be shown, because the specified user does not exist.',
+        'Lineage Tracker Backend',
+        412
+    )
+
+def format_lineage_entry(version:dict) -> dict:
+    '''
+    Converts a lineage query binding into a lineage entry
+    If update operation, operation description and update description are separated
+    '''
+    entry = {
+        'username': version['operationBy']['value'],
+        'user_group': version['associatedUserGroup']['value'],
+        'dataset_name': version['title']['value'],
+        'timestamp': version['timestamp']['value'],
+        'operation_description': version['operationDescription']['value'],
+        'derived_from': version['previousUUID']['value'] if 'previousUUID' in version else None
+    }
+    if 'update' in entry['operation_description']:
+        operation_description_list = entry['operation_description'].split(':')
+        if len(operation_description_list) == 2:
+            entry['operation_description'] = operation_description_list[0]
+            entry['update_description'] = operation_description_list[1]
+    return entry
+
+def lineage_from_bindings(ret:dict) -> dict:
+    '''
+    Builds a lineage from the result of a lineage query
+    Bindings are processed chronologically, so the latest operation of a dataset is kept
+    '''
+    logger.debug(
+        'GET_LINEAGE - RESULT:\n\n%s', ret['results']['bindings']
+    )
+
+    lineage = {}
+    for version in sorted(ret['results']['bindings'], key=lambda version: version['timestamp']['value']):
+        lineage[version['id']['value']] = format_lineage_entry(version)
+    return lineage
+
+@read_flights.coalesced
 def get_lineage_by_uuid(uuid:str) -> dict:
     '''
     Returns the dataset lineage given its uuid
     A dataset family tree is split into different lineages
     The lineage refers to the heritage of a dataset associated with the specified lineage_id
     '''
-    lineage = {}
     lineage_id = get_lineage_id_by_uuid(uuid)
     if lineage_id is None:
         raise CustomError(
@@ -665,39 +1003,8 @@ def get_lineage_by_uuid(uuid:str) -> dict:
             'Lineage Tracker Backend',
             412
         ) 
-    ret = select_lineage_by_lineage_id_SPARQL(lineage_id)
+    lineage = lineage_from_bindings(select_lineage_by_lineage_id_SPARQL(lineage_id))
 
-    logger.debug(
-        'GET_LINEAGE - RESULT:\n\n%s', ret['results']['bindings']
-    )
-
-    timestamps = [time.mktime(datetime.strptime(entry['timestamp']['value'], '%Y-%m-%d %H:%M:%S').timetuple()) for entry in ret['results']['bindings']]
-    chronology = np.argsort(timestamps)
-    for index, version in enumerate(np.array(ret['results']['bindings'])[chronology]):
-        try:
-            lineage[version['id']['value']] = {
-                'username': version['operationBy']['value'],
-                'user_group': version['associatedUserGroup']['value'],
-                'dataset_name': version['title']['value'],
-                'timestamp': version['timestamp']['value'],
-                'operation_description': version['operationDescription']['value'],
-                'derived_from': version['previousUUID']['value']    
-            }
-        except KeyError:
-            lineage[version['id']['value']] = {
-                'username': version['operationBy']['value'],
-                'user_group': version['associatedUserGroup']['value'],
-                'dataset_name': version['title']['value'],
-                'timestamp': version['timestamp']['value'],
-                'operation_description': version['operationDescription']['value'],
-                'derived_from': None
-            }
-        # If update operation, operation description and update description need to be separated
-        if 'update' in version['operationDescription']['value']:
-            operation_description_list = version['operationDescription']['value'].split(':')
-            if len(operation_description_list) == 2:
-                lineage[version['id']['value']]['operation_description'] = operation_description_list[0]
-                lineage[version['id']['value']]['update_description'] = operation_description_list[1]
     if len(lineage) > 0:
         return lineage
     else:
@@ -713,40 +1020,8 @@ def get_lineage_by_lineage_id(lineage_id:str) -> dict:
     A dataset family tree is split into different lineages
     The lineage refers to the heritage of a dataset associated with the specified lineage_id
     '''
-    lineage = {}
-    ret = select_lineage_by_lineage_id_SPARQL(lineage_id)
+    lineage = lineage_from_bindings(select_lineage_by_lineage_id_SPARQL(lineage_id))
 
-    logger.debug(
-        'GET_LINEAGE - RESULT:\n\n%s', ret['results']['bindings']
-    )
-
-    timestamps = [time.mktime(datetime.strptime(entry['timestamp']['value'], '%Y-%m-%d %H:%M:%S').timetuple()) for entry in ret['results']['bindings']]
-    chronology = np.argsort(timestamps)
-    for index, version in enumerate(np.array(ret['results']['bindings'])[chronology]):
-        try:
-            lineage[version['id']['value']] = {
-                'username': version['operationBy']['value'],
-                'user_group': version['associatedUserGroup']['value'],
-                'dataset_name': version['title']['value'],
-                'timestamp': version['timestamp']['value'],
-                'operation_description': version['operationDescription']['value'],
-                'derived_from': version['previousUUID']['value']    
-            }
-        except KeyError:
-            lineage[version['id']['value']] = {
-                'username': version['operationBy']['value'],
-                'user_group': version['associatedUserGroup']['value'],
-                'dataset_name': version['title']['value'],
-                'timestamp': version['timestamp']['value'],
-                'operation_description': version['operationDescription']['value'],
-                'derived_from': None
-            }
-        # If update operation, operation description and update description need to be separated
-        if 'update' in lineage[version['id']['value']]['operation_description']:
-            operation_description_list = lineage[version['id']['value']]['operation_description'].split(':')
-            if len(operation_description_list) == 2:
-                lineage[version['id']['value']]['operation_description'] = operation_description_list[0]
-                lineage[version['id']['value']]['update_description'] = operation_description_list[1]
     if len(lineage) > 0:
         return lineage
     else:
@@ -756,27 +1031,357 @@ def get_lineage_by_lineage_id(lineage_id:str) -> dict:
             412
         ) 
 
-def get_family_tree(uuid:str) -> dict:
+@read_flights.coalesced
+async def get_versioned_family_tree_async(uuid:str, revision:str=None) -> dict:
     '''
-    Returns the entire family tree given a uuid
-    The family tree includes all tree branches/lineage_ids
+    Returns the family tree of uuid with version labels (see versioning.add_versioning)
+    Trees are cached by family_id; the returned tree is shared and must not be modified
+    If revision (see get_family_tree_revision_async) is provided, the tree is at least as recent as revision
     '''
-    logger.info("*** Inside get_family_tree")
-    family_id = get_family_id(uuid)
-    ret = get_lineage_ids_by_family_id(family_id)
-    lineage_ids = np.unique(ret)
+    family_id = await get_family_id_async(uuid)
+    if family_id is None:
+        raise family_tree_not_found()
+    return await get_versioned_family_tree_by_family_id_async(family_id, revision)
+
+async def get_versioned_family_tree_by_family_id_async(family_id:str, revision:str=None) -> dict:
+    '''
+    Returns the family tree of family_id with version labels, cached like get_versioned_family_tree_async
+    A tree cached at another revision than the given one is read again
+    '''
+    cached = family_tree_cache.get(family_id)
+    if cached is not None and (revision is None or cached[0] == revision):
+        return cached[1]
+
+    generation = family_tree_cache_generation
+    ret = await select_family_tree_by_family_id_SPARQL_async(family_id)
+    return cache_family_tree(family_id, versioned_family_tree_from_result(ret), generation, revision)
 
-    if len(lineage_ids) == 0:
+@read_flights.coalesced
+async def get_family_structure_async(family_id:str) -> FamilyTree:
+    '''
+    Returns the indexed FamilyTree of family_id, built from the cached versioned family tree
+    Structures are cached by family_id; the returned structure is shared and must not be modified
+    '''
+    structure = family_structure_cache.get(family_id)
+    if structure is None:
+        generation = family_tree_cache_generation
+        structure = create_family_structure(await get_versioned_family_tree_by_family_id_async(family_id))
+        if generation == family_tree_cache_generation:
+            family_structure_cache.set(family_id, structure)
+    return structure
+
+async def is_derived_from_async(ancestor:str, descendant:str) -> bool:
+    '''
+    Returns whether descendant was derived, directly or transitively, from ancestor
+    Answered from the Euler tour index of their family, without returning the family tree
+    Both family lookups run concurrently
+    '''
+    ancestor_family_id, descendant_family_id = await asyncio.gather(
+        get_family_id_async(ancestor),
+        get_family_id_async(descendant)
+    )
+    if ancestor_family_id is None or descendant_family_id is None:
         raise CustomError(
-            'Dataset family tree cannot be shown, because the specified dataset does not exist.',
+            'Dataset ancestry cannot be determined, because the specified dataset does not exist.',
             'Lineage Tracker Backend',
             412
         )
-    
-    family_tree = {lineage_id: get_lineage_by_lineage_id(lineage_id) for lineage_id in lineage_ids}
+    if ancestor_family_id != descendant_family_id:
+        return False
+
+    structure = await get_family_structure_async(descendant_family_id)
+    return structure.is_derived_from(ancestor, descendant)
+
+async def get_common_ancestor_async(uuid_1:str, uuid_2:str) -> dict:
+    '''
+    Returns the nearest dataset both uuid_1 and uuid_2 were derived from (or are), with its version label
+    Answered from the binary lifting tables of their family; the ancestor is None for different families
+    Both family lookups run concurrently
+    '''
+    family_id_1, family_id_2 = await asyncio.gather(
+        get_family_id_async(uuid_1),
+        get_family_id_async(uuid_2)
+    )
+    if family_id_1 is None or family_id_2 is None:
+        raise CustomError(
+            'The common ancestor cannot be determined, because the specified dataset does not exist.',
+            'Lineage Tracker Backend',
+            412
+        )
+
+    common_ancestor = None
+    version = None
+    if family_id_1 == family_id_2:
+        structure = await get_family_structure_async(family_id_1)
+        common_ancestor = structure.get_common_ancestor(uuid_1, uuid_2)
+        if common_ancestor is not None:
+            version = structure.get_version(common_ancestor)
+
+    return {'uuid_1': uuid_1, 'uuid_2': uuid_2, 'common_ancestor': common_ancestor, 'version': version}
+
+def versioned_family_tree_from_result(ret:dict) -> dict:
+    '''
+    Builds the family tree from the result of select_family_tree_by_family_id_SPARQL with version labels
+    The stored labels are used if they form a valid labelling (see consistent_versions),
+    otherwise they are computed like relabel_family computes them
+    '''
+    family_tree = family_tree_from_result(ret)
+    versions = stored_versions(ret)
+    if not consistent_versions(family_tree, versions):
+        return add_creation_versioning(ret, family_tree)
+
+    for lineage in family_tree.values():
+        for uuid, entry in lineage.items():
+            entry['version'] = next(iter(versions[uuid]))
+    return family_tree
+
+def consistent_versions(family_tree:dict, versions:dict) -> bool:
+    '''
+    Returns whether the stored labels of family_tree form a valid labelling: every dataset has exactly one,
+    roots are ROOT_VERSION, and the n children of a dataset carry child_version(parent label, i, n) for i < n
+    Concurrent updates of the same dataset can store the same label twice, and a failed relabel_family
+    leaves an only child's label next to the label of its new sibling
+    '''
+    labels = {}
+    children = {}
+    for lineage in family_tree.values():
+        for uuid, entry in lineage.items():
+            stored = versions.get(uuid, ())
+            if len(stored) != 1:
+                return False
+            labels[uuid] = next(iter(stored))
+            children.setdefault(entry['derived_from'], []).append(uuid)
+
+    for parent, siblings in children.items():
+        if parent is None:
+            expected = [ROOT_VERSION]
+        elif parent in labels:
+            expected = [child_version(labels[parent], i, len(siblings)) for i in range(len(siblings))]
+        else:
+            return False
+        if sorted(labels[uuid] for uuid in siblings) != sorted(expected):
+            return False
+    return True
+
+def stored_versions(ret:dict) -> dict:
+    '''
+    Maps the uuids in the result of select_family_tree_by_family_id_SPARQL to their stored version labels
+    '''
+    versions = {}
+    for binding in ret['results']['bindings']:
+        if 'version' in binding:
+            versions.setdefault(binding['id']['value'], set()).add(binding['version']['value'])
+    return versions
+
+def relabel_family(family_id:str) -> int:
+    '''
+    Recomputes the version labels of a family and stores the ones that differ from the stored labels
+    Returns the number of datasets whose label was written
+    '''
+    ret = select_family_tree_by_family_id_SPARQL(family_id)
+    versions = stored_versions(ret)
+    family_tree = add_creation_versioning(ret, family_tree_from_result(ret))
+
+    changed = [
+        (Dataset(uuid, entry['dataset_name'], lineage_id, family_id), entry['version'])
+        for lineage_id, lineage in family_tree.items()
+        for uuid, entry in lineage.items()
+        if versions.get(uuid) != {entry['version']}
+    ]
+    if len(changed) > 0:
+        replace_versions_SPARQL(changed)
+
+    logger.info(
+        'RELABEL_FAMILY - %s - CHANGED: %s', family_id, len(changed)
+    )
+    return len(changed)
+
+def add_creation_versioning(ret:dict, family_tree:dict) -> dict:
+    '''
+    Adds computed version labels to family_tree, built from the result ret of select_family_tree_by_family_id_SPARQL
+    Siblings are ordered by creation, as on the write path, so deleting or updating a dataset does not relabel
+    its siblings; the timestamps of family_tree (latest operations) are kept
+    '''
+    created = {}
+    for binding in ret['results']['bindings']:
+        uuid = binding['id']['value']
+        created[uuid] = min(created.get(uuid, binding['timestamp']['value']), binding['timestamp']['value'])
+
+    latest = {}
+    for lineage in family_tree.values():
+        for uuid, entry in lineage.items():
+            latest[uuid] = entry['timestamp']
+            entry['timestamp'] = created[uuid]
+    # add_versioning labels the entries of family_tree in place
+    versioned = add_versioning(family_tree)
+    for lineage in family_tree.values():
+        for uuid, entry in lineage.items():
+            entry['timestamp'] = latest[uuid]
+    return versioned
+
+def cache_family_tree(family_id:str, family_tree:dict, generation:int, revision:str=None) -> dict:
+    '''
+    Caches a versioned family tree read at revision, unless a write invalidated a tree since generation
+    The tree was queried after revision was, so it is at least as recent as revision
+    '''
+    if generation == family_tree_cache_generation:
+        family_tree_cache.set(family_id, (revision, family_tree))
+    return family_tree
+
+async def get_family_tree_async(uuid:str) -> dict:
+    '''
+    Returns the entire family tree given a uuid
+    The family tree includes all tree branches/lineage_ids
+    All datasets of the family are retrieved with a single query and grouped by lineage_id
+    '''
+    logger.info("*** Inside get_family_tree")
+    family_id = await get_family_id_async(uuid)
+    if family_id is None:
+        raise family_tree_not_found()
+
+    ret = await select_family_tree_by_family_id_SPARQL_async(family_id)
+    return family_tree_from_result(ret)
+
+def family_tree_from_result(ret:dict) -> dict:
+    '''
+    Groups the result of select_family_tree_by_family_id_SPARQL into lineages
+    '''
+    logger.debug(
+        'GET_FAMILY_TREE - RESULT:\n\n%s', ret['results']['bindings']
+    )
+
+    family_tree = lineages_from_bindings(ret['results']['bindings'])
+    if len(family_tree) == 0:
+        raise family_tree_not_found()
 
     logger.debug(
         'GET_FAMILY_TREE - FAMILY TREE:\n\n%s', family_tree
     )
     
     return family_tree
+
+def lineages_from_bindings(bindings:list) -> dict:
+    '''
+    Groups bindings projected like select_family_tree_by_family_id into lineages, ordered by lineage_id
+    '''
+    # Bindings are processed chronologically, so the latest operation of a dataset is kept
+    lineages = {}
+    for version in sorted(bindings, key=lambda version: version['timestamp']['value']):
+        lineage = lineages.setdefault(version['lineageId']['value'], {})
+        lineage[version['id']['value']] = format_lineage_entry(version)
+    return {lineage_id: lineages[lineage_id] for lineage_id in sorted(lineages)}
+
+@read_flights.coalesced
+async def get_dataset_descendants_async(uuid:str, max_depth:int=None) -> dict:
+    '''
+    Returns the datasets derived, directly or transitively, from uuid, grouped by lineage like the family tree
+    Only datasets at most max_depth derivations away from uuid are returned if max_depth is given
+    The existence check and the descendants query run concurrently
+    '''
+    family_id, ret = await asyncio.gather(
+        get_family_id_async(uuid),
+        select_descendants_by_uuid_SPARQL_async(uuid, max_depth)
+    )
+    if family_id is None:
+        raise CustomError(
+            'Dataset descendants cannot be shown, because the specified dataset does not exist.',
+            'Lineage Tracker Backend',
+            412
+        )
+
+    return descendants_from_result(uuid, ret, max_depth)
+
+def descendants_from_result(uuid:str, ret:dict, max_depth:int=None) -> dict:
+    '''
+    Groups the result of select_descendants_by_uuid_SPARQL into lineages, with the stored version labels
+    Datasets more than max_depth derivations away from uuid are left out
+    '''
+    logger.debug(
+        'GET_DATASET_DESCENDANTS - RESULT:\n\n%s', ret['results']['bindings']
+    )
+
+    lineages = lineages_from_bindings(ret['results']['bindings'])
+    versions = stored_versions(ret)
+    derived_from = {dataset_id: entry['derived_from'] for lineage in lineages.values() for dataset_id, entry in lineage.items()}
+
+    # Number of derivations between uuid and each descendant
+    depths = {uuid: 0}
+    for dataset_id in derived_from:
+        path = []
+        while dataset_id not in depths and dataset_id in derived_from:
+            path.append(dataset_id)
+            dataset_id = derived_from[dataset_id]
+        depth = depths.get(dataset_id, 0)
+        for dataset_id in reversed(path):
+            depth += 1
+            depths[dataset_id] = depth
+
+    descendants = {}
+    for lineage_id, lineage in lineages.items():
+        for dataset_id, entry in lineage.items():
+            if max_depth is None or depths[dataset_id] <= max_depth:
+                labels = versions.get(dataset_id, ())
+                entry['version'] = next(iter(labels)) if len(labels) == 1 else None
+                descendants.setdefault(lineage_id, {})[dataset_id] = entry
+    return descendants
+
+def family_tree_not_found() -> CustomError:
+    '''
+    Returns the error raised when the family tree of a non-existing dataset is requested
+    '''
+    return CustomError(
+        'Dataset family tree cannot be shown, because the specified dataset does not exist.',
+        'Lineage Tracker Backend',
+        412
+    )
+
+@read_flights.coalesced
+async def get_dataset_history_revision_async(uuid:str) -> str:
+    '''
+    Returns a value that changes whenever the history of uuid changes (None if it has no operations)
+    '''
+    return revision_from_result(await get_dataset_history_revision_SPARQL_async(uuid))
+
+@read_flights.coalesced
+def get_lineage_revision(uuid:str) -> str:
+    '''
+    Returns a value that changes whenever the lineage of uuid changes (None if the dataset does not exist)
+    '''
+    lineage_id = get_lineage_id_by_uuid(uuid)
+    if lineage_id is None:
+        return None
+    return revision_from_result(get_lineage_revision_SPARQL(lineage_id))
+
+@read_flights.coalesced
+async def get_family_tree_revision_async(uuid:str) -> str:
+    '''
+    Returns a value that changes whenever the family tree of uuid changes (None if the dataset does not exist)
+    '''
+    family_id = await get_family_id_async(uuid)
+    if family_id is None:
+        return None
+    return revision_from_result(await get_family_revision_SPARQL_async(family_id))
+
+def revision_from_result(ret:dict) -> str:
+    '''
+    Combines the newest timestamp and the number of operations in the result of a revision query
+    As operations are only ever added, the pair changes with every write
+    '''
+    bindings = ret['results']['bindings']
+    if len(bindings) == 0 or 'lastIssued' not in bindings[0] or int(bindings[0]['operations']['value']) == 0:
+        return None
+    return bindings[0]['lastIssued']['value'] + '/' + bindings[0]['operations']['value']
+
+def get_metrics() -> dict:
+    '''
+    Returns the hit/miss counters of the in-process caches and of the read coalescing
+    '''
+    return {
+        'dataset_metadata_cache': metadata_cache.stats(),
+        'family_tree_cache': family_tree_cache.stats(),
+        'family_structure_cache': family_structure_cache.stats(),
+        'known_datasets': known_datasets_stats(),
+        'fds_table_cache': fds_table_cache.stats(),
+        'diff_cache': diff_cache.stats(),
+        'single_flight': read_flights.stats()
+    }
@@ -0,0 +1,62 @@
+'''
+Bloom filter over string keys.
+
+A Bloom filter answers "definitely not added" or "possibly added". It never gives
+a false negative, and gives a false positive at roughly error_rate once capacity
+keys have been added.
+'''
+
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+    '''
+    Thread-safe Bloom filter sized for capacity keys at the given false positive rate
+    '''
+    def __init__(self, capacity:int, error_rate:float=0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        # Optimal number of bits m and of hash functions k for n keys at false positive rate p
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+
+        self.lock = threading.Lock()
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, key:str):
+        '''
+        Yields the bit positions of key (double hashing over one 128 bit digest)
+        '''
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key:str):
+        '''
+        Adds key to the filter
+        '''
+        positions = list(self.positions(key))
+        with self.lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, key:str) -> bool:
+        '''
+        Returns False if key was definitely never added, True if it possibly was
+        '''
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+    def clear(self):
+        '''
+        Removes all keys
+        '''
+        with self.lock:
+            self.bits = bytearray(len(self.bits))
+            self.count = 0
@@ -0,0 +1,95 @@
+'''
+Bounded in-process caches.
+'''
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    Thread-safe least-recently-used cache with hit and miss counters
+
+    At most maxsize entries are kept; the least recently used entry is evicted first.
+    If ttl (seconds) is given, entries also expire ttl seconds after they were set.
+    '''
+    def __init__(self, maxsize:int, ttl:float=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        # key -> (value, expires_at)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        '''
+        Returns the value cached for key, or default if there is none (counted as a miss)
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= self.clock():
+                del self.entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl:float=None):
+        '''
+        Caches value for key, evicting the least recently used entry if the cache is full
+        ttl overrides the ttl of the cache for this entry
+        '''
+        if self.maxsize <= 0:
+            return
+
+        if ttl is None:
+            ttl = self.ttl
+        expires_at = self.clock() + ttl if ttl is not None else None
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        '''
+        Removes the entry of key, if any
+        '''
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        '''
+        Removes all entries and resets the counters
+        '''
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def stats(self) -> dict:
+        '''
+        Returns the size and hit/miss counters of the cache
+        '''
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups > 0 else None,
+            }
@@ -0,0 +1,110 @@
+'''
+Deadline budgets for outgoing requests.
+
+A request handler runs within a deadline, and every call to a backing service
+(Virtuoso, Factory Data Storage) limits its timeouts to the time that is left,
+so a chain of sequential calls cannot take longer than the budget of the request.
+The deadline is kept in a context variable, so it follows the request into
+executor threads and coroutines.
+'''
+
+import asyncio
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+
+current_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    '''
+    Raised when a call is started after the deadline of the request has passed
+    '''
+
+
+@contextmanager
+def deadline(budget:float):
+    '''
+    Runs the block within a deadline of budget seconds
+    A nested deadline can only shorten the enclosing one
+    '''
+    with deadline_at(time.monotonic() + budget):
+        yield
+
+
+@contextmanager
+def deadline_at(expires_at:float):
+    '''
+    Runs the block within a deadline that expires at expires_at (time.monotonic()), if it is not None
+    Used to resume the deadline of a request in code that runs after the handler returned, e.g. a streamed body
+    '''
+    if expires_at is None:
+        yield
+        return
+
+    enclosing = current_deadline.get()
+    if enclosing is not None:
+        expires_at = min(expires_at, enclosing)
+
+    token = current_deadline.set(expires_at)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def with_deadline(budget:float):
+    '''
+    Decorator running a (sync or async) function within a deadline of budget seconds
+    '''
+    def decorator(f):
+        if asyncio.iscoroutinefunction(f):
+            @functools.wraps(f)
+            async def wrapped(*args, **kwargs):
+                with deadline(budget):
+                    return await f(*args, **kwargs)
+        else:
+            @functools.wraps(f)
+            def wrapped(*args, **kwargs):
+                with deadline(budget):
+                    return f(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def remaining_time():
+    '''
+    Returns the seconds left until the current deadline, or None outside of a deadline
+    '''
+    expires_at = current_deadline.get()
+    if expires_at is None:
+        return None
+    return expires_at - time.monotonic()
+
+
+def check_deadline():
+    '''
+    Raises DeadlineExceeded if the current deadline has passed
+    '''
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded('The deadline of the request has passed.')
+
+
+def deadline_timeout(timeout):
+    '''
+    Limits a requests timeout (None, seconds, or a (connect, read) tuple) to the time left
+    Raises DeadlineExceeded if no time is left
+    '''
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceeded('The deadline of the request has passed.')
+
+    if timeout is None:
+        return remaining
+    if isinstance(timeout, tuple):
+        return tuple(remaining if value is None else min(value, remaining) for value in timeout)
+    return min(timeout, remaining)
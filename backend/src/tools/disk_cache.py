@@ -0,0 +1,149 @@
+'''
+Size-bounded cache of immutable blobs on disk.
+
+Entries are gzip-compressed files named after the sha256 of their key, so any
+string (e.g., an asset uuid) can be used as a key. Once the files exceed
+max_bytes, the least recently used ones are deleted. Writes go through a
+temporary file and an atomic rename, so concurrent readers never see a
+partial entry.
+'''
+
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class DiskCache:
+    '''
+    Thread-safe least-recently-used cache of bytes stored in directory
+    '''
+    def __init__(self, directory:str, max_bytes:int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        # file name -> compressed size, least recently used first
+        self.entries = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key:str) -> str:
+        '''
+        Returns the file of key
+        '''
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.gz')
+
+    def load_index(self):
+        '''
+        Indexes the files left in directory by an earlier process, oldest access first
+        Must be called with the lock held
+        '''
+        if self.entries is not None:
+            return
+
+        files = []
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith('.gz'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name, stat.st_size))
+        except OSError:
+            # An unusable directory makes every lookup a miss and every write a no-op
+            pass
+
+        self.entries = OrderedDict((name, size) for _, name, size in sorted(files))
+        self.size = sum(self.entries.values())
+
+    def get(self, key:str):
+        '''
+        Returns the bytes cached for key, or None if there are none (counted as a miss)
+        '''
+        if self.max_bytes <= 0:
+            return None
+
+        path = self.path(key)
+        name = os.path.basename(path)
+        with self.lock:
+            self.load_index()
+
+        try:
+            with open(path, 'rb') as file:
+                compressed = file.read()
+            value = gzip.decompress(compressed)
+            os.utime(path)
+        except (OSError, EOFError):
+            # Missing, evicted by another process, or corrupt
+            with self.lock:
+                self.discard(name)
+                self.misses += 1
+            return None
+
+        with self.lock:
+            # The file may have been written by another process
+            self.size += len(compressed) - self.entries.pop(name, 0)
+            self.entries[name] = len(compressed)
+            self.hits += 1
+        return value
+
+    def set(self, key:str, value:bytes):
+        '''
+        Caches value for key, deleting least recently used entries beyond max_bytes
+        '''
+        if self.max_bytes <= 0:
+            return
+
+        compressed = gzip.compress(value)
+        if len(compressed) > self.max_bytes:
+            return
+
+        path = self.path(key)
+        name = os.path.basename(path)
+        with self.lock:
+            self.load_index()
+            temporary = None
+            try:
+                descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+                with os.fdopen(descriptor, 'wb') as file:
+                    file.write(compressed)
+                os.replace(temporary, path)
+            except OSError:
+                if temporary is not None and os.path.exists(temporary):
+                    os.remove(temporary)
+                return
+
+            self.size -= self.entries.pop(name, 0)
+            self.entries[name] = len(compressed)
+            self.size += len(compressed)
+            while self.size > self.max_bytes:
+                self.discard(next(iter(self.entries)))
+
+    def discard(self, name:str):
+        '''
+        Deletes the file name and its index entry
+        Must be called with the lock held
+        '''
+        self.size -= self.entries.pop(name, 0)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        '''
+        Returns the size and hit/miss counters of the cache
+        '''
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size_bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'entries': len(self.entries) if self.entries is not None else 0,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups > 0 else None,
+            }
@@ -4,3 +4,9 @@ class CustomError(Exception):
         self.origin = origin
         self.status_code = status_code
         super().__init__(self.message)
+
+
+class ServiceUnavailableError(CustomError):
+    def __init__(self, message, origin, retry_after):
+        super().__init__(message, origin, 503)
+        self.retry_after = retry_after
@@ -1,18 +1,241 @@
 import logging
+import os
+import threading
+from tools.bloom_filter import BloomFilter
+from tools.cache import LRUCache
 from tools.sparql.wrapper import validate_operation_by_uuid_SPARQL, \
-    get_name_by_uuid_SPARQL, get_lineage_id_by_uuid_SPARQL, get_lineage_id_by_family_id_SPARQL, get_family_id_SPARQL, get_family_uuids_by_uuid_SPARQL, \
-        check_lineage_node_SPARQL, check_was_derived_from_SPARQL
+    get_lineage_id_by_family_id_SPARQL, get_family_uuids_by_uuid_SPARQL, \
+        check_lineage_node_SPARQL, get_dataset_metadata_SPARQL, get_family_metadata_by_uuid_SPARQL, \
+            validate_operation_by_uuid_SPARQL_async, get_dataset_metadata_SPARQL_async, \
+                select_dataset_uuids_SPARQL_rows
 
 logger = logging.getLogger('operation_validator')
 
-def validate_create(uuid:str) -> bool:
+DATASET_METADATA_CACHE_SIZE = int(os.getenv('DATASET_METADATA_CACHE_SIZE', '10000'))
+
+# name, lineage_id and family_id of a dataset never change once written, so they are cached without expiry
+metadata_cache = LRUCache(DATASET_METADATA_CACHE_SIZE)
+
+KNOWN_DATASETS_CAPACITY = int(os.getenv('KNOWN_DATASETS_CAPACITY', '1000000'))
+KNOWN_DATASETS_ERROR_RATE = float(os.getenv('KNOWN_DATASETS_ERROR_RATE', '0.01'))
+KNOWN_DATASETS_PAGE_SIZE = int(os.getenv('KNOWN_DATASETS_PAGE_SIZE', '10000'))
+# Number of worker processes serving the API, as set for gunicorn and uvicorn
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))
+# The filter only sees the creates of its own process, so a uuid created through another worker would be
+# taken for a new one; it is therefore only used when a single process serves the API
+KNOWN_DATASETS_ENABLED = KNOWN_DATASETS_CAPACITY > 0 and WEB_CONCURRENCY <= 1
+
+# Bloom filter over the identifiers of all datasets, used to skip the existence query when a dataset is created
+# It is only consulted once load_known_datasets has scanned the whole store, and never for reads:
+# it misses the datasets written through other processes, which would then be reported as missing
+known_datasets = BloomFilter(max(KNOWN_DATASETS_CAPACITY, 1), KNOWN_DATASETS_ERROR_RATE)
+known_datasets_loaded = threading.Event()
+known_datasets_skipped_queries = 0
+
+def load_known_datasets():
+    '''
+    Adds the identifiers of all datasets in the store to the known_datasets filter
+    The filter is used by create only after the scan completed; on a store error, or if it is not enabled
+    (see KNOWN_DATASETS_ENABLED), it stays unused
+    '''
+    if not KNOWN_DATASETS_ENABLED:
+        logger.info(
+            'LOAD_KNOWN_DATASETS - DISABLED - WEB_CONCURRENCY: %s', WEB_CONCURRENCY
+        )
+        return
+
+    after = ''
+    while True:
+        page = 0
+        for row in select_dataset_uuids_SPARQL_rows(KNOWN_DATASETS_PAGE_SIZE, after):
+            known_datasets.add(row['uuid'])
+            after = row['uuid']
+            page += 1
+        if page < KNOWN_DATASETS_PAGE_SIZE:
+            break
+
+    known_datasets_loaded.set()
+    logger.info(
+        'LOAD_KNOWN_DATASETS - LOADED: %s', known_datasets.count
+    )
+
+def add_known_dataset(uuid:str):
+    '''
+    Records a newly written dataset identifier in the known_datasets filter
+    '''
+    known_datasets.add(uuid)
+
+def is_new_dataset(uuid:str) -> bool:
+    '''
+    Returns True if the known_datasets filter proves that the dataset does not exist
+    '''
+    global known_datasets_skipped_queries
+    if KNOWN_DATASETS_ENABLED and known_datasets_loaded.is_set() and uuid not in known_datasets:
+        known_datasets_skipped_queries += 1
+        return True
+    return False
+
+def known_datasets_stats() -> dict:
+    '''
+    Returns the state of the known_datasets filter
+    '''
+    return {
+        'enabled': KNOWN_DATASETS_ENABLED,
+        'loaded': known_datasets_loaded.is_set(),
+        'size': known_datasets.count,
+        'capacity': known_datasets.capacity,
+        'skipped_queries': known_datasets_skipped_queries,
+    }
+
+def cache_dataset_metadata(uuid:str, name:str, lineage_id:str, family_id:str):
+    '''
+    Caches the immutable metadata (name, lineage_id, family_id) of a dataset
+    '''
+    metadata_cache.set(uuid, {
+        'name': name,
+        'lineage_id': lineage_id,
+        'family_id': family_id
+    })
+
+def get_immutable_metadata(uuid:str) -> dict:
+    '''
+    Returns name, lineage_id and family_id of a dataset (None if the dataset does not exist)
+    The metadata is read through the metadata cache
+    '''
+    cached = metadata_cache.get(uuid)
+    if cached is not None:
+        return cached
+    return immutable_metadata(get_dataset_metadata(uuid))
+
+async def get_immutable_metadata_async(uuid:str) -> dict:
+    '''
+    Awaitable version of get_immutable_metadata
+    '''
+    cached = metadata_cache.get(uuid)
+    if cached is not None:
+        return cached
+    ret = await get_dataset_metadata_SPARQL_async(uuid)
+    return immutable_metadata(dataset_metadata_from_result(uuid, ret))
+
+def immutable_metadata(metadata:dict) -> dict:
+    '''
+    Returns the immutable part of the result of get_dataset_metadata (None if the dataset does not exist)
+    '''
+    if not metadata['dataset_exists']:
+        return None
+    return {
+        'name': metadata['name'],
+        'lineage_id': metadata['lineage_id'],
+        'family_id': metadata['family_id']
+    }
+
+def get_dataset_metadata(uuid:str, with_children:bool=True) -> dict:
+    '''
+    Returns everything needed to validate and document an operation on a dataset,
+    retrieved with a single query:
+    1. dataset_exists: the dataset exists
+    2. deleted: the dataset has been deleted
+    3. name, lineage_id, family_id of the dataset (None if the dataset does not exist)
+    4. has_children: another dataset wasDerivedFrom this dataset
+    5. has_undeleted_children: another undeleted dataset wasDerivedFrom this dataset
+    6. num_children: the number of datasets derived from this dataset
+    7. version: the stored version label of the dataset (None if it has none)
+    If with_children is False and 3. is cached, only the operations of the dataset are queried
+    and 4. to 7. are None
+    '''
+    if not with_children:
+        cached = metadata_cache.get(uuid)
+        if cached is not None:
+            ret = validate_operation_by_uuid_SPARQL(uuid)
+            operations = {binding['operationFrom']['value'] for binding in ret['results']['bindings']}
+            return {
+                'dataset_exists': len(operations) > 0,
+                'deleted': any('delete' in operation for operation in operations),
+                **cached,
+                'has_children': None,
+                'has_undeleted_children': None,
+                'num_children': None,
+                'version': None,
+            }
+
+    ret = get_dataset_metadata_SPARQL(uuid)
+    return dataset_metadata_from_result(uuid, ret)
+
+def dataset_metadata_from_result(uuid:str, ret:dict) -> dict:
+    '''
+    Builds the dataset metadata from the result of get_dataset_metadata_SPARQL
+    and caches its immutable part
+    '''
+    logger.debug(
+        'GET_DATASET_METADATA - RESULT:\n\n%s', ret['results']['bindings']
+    )
+
+    operations = set()
+    name = None
+    lineage_ids = set()
+    family_ids = set()
+    version = None
+    # Maps each derived dataset to whether it has been deleted
+    children = {}
+    for binding in ret['results']['bindings']:
+        operations.add(binding['operationFrom']['value'])
+        if 'name' in binding:
+            name = binding['name']['value']
+        if 'lineageId' in binding:
+            lineage_ids.add(binding['lineageId']['value'])
+        if 'familyId' in binding:
+            family_ids.add(binding['familyId']['value'])
+        if 'version' in binding:
+            version = binding['version']['value']
+        if 'child' in binding:
+            child = binding['child']['value']
+            is_child_deleted = 'delete' in binding['childOperation']['value']
+            children[child] = children.get(child, False) or is_child_deleted
+
+    metadata = {
+        'dataset_exists': len(operations) > 0,
+        'deleted': len(list(filter(lambda o: 'delete' in o, operations))) > 0,
+        'name': name,
+        'lineage_id': lineage_ids.pop() if len(lineage_ids) == 1 else None,
+        'family_id': family_ids.pop() if len(family_ids) == 1 else None,
+        'has_children': len(children) > 0,
+        'has_undeleted_children': not all(children.values()),
+        'num_children': len(children),
+        'version': version,
+    }
+
+    logger.debug(
+        'GET_DATASET_METADATA - METADATA: %s', metadata
+    )
+
+    if metadata['name'] is not None and metadata['lineage_id'] is not None and metadata['family_id'] is not None:
+        cache_dataset_metadata(uuid, metadata['name'], metadata['lineage_id'], metadata['family_id'])
+
+    return metadata
+
+def validate_create(uuid:str, use_known_datasets:bool=False) -> bool:
     '''
     Validates if a dataset can be created based on the condition:
     1. The dataset does not already exist
+    If use_known_datasets is True, the known_datasets filter may answer without a query
     '''
+    if use_known_datasets and is_new_dataset(uuid):
+        return True
 
     ret = validate_operation_by_uuid_SPARQL(uuid)
+    return create_condition(ret)
+
+async def validate_create_async(uuid:str) -> bool:
+    '''
+    Awaitable version of validate_create, always checked against the store
+    '''
+    ret = await validate_operation_by_uuid_SPARQL_async(uuid)
+    return create_condition(ret)
 
+def create_condition(ret:dict) -> bool:
+    '''
+    Computes the create condition from the result of validate_operation_by_uuid_SPARQL
+    '''
     logger.debug(
         'VALIDATE_CREATE - RESULT:\n\n%s', ret['results']['bindings']
     )
@@ -24,31 +247,19 @@ def validate_create(uuid:str) -> bool:
 
     return condition
 
-def validate_read(uuid:str):
+def validate_read(uuid:str, metadata:dict=None) -> dict:
     '''
     Validates if a dataset can be read based on the conditions:
     1. dataset exists
     2. dataset is not deleted
+    metadata is the result of get_dataset_metadata(uuid), which is queried if not provided
     '''
-    ret = validate_operation_by_uuid_SPARQL(uuid)
-
-    logger.debug(
-        'VALIDATE_READ - RESULT:\n\n%s', ret['results']['bindings']
-    )
-
-    # Condition 1. Check that dataset exists
-    dataset_exists = len(ret['results']['bindings']) > 0
-
-    # Condition 2. Check that dataset has not been deleted
-    # Check if delete operations have been performed on this uuid
-    operations = [entry['operationFrom']['value'] for entry in ret['results']['bindings']]
-    logger.debug("operation_validator.py/validate_read - operations: %s", operations)
-    not_deleted = len(list(filter(lambda o: 'delete' in o, operations))) == 0
-    logger.debug("operation_validator.py/validate_read - not_deleted: %s", not_deleted)
+    if metadata is None:
+        metadata = get_dataset_metadata(uuid, with_children=False)
 
     conditions = {
-        'dataset_exists': dataset_exists,
-        'not_deleted': not_deleted
+        'dataset_exists': metadata['dataset_exists'],
+        'not_deleted': not metadata['deleted']
     }
 
     logger.debug(
@@ -57,28 +268,19 @@ def validate_read(uuid:str):
 
     return conditions
 
-def validate_update(uuid:str) -> dict:
+def validate_update(uuid:str, metadata:dict=None) -> dict:
     '''
     Validates if a dataset can be updated based on the conditions:
     1. The dataset exists
     2. The dataset has not been deleted
+    metadata is the result of get_dataset_metadata(uuid), which is queried if not provided
     '''
-    ret = validate_operation_by_uuid_SPARQL(uuid)
-
-    logger.debug(
-        'VALIDATE_UPDATE - RESULT:\n\n%s', ret['results']['bindings']
-    )
-    
-    # 1. Dataset exists?
-    dataset_exists = len(ret['results']['bindings']) > 0
-    operations = [entry['operationFrom']['value'] for entry in ret['results']['bindings']]
-    
-    # 2. Dataset deleted?
-    not_deleted = len(list(filter(lambda o: 'delete' in o, operations))) == 0
+    if metadata is None:
+        metadata = get_dataset_metadata(uuid)
 
     conditions = {
-        'dataset_exists': dataset_exists,
-        'not_deleted': not_deleted
+        'dataset_exists': metadata['dataset_exists'],
+        'not_deleted': not metadata['deleted']
     }
 
     logger.debug(
@@ -87,67 +289,22 @@ def validate_update(uuid:str) -> dict:
     
     return conditions
 
-def validate_delete(uuid:str) -> dict:
+def validate_delete(uuid:str, metadata:dict=None) -> dict:
     '''
     Validates if a dataset can be deleted based on the conditions:
     1. The dataset exists
     2. The dataset has not been deleted
     3. There is not an undeleted dataset this dataset wasDerivedFrom
+    metadata is the result of get_dataset_metadata(uuid), which is queried if not provided
     '''
+    if metadata is None:
+        metadata = get_dataset_metadata(uuid)
 
-    ret = validate_operation_by_uuid_SPARQL(uuid)
-
-    logger.debug(
-        'VALIDATE_DELETE - RESULT:\n\n%s', ret['results']['bindings']
-    )
-    
-    # 1. Dataset exists?
-    dataset_exists = len(ret['results']['bindings']) > 0
-
-    # 2. Dataset deleted?
-    operations = [entry['operationFrom']['value'] for entry in ret['results']['bindings']]
-    not_deleted = len(list(filter(lambda o: 'delete' in o, operations))) == 0
-
-    # 3. Was any other undeleted dataset derivedFrom this dataset?
-    # This returns any entities that wasDerivedFrom and all of their operations
-    ret = check_was_derived_from_SPARQL(uuid)
-    logger.debug(
-        'VALIDATE_UPDATE - was_derived_from check:\n\n%s', ret['results']['bindings']
-    )
-    logger.debug("*** Inside operationvalidator/validate_delete")
-    logger.debug("Ret: %s", ret)
-
-    not_undeleted_was_derived_from = False
-    if len(ret['results']['bindings']) != 0:
-        # For each entity returned, check if the entity was deleted
-        entity_dict = {}
-        for entity in ret['results']['bindings']:
-            this_entity_val = entity['entity']['value']
-            is_entity_deleted = ('delete' in entity['operationFrom']['value'])
-            if this_entity_val in entity_dict:
-                if not entity_dict[this_entity_val]:
-                    entity_dict[this_entity_val] = is_entity_deleted
-            else:
-                entity_dict[this_entity_val] = is_entity_deleted
-
-        # Check if all entities returned have been deleted
-        are_all_entities_deleted = True
-        for _, val in entity_dict.items():
-            if not val:
-                are_all_entities_deleted = False
-                break
-        
-        # If all wasDerivedFrom entities are deleted, condition passes
-        # Otherwise, condition fails
-        not_undeleted_was_derived_from = are_all_entities_deleted
-    else:
-        # If no wasDerivedFrom entities, condition passes
-        not_undeleted_was_derived_from = True
-
+    # 3. If all wasDerivedFrom entities are deleted (or there are none), condition passes
     conditions = {
-        'dataset_exists': dataset_exists,
-        'not_deleted': not_deleted,
-        'not_undeleted_was_derived_from': not_undeleted_was_derived_from
+        'dataset_exists': metadata['dataset_exists'],
+        'not_deleted': not metadata['deleted'],
+        'not_undeleted_was_derived_from': not metadata['has_undeleted_children']
     }
 
     logger.debug(
@@ -156,29 +313,19 @@ def validate_delete(uuid:str) -> dict:
     
     return conditions
 
-def validate_delete_family_tree(uuid:str) -> dict:
+def validate_delete_family_tree(uuid:str, metadata:dict=None) -> dict:
     '''
     Validates if a family tree can be deleted based on the conditions:
     1. The dataset exists
     2. The dataset has not been deleted
+    metadata is the result of get_dataset_metadata(uuid), which is queried if not provided
     '''
-
-    ret = validate_operation_by_uuid_SPARQL(uuid)
-
-    logger.debug(
-        'VALIDATE_DELETE - RESULT:\n\n%s', ret['results']['bindings']
-    )
-    
-    # 1. Dataset exists?
-    dataset_exists = len(ret['results']['bindings']) > 0
-
-    # 2. Dataset deleted?
-    operations = [entry['operationFrom']['value'] for entry in ret['results']['bindings']]
-    not_deleted = len(list(filter(lambda o: 'delete' in o, operations))) == 0
+    if metadata is None:
+        metadata = get_dataset_metadata(uuid, with_children=False)
 
     conditions = {
-        'dataset_exists': dataset_exists,
-        'not_deleted': not_deleted,
+        'dataset_exists': metadata['dataset_exists'],
+        'not_deleted': not metadata['deleted'],
     }
 
     logger.debug(
@@ -200,34 +347,16 @@ def get_name_by_uuid(uuid:str):
     '''
     Returns the name of a dataset given its uuid
     '''
-    ret = get_name_by_uuid_SPARQL(uuid)
-
-    logger.debug(
-        'CHECK_LINEAGE_ID_BY_UUID - RESULT:\n\n%s', ret['results']['bindings']
-    )
-
-    name = ret['results']['bindings'][-1:][0]['name']['value']
-
-    return name
+    metadata = get_immutable_metadata(uuid)
+    return metadata['name'] if metadata is not None else None
 
 def get_lineage_id_by_uuid(uuid:str) -> str :
     '''
     Given a dataset's uuid, returns its lineageId
     Return format: lineageId
     '''
-    ret = get_lineage_id_by_uuid_SPARQL(uuid)
-
-    logger.debug(
-        'CHECK_LINEAGE_ID_BY_UUID - RESULT:\n\n%s', ret['results']['bindings']
-        )
-    
-    # Format result
-    result = None
-    bindings = ret['results']['bindings']
-    if len(bindings) == 1:
-        result = bindings[0]['lineageId']['value']
-
-    return result
+    metadata = get_immutable_metadata(uuid)
+    return metadata['lineage_id'] if metadata is not None else None
 
 def get_lineage_ids_by_family_id(family_id:str) -> str :
     '''
@@ -254,18 +383,15 @@ def get_family_id(uuid:str) -> str :
     Given a dataset's uuid, returns the associated familyId
     Return format: familyId
     '''
-    ret = get_family_id_SPARQL(uuid)
-
-    logger.debug(
-        'GET_FAMILY_ID - RESULT:\n\n%s', ret['results']['bindings']
-        )
+    metadata = get_immutable_metadata(uuid)
+    return metadata['family_id'] if metadata is not None else None
 
-    # Format return value
-    result = None
-    bindings = ret['results']['bindings']
-    if len(bindings) == 1:
-        result = bindings[0]['familyId']['value']
-    return result
+async def get_family_id_async(uuid:str) -> str :
+    '''
+    Awaitable version of get_family_id
+    '''
+    metadata = await get_immutable_metadata_async(uuid)
+    return metadata['family_id'] if metadata is not None else None
 
 def get_family_uuids_by_uuid(uuid:str) -> list :
     '''
@@ -288,4 +414,26 @@ def get_family_uuids_by_uuid(uuid:str) -> list :
             result.append(this_uuid_val)
 
     return result
-   
\ No newline at end of file
+   
+def get_family_metadata_by_uuid(uuid:str) -> list :
+    '''
+    Given a dataset's uuid, returns the metadata of every dataset in that family tree
+    Return format: [{'uuid': uuid1, 'name': name1, 'lineage_id': lineageId1, 'family_id': familyId}, ...]
+    '''
+    ret = get_family_metadata_by_uuid_SPARQL(uuid)
+
+    logger.debug(
+        'GET_FAMILY_METADATA_BY_UUID - RESULT:\n\n%s', ret['results']['bindings']
+        )
+
+    result = []
+    for binding in ret['results']['bindings']:
+        result.append({
+            'uuid': binding['uuid']['value'],
+            'name': binding['name']['value'],
+            'lineage_id': binding['lineageId']['value'],
+            'family_id': binding['familyId']['value']
+        })
+        cache_dataset_metadata(result[-1]['uuid'], result[-1]['name'], result[-1]['lineage_id'], result[-1]['family_id'])
+
+    return result
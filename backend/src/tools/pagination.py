@@ -0,0 +1,54 @@
+'''
+Opaque cursors for keyset pagination.
+
+A cursor encodes the sort key of the last row of a page (e.g., its timestamp and
+operation). The next page is queried for the rows strictly after that key, so the
+store never has to skip over the rows of previous pages.
+'''
+
+import base64
+import binascii
+from json import dumps, loads
+
+from tools.error_handler import CustomError
+
+
+def encode_cursor(key:list) -> str:
+    '''
+    Encodes the sort key of a row as a URL-safe cursor
+    '''
+    return base64.urlsafe_b64encode(dumps(key, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor:str, size:int) -> list:
+    '''
+    Decodes a cursor into a sort key of size values
+    When no cursor is given, the key preceding every row is returned
+    '''
+    if cursor is None:
+        return [''] * size
+
+    try:
+        key = loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        key = None
+
+    if not isinstance(key, list) or len(key) != size or not all(isinstance(value, str) for value in key):
+        raise CustomError(
+            'The provided cursor is invalid.',
+            'Lineage Tracker Backend',
+            400
+        )
+    return key
+
+
+def paginate(rows:list, limit:int, sort_key) -> tuple:
+    '''
+    Splits the limit + 1 rows fetched for a page into the page and the cursor of the next page
+    The cursor is None when there is no next page
+    '''
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(sort_key(page[-1]))
+    return page, next_cursor
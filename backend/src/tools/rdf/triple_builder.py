@@ -0,0 +1,192 @@
+'''
+Direct serializer of user/dataset/operation objects to RDF triples.
+
+Produces the same graph as graph_builder.Document, but writes the triples straight
+into N-Triples or a SPARQL INSERT DATA statement, without building a prov.ProvDocument
+and without rewriting its serialization.
+'''
+
+from dataclasses import dataclass, field
+
+from tools.rdf.graph_builder import namespaces, Dataset, Operation, User
+
+RDF_TYPE = '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>'
+PROV = 'http://www.w3.org/ns/prov#'
+DCT = 'http://purl.org/dc/terms/'
+
+PROV_ENTITY = '<' + PROV + 'Entity>'
+PROV_ACTIVITY = '<' + PROV + 'Activity>'
+PROV_AGENT = '<' + PROV + 'Agent>'
+PROV_USED = '<' + PROV + 'used>'
+PROV_WAS_ASSOCIATED_WITH = '<' + PROV + 'wasAssociatedWith>'
+PROV_WAS_GENERATED_BY = '<' + PROV + 'wasGeneratedBy>'
+PROV_WAS_ATTRIBUTED_TO = '<' + PROV + 'wasAttributedTo>'
+PROV_WAS_DERIVED_FROM = '<' + PROV + 'wasDerivedFrom>'
+DCT_IDENTIFIER = '<' + DCT + 'identifier>'
+DCT_TITLE = '<' + DCT + 'title>'
+DCT_DESCRIPTION = '<' + DCT + 'description>'
+DCT_ISSUED = '<' + DCT + 'issued>'
+
+NAMESPACE_URIS = {namespace['namespace_or_prefix']: namespace['uri'] for namespace in namespaces}
+
+FOAF_NICK = '<' + NAMESPACE_URIS['foaf'] + 'nick>'
+LINEAGE_ID = '<' + NAMESPACE_URIS['pistisDatasetLineage'] + 'id>'
+FAMILY_ID = '<' + NAMESPACE_URIS['pistisDatasetFamily'] + 'id>'
+USER_GROUP_ID = '<' + NAMESPACE_URIS['pistisUserGroup'] + 'id>'
+VERSION_INFO = '<' + NAMESPACE_URIS['owl'] + 'versionInfo>'
+
+GRAPH = '<pistisGraph:v3>'
+
+# N-Triples / SPARQL ECHAR escapes
+LITERAL_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '"': '\\"',
+    "'": "\\'",
+    '\n': '\\n',
+    '\r': '\\r',
+    '\t': '\\t',
+    '\b': '\\b',
+    '\f': '\\f',
+})
+
+
+def escape_literal(value:str) -> str:
+    '''
+    Escapes a value for use inside a double-quoted literal
+    '''
+    return str(value).translate(LITERAL_ESCAPES)
+
+
+def literal(value) -> str:
+    '''
+    Serializes a value as a plain literal
+    '''
+    return '"' + escape_literal(value) + '"'
+
+
+def iri(qualified_name:str) -> str:
+    '''
+    Expands a qualified name (e.g., pistisDataset:name-uuid) into a full IRI
+    '''
+    prefix, local_part = qualified_name.split(':', 1)
+    return '<' + NAMESPACE_URIS[prefix] + local_part + '>'
+
+
+def dataset_triples(dataset:Dataset) -> list:
+    '''
+    Returns the triples of a Dataset (PROV-O entity)
+    '''
+    subject = iri(dataset.uri)
+    return [
+        (subject, RDF_TYPE, PROV_ENTITY),
+        (subject, DCT_IDENTIFIER, literal(dataset.uuid)),
+        (subject, DCT_TITLE, literal(dataset.name)),
+        (subject, LINEAGE_ID, literal(dataset.lineage_id)),
+        (subject, FAMILY_ID, literal(dataset.family_id)),
+    ]
+
+
+def version_triple(dataset:Dataset, version:str) -> tuple:
+    '''
+    Returns the triple storing the version label of a Dataset
+    '''
+    return (iri(dataset.uri), VERSION_INFO, literal(version))
+
+
+def operation_triples(operation:Operation) -> list:
+    '''
+    Returns the triples of an Operation (PROV-O activity)
+    '''
+    dct_description = operation.type_
+    if dct_description == 'update':
+        dct_description += (":" + operation.description)
+
+    subject = iri(operation.uri)
+    return [
+        (subject, RDF_TYPE, PROV_ACTIVITY),
+        (subject, DCT_DESCRIPTION, literal(dct_description)),
+        (subject, DCT_ISSUED, literal(operation.timestamp)),
+    ]
+
+
+def user_triples(user:User) -> list:
+    '''
+    Returns the triples of a User (PROV-O agent of type Person)
+    '''
+    subject = iri(user.uri)
+    return [
+        (subject, RDF_TYPE, PROV_AGENT),
+        (subject, RDF_TYPE, literal('Person')),
+        (subject, FOAF_NICK, literal(user.name)),
+        (subject, USER_GROUP_ID, literal(user.group)),
+    ]
+
+
+@dataclass(frozen=True)
+class TripleDocument:
+    '''
+    Lightweight counterpart of graph_builder.Document
+    Holds the objects of one operation and serializes them directly to triples
+    version is the version label of a dataset written by a create or update operation
+    '''
+    user: User
+    dataset: Dataset
+    operation: Operation
+    dataset_prev: Dataset = field(default=None)
+    version: str = field(default=None)
+
+    def get_triples(self) -> list:
+        '''
+        Returns the triples of the operation performed by user on dataset (and dataset_prev)
+        '''
+        dataset = iri(self.dataset.uri)
+        operation = iri(self.operation.uri)
+        user = iri(self.user.uri)
+
+        triples = dataset_triples(self.dataset) + operation_triples(self.operation) + user_triples(self.user)
+        triples.append((operation, PROV_USED, dataset))
+        triples.append((operation, PROV_WAS_ASSOCIATED_WITH, user))
+
+        if self.operation.type_ != 'read':
+            triples.append((dataset, PROV_WAS_GENERATED_BY, operation))
+            triples.append((dataset, PROV_WAS_ATTRIBUTED_TO, user))
+
+        if self.operation.type_ == 'update':
+            triples += dataset_triples(self.dataset_prev)
+            triples.append((dataset, PROV_WAS_DERIVED_FROM, iri(self.dataset_prev.uri)))
+
+        if self.version is not None:
+            triples.append(version_triple(self.dataset, self.version))
+
+        return triples
+
+    def get_ntriples(self) -> str:
+        '''
+        Serializes the triples as N-Triples
+        '''
+        return to_ntriples(self.get_triples())
+
+
+def to_ntriples(triples:list) -> str:
+    '''
+    Serializes triples as N-Triples
+    '''
+    return ''.join(' '.join(triple) + ' .\n' for triple in triples)
+
+
+def to_insert_data(triples:list, graph:str=GRAPH) -> str:
+    '''
+    Serializes triples as a SPARQL INSERT DATA statement into graph
+    '''
+    return 'INSERT DATA\n{\nGRAPH ' + graph + '\n{\n' + to_ntriples(triples) + '}\n}'
+
+
+def to_replace_versions(versions:list, graph:str=GRAPH) -> str:
+    '''
+    Serializes a SPARQL update replacing the version labels of (Dataset, version) pairs in graph
+    '''
+    deletes = ''.join(
+        'DELETE WHERE\n{\nGRAPH ' + graph + '\n{\n' + iri(dataset.uri) + ' ' + VERSION_INFO + ' ?version .\n}\n};\n'
+        for dataset, _ in versions
+    )
+    return deletes + to_insert_data([version_triple(dataset, version) for dataset, version in versions], graph)
@@ -0,0 +1,154 @@
+'''
+Single-flight coalescing of identical concurrent calls.
+
+While a call with a given key is in flight, identical calls (same function and
+arguments) do not run again but wait for it and share its result or error.
+Requests are served by different threads, each with its own event loop for async
+views, so calls are shared through thread-safe futures rather than asyncio tasks.
+'''
+
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from tools.deadline import DeadlineExceeded, remaining_time
+
+
+class Abandoned(Exception):
+    '''
+    Set on a shared call whose caller went away (e.g., cancelled) before it finished
+    Waiting callers then run the call themselves
+    '''
+
+
+class SingleFlight:
+    '''
+    Thread-safe group of coalesced calls with per-function counters
+    '''
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        # key -> Future of the call in flight
+        self.calls = {}
+        # function name -> counters
+        self.counters = {}
+
+    def join(self, key) -> tuple:
+        '''
+        Returns the future of the call in flight for key, and whether the caller has to run it
+        '''
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self.calls[key] = future
+            return future, True
+
+    def finish(self, key, future:Future, result=None, error:BaseException=None):
+        '''
+        Publishes the outcome of the call of key to the callers waiting on it
+        '''
+        with self.lock:
+            del self.calls[key]
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            future.set_exception(Abandoned())
+
+    def record(self, name:str, shared:bool, waited:float=0):
+        '''
+        Counts a call of name, either run or shared after waiting waited seconds
+        '''
+        with self.lock:
+            counters = self.counters.setdefault(name, {'calls': 0, 'shared': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0})
+            counters['calls'] += 1
+            if shared:
+                counters['shared'] += 1
+                counters['wait_seconds'] += waited
+                counters['max_wait_seconds'] = max(counters['max_wait_seconds'], waited)
+
+    def do(self, name:str, function, *args, **kwargs):
+        '''
+        Runs function(*args, **kwargs), or waits for the identical call in flight and returns its result
+        Waiting is bounded by the deadline of the request
+        '''
+        key = (name, args, tuple(sorted(kwargs.items())))
+        while True:
+            future, leader = self.join(key)
+            if leader:
+                self.record(name, False)
+                try:
+                    result = function(*args, **kwargs)
+                except BaseException as e:
+                    self.finish(key, future, error=e)
+                    raise
+                self.finish(key, future, result)
+                return result
+
+            start = self.clock()
+            try:
+                result = future.result(timeout=remaining_time())
+            except Abandoned:
+                continue
+            except FutureTimeoutError:
+                raise DeadlineExceeded('The deadline of the request passed while waiting for an identical call.')
+            self.record(name, True, self.clock() - start)
+            return result
+
+    async def do_async(self, name:str, function, *args, **kwargs):
+        '''
+        Awaitable version of do, for coroutine functions
+        '''
+        key = (name, args, tuple(sorted(kwargs.items())))
+        while True:
+            future, leader = self.join(key)
+            if leader:
+                self.record(name, False)
+                try:
+                    result = await function(*args, **kwargs)
+                except BaseException as e:
+                    self.finish(key, future, error=e)
+                    raise
+                self.finish(key, future, result)
+                return result
+
+            start = self.clock()
+            try:
+                # shield: a waiter that gives up must not cancel the shared future
+                result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), remaining_time())
+            except Abandoned:
+                continue
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded('The deadline of the request passed while waiting for an identical call.')
+            self.record(name, True, self.clock() - start)
+            return result
+
+    def coalesced(self, f):
+        '''
+        Decorator coalescing identical concurrent calls of a (sync or async) function
+        Arguments must be hashable; calls are keyed by the function name and arguments
+        '''
+        name = f.__name__
+        if asyncio.iscoroutinefunction(f):
+            @functools.wraps(f)
+            async def wrapped(*args, **kwargs):
+                return await self.do_async(name, f, *args, **kwargs)
+        else:
+            @functools.wraps(f)
+            def wrapped(*args, **kwargs):
+                return self.do(name, f, *args, **kwargs)
+        return wrapped
+
+    def stats(self) -> dict:
+        '''
+        Returns the counters of every coalesced function
+        shared is the number of calls answered by an identical call in flight, which the store did not see
+        '''
+        with self.lock:
+            return {name: dict(counters) for name, counters in self.counters.items()}
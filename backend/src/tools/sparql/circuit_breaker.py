@@ -0,0 +1,94 @@
+'''
+Circuit breaker for calls to the triple store.
+
+After failure_threshold consecutive failures the breaker opens, and calls are
+rejected immediately instead of waiting on a store that is down or overloaded.
+After reset_timeout seconds a single trial call is let through (half-open):
+its success closes the breaker again, its failure re-opens it.
+'''
+
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    '''
+    Raised when a call is rejected by an open circuit breaker
+    '''
+    def __init__(self, retry_after:float):
+        self.retry_after = retry_after
+        super().__init__('Circuit breaker is open, retry after {:.0f}s.'.format(retry_after))
+
+
+class CircuitBreaker:
+    '''
+    Thread-safe circuit breaker
+    '''
+    def __init__(self, failure_threshold:int, reset_timeout:float, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        '''
+        Returns the current state (closed, open or half-open)
+        '''
+        with self.lock:
+            if self.opened_at is None:
+                return CLOSED
+            if self.trial_in_flight or self.clock() - self.opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return OPEN
+
+    def before_call(self):
+        '''
+        Admits a call, or raises CircuitOpenError if the breaker is open
+        Every admitted call must be followed by record_success, record_failure or release
+        '''
+        with self.lock:
+            if self.opened_at is None:
+                return
+
+            elapsed = self.clock() - self.opened_at
+            if elapsed < self.reset_timeout:
+                raise CircuitOpenError(self.reset_timeout - elapsed)
+            if self.trial_in_flight:
+                raise CircuitOpenError(1)
+            self.trial_in_flight = True
+
+    def record_success(self):
+        '''
+        Records that the store answered, closing the breaker
+        '''
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        '''
+        Records a failed call, opening the breaker after failure_threshold consecutive failures
+        A failed trial call re-opens the breaker immediately
+        '''
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = self.clock()
+            self.trial_in_flight = False
+
+    def release(self):
+        '''
+        Ends an admitted call that never reached the store, without recording an outcome
+        '''
+        with self.lock:
+            self.trial_in_flight = False
@@ -0,0 +1,142 @@
+import asyncio
+import contextvars
+import csv
+import functools
+import io
+import logging
+import os
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPDigestAuth
+
+from tools.deadline import deadline_timeout
+
+logger = logging.getLogger('wrapper')
+
+SPARQL_POOL_SIZE = int(os.getenv('SPARQL_POOL_SIZE', '10'))
+SPARQL_CONNECT_TIMEOUT = float(os.getenv('SPARQL_CONNECT_TIMEOUT', '5'))
+SPARQL_READ_TIMEOUT = float(os.getenv('SPARQL_READ_TIMEOUT', '60'))
+
+JSON_RESULTS = 'application/sparql-results+json'
+CSV_RESULTS = 'text/csv'
+
+
+class SPARQLClient:
+    '''
+    Thread-safe client for a SPARQL endpoint
+
+    Unlike a shared SPARQLWrapper object, no query state is kept on the client:
+    every call receives its own query string, so concurrent requests cannot
+    overwrite each other's queries.
+    Connections are kept alive in a bounded pool (pool_block=True), so at most
+    pool_size connections are opened and the digest handshake is only paid once
+    per thread, as HTTPDigestAuth reuses the server nonce for later requests.
+    Timeouts are limited to the time left until the deadline of the current request.
+    '''
+    def __init__(self, endpoint:str, username:str=None, password:str=None, pool_size:int=SPARQL_POOL_SIZE,
+                 connect_timeout:float=SPARQL_CONNECT_TIMEOUT, read_timeout:float=SPARQL_READ_TIMEOUT):
+        self.endpoint = endpoint
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if username is not None:
+            self.session.auth = HTTPDigestAuth(username, password)
+
+    def query(self, query:str) -> dict:
+        '''
+        Runs a SPARQL query (SELECT/ASK) and returns the decoded JSON result
+        '''
+        response = self.session.post(
+            self.endpoint,
+            data={'query': query, 'format': JSON_RESULTS},
+            headers={'Accept': JSON_RESULTS},
+            timeout=deadline_timeout(self.timeout)
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def query_rows(self, query:str):
+        '''
+        Runs a SPARQL SELECT query and yields its solutions one at a time
+
+        The result is requested in the SPARQL CSV format and decoded while it is
+        received, so only the current row is held in memory.
+        Every row is a dict of variable name to value; unbound variables are None.
+        '''
+        response = self.session.post(
+            self.endpoint,
+            data={'query': query, 'format': CSV_RESULTS},
+            headers={'Accept': CSV_RESULTS},
+            timeout=deadline_timeout(self.timeout),
+            stream=True
+        )
+        try:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            # TextIOWrapper reads once more at the end of the body, which fails on an auto-closed stream
+            response.raw.auto_close = False
+            reader = csv.reader(io.TextIOWrapper(response.raw, encoding='utf-8', newline=''))
+            variables = next(reader, [])
+            for values in reader:
+                yield {variable: value if value != '' else None for variable, value in zip(variables, values)}
+        finally:
+            response.close()
+
+    def update(self, update:str):
+        '''
+        Runs a SPARQL Update (e.g., INSERT DATA) and returns the endpoint's response
+        '''
+        response = self.session.post(
+            self.endpoint,
+            data={'update': update},
+            headers={'Accept': JSON_RESULTS},
+            timeout=deadline_timeout(self.timeout)
+        )
+        response.raise_for_status()
+        if 'json' in response.headers.get('Content-Type', ''):
+            return response.json()
+        return response.text
+
+    def close(self):
+        '''
+        Closes all pooled connections
+        '''
+        self.session.close()
+
+
+class AsyncSPARQLClient:
+    '''
+    asyncio interface to a SPARQLClient
+
+    Blocking calls run on a dedicated executor sized to the connection pool, so
+    independent queries awaited together (e.g., with asyncio.gather) run concurrently
+    over the pooled keep-alive connections.
+    '''
+    def __init__(self, client:SPARQLClient):
+        self.client = client
+        self.executor = ThreadPoolExecutor(max_workers=client.pool_size, thread_name_prefix='sparql')
+
+    async def run(self, function, *args):
+        '''
+        Runs a blocking function on the executor, preserving the caller's context variables
+        '''
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, function, *args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    async def query(self, query:str) -> dict:
+        '''
+        Runs a SPARQL query (SELECT/ASK) and returns the decoded JSON result
+        '''
+        return await self.run(self.client.query, query)
+
+    async def update(self, update:str):
+        '''
+        Runs a SPARQL Update (e.g., INSERT DATA) and returns the endpoint's response
+        '''
+        return await self.run(self.client.update, update)
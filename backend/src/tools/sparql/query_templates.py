@@ -0,0 +1,552 @@
+'''
+Registry of named SPARQL query templates.
+
+Templates are parsed once at import: the PREFIX block is built a single time from the
+graph namespaces, and every template body is split into its static text and its
+placeholders. Placeholders are written as %(name)s and must be declared with a type,
+so that bound values are always serialized as properly escaped SPARQL terms.
+'''
+
+import re
+
+from tools.rdf.graph_builder import namespaces
+from tools.rdf.triple_builder import escape_literal
+
+XSD_STRING = '<http://www.w3.org/2001/XMLSchema#string>'
+
+PLACEHOLDER_PATTERN = re.compile(r'%\((\w+)\)s')
+
+def build_prefix_block(namespaces:list) -> str:
+    '''
+    Returns the PREFIX declarations for the given namespaces (plus prov)
+    '''
+    prefixes = ['PREFIX {}: <{}>'.format(namespace['namespace_or_prefix'], namespace['uri']) for namespace in namespaces]
+    return '\n'.join(prefixes) + '\nPREFIX prov:<http://www.w3.org/ns/prov#>\n\n'
+
+
+def serialize_string(value) -> str:
+    '''
+    Serializes a value as an xsd:string typed literal
+    '''
+    return '"{}"^^{}'.format(escape_literal(value), XSD_STRING)
+
+
+def serialize_literal(value) -> str:
+    '''
+    Serializes a value as a plain (simple) literal
+    '''
+    return '"{}"'.format(escape_literal(value))
+
+
+def serialize_integer(value) -> str:
+    '''
+    Serializes a value as an integer, rejecting anything that is not one
+    '''
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise TypeError('Expected an integer, got {!r}'.format(value))
+    return str(value)
+
+
+SERIALIZERS = {
+    'string': serialize_string,
+    'literal': serialize_literal,
+    'integer': serialize_integer,
+}
+
+PREFIXES = build_prefix_block(namespaces)
+
+
+class QueryTemplate:
+    '''
+    Precompiled SPARQL query with typed parameters
+    '''
+    def __init__(self, name:str, body:str, params:dict):
+        self.name = name
+        self.params = params
+
+        # Split body into static text segments and placeholder names
+        parts = PLACEHOLDER_PATTERN.split(body)
+        self.segments = parts[0::2]
+        self.placeholders = parts[1::2]
+
+        undeclared = set(self.placeholders) - set(params)
+        if undeclared:
+            raise ValueError('Template {} uses undeclared parameters: {}'.format(name, sorted(undeclared)))
+        unknown_types = set(params.values()) - set(SERIALIZERS)
+        if unknown_types:
+            raise ValueError('Template {} uses unknown parameter types: {}'.format(name, sorted(unknown_types)))
+
+        self.serializers = {param: SERIALIZERS[type_] for param, type_ in params.items()}
+
+    def bind(self, **values) -> str:
+        '''
+        Returns the full query (PREFIX block included) with all parameters bound
+        '''
+        missing = set(self.params) - set(values)
+        if missing:
+            raise ValueError('Template {} is missing parameters: {}'.format(self.name, sorted(missing)))
+
+        terms = {param: serializer(values[param]) for param, serializer in self.serializers.items()}
+        query = [PREFIXES]
+        for segment, placeholder in zip(self.segments, self.placeholders):
+            query.append(segment)
+            query.append(terms[placeholder])
+        query.append(self.segments[-1])
+        return ''.join(query)
+
+
+QUERIES = {}
+
+
+def register_query(name:str, body:str, **params) -> QueryTemplate:
+    '''
+    Adds a query template to the registry
+    '''
+    template = QueryTemplate(name, body, params)
+    QUERIES[name] = template
+    return template
+
+
+def render_query(name:str, **values) -> str:
+    '''
+    Binds the parameters of a registered query template
+    '''
+    return QUERIES[name].bind(**values)
+
+
+register_query('get_name_by_uuid', '''
+    SELECT ?name
+    FROM <pistisGraph:v3>
+    {
+	    ?d a prov:Entity;
+        dct:identifier %(uuid)s;
+        dct:title ?name.
+    }
+    ''', uuid='string')
+
+DATASET_HISTORY_QUERY = '''
+    SELECT ?operation ?operationDescription ?timestamp ?associatedUser ?associatedUserGroup ?previousUUID ?nextUUID
+
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        {
+            ?operation a prov:Activity;
+                prov:used ?dataset;
+                prov:wasAssociatedWith ?User.
+        }
+        UNION
+        {
+            ?operation a prov:Activity;
+                prov:used ?nextDataset;
+                prov:wasAssociatedWith ?User;
+                dcterms:description ?desc.
+            FILTER(CONTAINS(LCASE(STR(?desc)), "update"))
+            ?nextDataset prov:wasDerivedFrom ?dataset.
+        }
+
+        ?operation dct:description ?operationDescription;
+            dct:issued ?timestamp.
+        ?dataset dct:identifier %(uuid)s.
+        ?User foaf:nick ?associatedUser.
+        ?User pistisUserGroup:id ?associatedUserGroup.
+%(user_group_filter)s
+        OPTIONAL {
+            ?dataset prov:wasDerivedFrom ?previousDataset.
+            ?previousDataset dct:identifier ?previousUUID.
+        }
+
+        OPTIONAL {
+            ?nextDataset prov:wasDerivedFrom ?dataset.
+            ?nextDataset dct:identifier ?nextUUID.
+        }
+%(page_filter)s
+    }
+    ORDER BY STR(?timestamp) STR(?operation) COALESCE(STR(?nextUUID), "")
+%(page_limit)s
+    '''
+USER_GROUP_FILTER = '''
+        FILTER(STR(?associatedUserGroup) = %(user_group)s)
+'''
+# Keyset pagination: rows strictly after the (timestamp, operation, nextUUID) key of the previous page
+DATASET_HISTORY_PAGE_FILTER = '''
+        FILTER(STR(?timestamp) > %(after_timestamp)s
+            || (STR(?timestamp) = %(after_timestamp)s && STR(?operation) > %(after_operation)s)
+            || (STR(?timestamp) = %(after_timestamp)s && STR(?operation) = %(after_operation)s
+                && COALESCE(STR(?nextUUID), "") > %(after_next_uuid)s))
+'''
+PAGE_LIMIT = '''
+    LIMIT %(limit)s
+'''
+
+def dataset_history_query(user_group_filter:str='', page_filter:str='', page_limit:str='') -> str:
+    '''
+    Returns the dataset history query body with the given filter and limit fragments
+    '''
+    return DATASET_HISTORY_QUERY \
+        .replace('%(user_group_filter)s', user_group_filter) \
+        .replace('%(page_filter)s', page_filter) \
+        .replace('%(page_limit)s', page_limit)
+
+DATASET_HISTORY_PAGE_PARAMS = {
+    'after_timestamp': 'literal',
+    'after_operation': 'literal',
+    'after_next_uuid': 'literal',
+    'limit': 'integer',
+}
+
+register_query('select_dataset_history_by_uuid',
+               dataset_history_query(),
+               uuid='string')
+register_query('select_dataset_history_by_uuid_and_user_group',
+               dataset_history_query(USER_GROUP_FILTER),
+               uuid='string', user_group='literal')
+register_query('select_dataset_history_page_by_uuid',
+               dataset_history_query('', DATASET_HISTORY_PAGE_FILTER, PAGE_LIMIT),
+               uuid='string', **DATASET_HISTORY_PAGE_PARAMS)
+register_query('select_dataset_history_page_by_uuid_and_user_group',
+               dataset_history_query(USER_GROUP_FILTER, DATASET_HISTORY_PAGE_FILTER, PAGE_LIMIT),
+               uuid='string', user_group='literal', **DATASET_HISTORY_PAGE_PARAMS)
+
+USER_HISTORY_QUERY = '''
+    SELECT ?operation ?operationDescription ?timestamp ?datasetUUID ?datasetTitle ?previousDataset ?previousUUID ?associatedUserGroup
+
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?operation a prov:Activity;
+            prov:used ?dataset;
+            prov:wasAssociatedWith ?User.
+
+        ?operation dct:description ?operationDescription;
+            dct:issued ?timestamp.
+        ?dataset dct:identifier ?datasetUUID;
+            dct:title ?datasetTitle.
+        ?User pistisUserGroup:id ?associatedUserGroup.
+
+        # Check if the User variable contains the username
+        ?User foaf:nick ?associatedUser.
+        FILTER(CONTAINS(LCASE(STR(?associatedUser)), LCASE(%(username)s)))
+
+        OPTIONAL {
+            ?dataset prov:wasDerivedFrom ?previousDataset.
+            ?previousDataset dct:identifier ?previousUUID
+        }
+%(page_filter)s
+    }
+    ORDER BY STR(?timestamp) STR(?operation)
+%(page_limit)s
+    '''
+# Keyset pagination: rows strictly after the (timestamp, operation) key of the previous page
+USER_HISTORY_PAGE_FILTER = '''
+        FILTER(STR(?timestamp) > %(after_timestamp)s
+            || (STR(?timestamp) = %(after_timestamp)s && STR(?operation) > %(after_operation)s))
+'''
+
+register_query('select_user_history_by_username',
+               USER_HISTORY_QUERY.replace('%(page_filter)s', '').replace('%(page_limit)s', ''),
+               username='literal')
+register_query('select_user_history_page_by_username',
+               USER_HISTORY_QUERY.replace('%(page_filter)s', USER_HISTORY_PAGE_FILTER).replace('%(page_limit)s', PAGE_LIMIT),
+               username='literal', after_timestamp='literal', after_operation='literal', limit='integer')
+
+register_query('select_lineage_by_lineage_id', '''
+    SELECT ?id ?title ?operationDescription ?operationBy ?associatedUserGroup ?titleFrom ?timestamp ?previousUUID
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?d a prov:Entity;
+        prov:wasAttributedTo ?attributed;
+        prov:wasGeneratedBy ?operationFrom;
+        dct:identifier ?id;
+        pistisDatasetLineage:id %(lineage_id)s;
+        dct:title ?title.
+        ?operationFrom dct:description ?operationDescription.
+
+        OPTIONAL {
+            ?d prov:wasDerivedFrom ?previousDataset.
+            ?previousDataset dct:identifier ?previousUUID
+        }
+
+        ?operationFrom dct:issued ?timestamp.
+        ?attributed foaf:nick ?operationBy.
+        ?attributed pistisUserGroup:id ?associatedUserGroup.
+      }
+    ''', lineage_id='string')
+
+# Revision queries: the newest timestamp and the number of operations that can change a response,
+# used to build ETags without running the (much larger) response query
+register_query('get_dataset_history_revision', '''
+    SELECT (MAX(STR(?timestamp)) AS ?lastIssued) (COUNT(DISTINCT ?operation) AS ?operations)
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?dataset dct:identifier %(uuid)s.
+        {
+            ?operation prov:used ?dataset.
+        }
+        UNION
+        {
+            ?operation prov:used ?nextDataset.
+            ?nextDataset prov:wasDerivedFrom ?dataset.
+        }
+        ?operation dct:issued ?timestamp.
+    }
+    ''', uuid='string')
+
+register_query('get_lineage_revision', '''
+    SELECT (MAX(STR(?timestamp)) AS ?lastIssued) (COUNT(DISTINCT ?operation) AS ?operations)
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?d pistisDatasetLineage:id %(lineage_id)s;
+        prov:wasGeneratedBy ?operation.
+        ?operation dct:issued ?timestamp.
+    }
+    ''', lineage_id='string')
+
+register_query('get_family_revision', '''
+    SELECT (MAX(STR(?timestamp)) AS ?lastIssued) (COUNT(DISTINCT ?operation) AS ?operations)
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?d pistisDatasetFamily:id %(family_id)s;
+        prov:wasGeneratedBy ?operation.
+        ?operation dct:issued ?timestamp.
+    }
+    ''', family_id='string')
+
+register_query('validate_operation_by_uuid', '''
+    SELECT ?operationFrom
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?d a prov:Entity;
+        prov:wasGeneratedBy ?operationFrom;
+        dct:identifier %(uuid)s.
+    }
+    ''', uuid='string')
+
+# Keyset pagination over all dataset identifiers, strictly after the last identifier of the previous page
+register_query('select_dataset_uuids_page', '''
+    SELECT DISTINCT ?uuid
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?d a prov:Entity;
+        prov:wasGeneratedBy ?operationFrom;
+        dct:identifier ?uuid.
+        FILTER(STR(?uuid) > %(after_uuid)s)
+    }
+    ORDER BY STR(?uuid)
+    LIMIT %(limit)s
+    ''', after_uuid='literal', limit='integer')
+
+register_query('check_was_derived_from', '''
+    SELECT ?entity ?operationFrom
+    FROM <pistisGraph:v3>
+    WHERE {
+        ?entity a prov:Entity;
+        prov:wasGeneratedBy ?operationFrom;
+        prov:wasDerivedFrom ?entityDerived.
+        ?entityDerived dct:identifier %(uuid)s.
+    }
+    ''', uuid='string')
+
+register_query('check_lineage_node', '''
+    SELECT ?d
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?d a prov:Entity ;
+        prov:wasDerivedFrom ?from .
+        ?from dct:identifier %(uuid)s .
+    }
+    ''', uuid='string')
+
+register_query('get_status_by_uuid', '''
+    SELECT ?status
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?d a prov:Entity;
+        adms:status ?status;
+        dct:identifier %(uuid)s.
+    }
+    ''', uuid='string')
+
+register_query('get_lineage_id_by_uuid', '''
+    SELECT ?lineageId
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+       ?d a prov:Entity;
+        pistisDatasetLineage:id ?lineageId;
+        dct:identifier %(uuid)s.
+    }
+    ''', uuid='string')
+
+register_query('get_lineage_id_by_family_id', '''
+    SELECT ?lineageId
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?d a prov:Entity ;
+        pistisDatasetLineage:id ?lineageId ;
+        pistisDatasetFamily:id %(family_id)s.
+    }
+    ''', family_id='string')
+
+register_query('get_family_id', '''
+    SELECT ?familyId
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?d a prov:Entity;
+        pistisDatasetFamily:id ?familyId;
+        dct:identifier %(uuid)s.
+    }
+    ''', uuid='string')
+
+register_query('get_family_uuids_by_uuid', '''
+        SELECT ?uuid
+        FROM <pistisGraph:v3>
+        WHERE
+        {
+            ?dataset a prov:Entity;
+                dct:identifier %(uuid)s;
+                pistisDatasetFamily:id ?familyId.
+
+            ?otherDataset a prov:Entity;
+                pistisDatasetFamily:id ?familyId;
+                dct:identifier ?uuid.
+        }
+        ''', uuid='string')
+
+register_query('get_dataset_metadata', '''
+    SELECT ?operationFrom ?name ?lineageId ?familyId ?version ?child ?childOperation
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?d a prov:Entity;
+        prov:wasGeneratedBy ?operationFrom;
+        dct:identifier %(uuid)s.
+
+        OPTIONAL { ?d dct:title ?name. }
+        OPTIONAL { ?d pistisDatasetLineage:id ?lineageId. }
+        OPTIONAL { ?d pistisDatasetFamily:id ?familyId. }
+        OPTIONAL { ?d owl:versionInfo ?version. }
+
+        OPTIONAL {
+            ?child a prov:Entity;
+            prov:wasGeneratedBy ?childOperation;
+            prov:wasDerivedFrom ?d.
+        }
+    }
+    ''', uuid='string')
+
+register_query('select_family_tree_by_family_id', '''
+    SELECT ?id ?lineageId ?title ?operationDescription ?operationBy ?associatedUserGroup ?timestamp ?previousUUID ?version
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?d a prov:Entity;
+        prov:wasAttributedTo ?attributed;
+        prov:wasGeneratedBy ?operationFrom;
+        dct:identifier ?id;
+        pistisDatasetLineage:id ?lineageId;
+        pistisDatasetFamily:id %(family_id)s;
+        dct:title ?title.
+        ?operationFrom dct:description ?operationDescription.
+
+        OPTIONAL { ?d owl:versionInfo ?version. }
+
+        OPTIONAL {
+            ?d prov:wasDerivedFrom ?previousDataset.
+            ?previousDataset dct:identifier ?previousUUID
+        }
+
+        ?operationFrom dct:issued ?timestamp.
+        ?attributed foaf:nick ?operationBy.
+        ?attributed pistisUserGroup:id ?associatedUserGroup.
+      }
+    ''', family_id='string')
+
+# Deepest max_depth answered with unrolled fixed-length paths; deeper limits use prov:wasDerivedFrom+
+DESCENDANTS_MAX_UNROLLED_DEPTH = 8
+
+def select_descendants_body(derivation:str) -> str:
+    '''
+    Returns a query for the datasets ?d whose derivation pattern leads to the dataset ?ancestor with uuid
+    Datasets are projected like in select_family_tree_by_family_id
+    '''
+    return '''
+    SELECT ?id ?lineageId ?title ?operationDescription ?operationBy ?associatedUserGroup ?timestamp ?previousUUID ?version
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?ancestor a prov:Entity;
+        dct:identifier %(uuid)s.
+
+        ''' + derivation + '''
+
+        ?d a prov:Entity;
+        prov:wasAttributedTo ?attributed;
+        prov:wasGeneratedBy ?operationFrom;
+        dct:identifier ?id;
+        pistisDatasetLineage:id ?lineageId;
+        dct:title ?title.
+        ?operationFrom dct:description ?operationDescription.
+
+        OPTIONAL { ?d owl:versionInfo ?version. }
+
+        OPTIONAL {
+            ?d prov:wasDerivedFrom ?previousDataset.
+            ?previousDataset dct:identifier ?previousUUID
+        }
+
+        ?operationFrom dct:issued ?timestamp.
+        ?attributed foaf:nick ?operationBy.
+        ?attributed pistisUserGroup:id ?associatedUserGroup.
+    }
+    '''
+
+# Every dataset derived, directly or transitively, from uuid
+register_query('select_descendants_by_uuid', select_descendants_body('?d prov:wasDerivedFrom+ ?ancestor.'), uuid='string')
+
+# Datasets derived from uuid through at most max_depth derivations, one fixed-length path per depth
+for max_depth in range(1, DESCENDANTS_MAX_UNROLLED_DEPTH + 1):
+    register_query('select_descendants_by_uuid_depth_%d' % max_depth, select_descendants_body('\n        UNION\n        '.join(
+        '{ ?d ' + '/'.join(['prov:wasDerivedFrom'] * depth) + ' ?ancestor. }' for depth in range(1, max_depth + 1)
+    )), uuid='string')
+
+# Keyset pagination over all family ids, strictly after the last family id of the previous page
+register_query('select_family_ids_page', '''
+    SELECT DISTINCT ?familyId
+    FROM <pistisGraph:v3>
+    WHERE
+    {
+        ?d a prov:Entity;
+        pistisDatasetFamily:id ?familyId.
+        FILTER(STR(?familyId) > %(after_family_id)s)
+    }
+    ORDER BY STR(?familyId)
+    LIMIT %(limit)s
+    ''', after_family_id='literal', limit='integer')
+
+register_query('get_family_metadata_by_uuid', '''
+        SELECT DISTINCT ?uuid ?name ?lineageId ?familyId
+        FROM <pistisGraph:v3>
+        WHERE
+        {
+            ?dataset a prov:Entity;
+                dct:identifier %(uuid)s;
+                pistisDatasetFamily:id ?familyId.
+
+            ?otherDataset a prov:Entity;
+                pistisDatasetFamily:id ?familyId;
+                dct:identifier ?uuid;
+                dct:title ?name;
+                pistisDatasetLineage:id ?lineageId.
+        }
+        ''', uuid='string')
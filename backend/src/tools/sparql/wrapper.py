@@ -1,570 +1,403 @@
+import asyncio
 import http.client as http_client
 import logging
+import math
 import os
-import re
-from SPARQLWrapper import SPARQLWrapper, JSON
+import requests
 
-from tools.sparql.groundlevel_tools.regex_query_builder import re_convert_insert, re_get_namespaces_rdf_query
-from tools.rdf.graph_builder import namespaces, Document
-from tools.error_handler import CustomError
+from tools.deadline import DeadlineExceeded
+from tools.sparql.circuit_breaker import CircuitBreaker, CircuitOpenError
+from tools.sparql.client import AsyncSPARQLClient, SPARQLClient
+from tools.sparql.query_templates import DESCENDANTS_MAX_UNROLLED_DEPTH, render_query
+from tools.rdf.triple_builder import TripleDocument, to_insert_data, to_replace_versions
+from tools.error_handler import CustomError, ServiceUnavailableError
 
 http_client.HTTPConnection.debuglevel = 1
 logger = logging.getLogger('wrapper')
 
 virtuoso_host = os.getenv('VIRTUOSO_HOST', 'http://lineage-information-store:8890')
 
-sparql = SPARQLWrapper(
-    virtuoso_host + '/sparql-auth')
-sparql.setHTTPAuth('DIGEST')
-sparql.setCredentials('dba', 'dba')
-sparql.setReturnFormat(JSON)
+virtuoso_user = os.getenv('VIRTUOSO_USER', 'dba')
+virtuoso_password = os.getenv('VIRTUOSO_PASSWORD', 'dba')
 
-# Actual SPARQL queries  
-def insert_SPARQL(document:Document):
-    '''
-    Inserts document into rdf graph
-    '''
-    rdf_string = document.get_serialized_rdf_graph()
-    pattern = r'((@prefix)( \S+: <\S+> ).(\n+))+?(\{(?s).*\})?'
-    query = re.sub(pattern, re_convert_insert, rdf_string)
-    
-    logger.debug(
-        'INSERT_SPARQL - QUERY:\n\n%s', query
-    )
+SPARQL_BREAKER_FAILURE_THRESHOLD = int(os.getenv('SPARQL_BREAKER_FAILURE_THRESHOLD', '5'))
+SPARQL_BREAKER_RESET_TIMEOUT = float(os.getenv('SPARQL_BREAKER_RESET_TIMEOUT', '30'))
+
+# Shared across threads; the client keeps no per-query state
+client = SPARQLClient(
+    virtuoso_host + '/sparql-auth',
+    username=virtuoso_user,
+    password=virtuoso_password
+)
+async_client = AsyncSPARQLClient(client)
 
-    # Sets the sparql query
-    sparql.setQuery(query)
+# Shared by all store calls, so requests fail fast with a 503 while the store is down
+breaker = CircuitBreaker(SPARQL_BREAKER_FAILURE_THRESHOLD, SPARQL_BREAKER_RESET_TIMEOUT)
 
+def check_breaker(label:str):
+    '''
+    Admits a store call, or raises a 503 with a retry hint while the circuit breaker is open
+    '''
     try:
-        # Executes the query and retrieves results
-        result = sparql.queryAndConvert()
-        return result
-    except Exception as e:
-        logger.error('500 - ERROR - INSERT_SPARQL - VIRTUOSO TRIPLE STORE - %s', str(e))
-        raise CustomError(
-            str(e),
+        breaker.before_call()
+    except CircuitOpenError as e:
+        retry_after = math.ceil(e.retry_after)
+        logger.error(
+            '503 - ERROR - %s - VIRTUOSO TRIPLE STORE - CIRCUIT OPEN - RETRY AFTER %ss', label, retry_after
+        )
+        raise ServiceUnavailableError(
+            'Virtuoso Triple Store is unavailable, please retry later.',
             'Virtuoso Triple Store',
-            500
+            retry_after
         )
 
-def get_name_by_uuid_SPARQL(uuid:str):
+def store_error(e:Exception, label:str) -> CustomError:
     '''
-    Queries rdf graph for dataset name given uuid
+    Records the outcome of a failed store call in the circuit breaker and
+    returns the error to raise: 504 for timeouts, 500 otherwise
     '''
-    #the generation of an empty document to only access the namespaces for _creation unrelated_ SPARQL queries
-    empty_document = Document(namespaces)
-    namespaces_rdf = empty_document.get_rdf_namespaces()
-    namespaces_rdf_query = re_get_namespaces_rdf_query(namespaces_rdf)
-    
-    query = '''
-    SELECT ?name
-    FROM <pistisGraph:v3> 
-    {
-	    ?d a prov:Entity;
-        %1;
-        dct:title ?name.
-    }
-    '''
-    query = namespaces_rdf_query + re.sub(r'%1', 'dct:identifier "{}"^^<http://www.w3.org/2001/XMLSchema#string>'.format(uuid), query)  
-    logger.debug(
-        'GET_NAME_BY_UUID_SPARQL - QUERY:\n\n%s', query
-        )
-    
-    sparql.setQuery(query)
-    try:
-        return sparql.queryAndConvert()
-        
-    except Exception as e:
-        logger.error(
-            '500 - ERROR - GET_NAME_TYPE_UUID_SPARQL - VIRTUOSO TRIPLE STORE - %s', str(e)
+    if isinstance(e, DeadlineExceeded):
+        # The store was not called
+        breaker.release()
+    elif isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code < 500:
+        # The store answered, the query was rejected
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+
+    if isinstance(e, (DeadlineExceeded, requests.Timeout)):
+        error = CustomError(
+            'Virtuoso Triple Store did not answer within the deadline of the request.',
+            'Virtuoso Triple Store',
+            504
         )
-        raise CustomError(
+    else:
+        error = CustomError(
             str(e),
             'Virtuoso Triple Store',
             500
         )
 
-def select_dataset_history_by_uuid_SPARQL(uuid: str, user_group=None):
-    '''
-    Queries RDF graph for dataset history given uuid
-    '''
-    empty_document = Document(namespaces)
-    namespaces_rdf = empty_document.get_rdf_namespaces()
-    namespaces_rdf_query = re_get_namespaces_rdf_query(namespaces_rdf)
-    
-    # Base query
-    query = '''
-    SELECT ?operationDescription ?timestamp ?associatedUser ?associatedUserGroup ?previousUUID ?nextUUID
-
-    FROM <pistisGraph:v3> 
-    WHERE
-    {{
-        {{
-            ?operation a prov:Activity;
-                prov:used ?dataset;
-                prov:wasAssociatedWith ?User.
-        }}
-        UNION
-        {{
-            ?operation a prov:Activity;
-                prov:used ?nextDataset;
-                prov:wasAssociatedWith ?User;
-                dcterms:description ?desc.
-            FILTER(CONTAINS(LCASE(STR(?desc)), "update"))
-            ?nextDataset prov:wasDerivedFrom ?dataset.
-        }}
-
-        ?operation dct:description ?operationDescription;
-            dct:issued ?timestamp.
-        ?dataset dct:identifier "{}"^^<http://www.w3.org/2001/XMLSchema#string>.
-        ?User foaf:nick ?associatedUser.
-        ?User pistisUserGroup:id ?associatedUserGroup.
-'''.format(uuid)  # Note: Do not close the WHERE clause here
-
-    # If user_group is provided, add a FILTER inside the WHERE clause
-    if user_group:
-        query += '''
-        FILTER(STR(?associatedUserGroup) = "{}")
-        '''.format(user_group)
-    
-    # Append optional clauses and close the WHERE clause
-    query += '''
-        OPTIONAL {
-            ?dataset prov:wasDerivedFrom ?previousDataset.
-            ?previousDataset dct:identifier ?previousUUID.
-        }
-
-        OPTIONAL {
-            ?nextDataset prov:wasDerivedFrom ?dataset.
-            ?nextDataset dct:identifier ?nextUUID.
-        }
-    }
-    '''
-
-    # Combine namespaces and query
-    query = namespaces_rdf_query + query
-
-    logger.debug('SELECT_HISTORY_UUID_SPARQL - QUERY:\n\n%s', query)
-    
-    sparql.setQuery(query)
+    logger.error(
+        '%s - ERROR - %s - VIRTUOSO TRIPLE STORE - %s', error.status_code, label, str(e)
+    )
+    return error
+
+def call_store(function, argument:str, label:str):
+    '''
+    Runs a client call through the circuit breaker
+    Any store error is logged under label and raised as a CustomError
+    '''
+    check_breaker(label)
     try:
-        return sparql.queryAndConvert()
+        result = function(argument)
     except Exception as e:
-        logger.error(
-            '500 - ERROR - SELECT_HISTORY_UUID_SPARQL - VIRTUOSO TRIPLE STORE - %s', str(e)
-        )
-        raise CustomError(str(e), 'Virtuoso Triple Store', 500)
+        raise store_error(e, label)
+    breaker.record_success()
+    return result
 
+def execute_query(query:str, label:str):
+    '''
+    Runs a SELECT query against the triple store
+    Any store error is logged under label and raised as a CustomError
+    '''
+    logger.debug(
+        '%s - QUERY:\n\n%s', label, query
+    )
+    return call_store(client.query, query, label)
 
+async def execute_query_async(query:str, label:str):
+    '''
+    Awaitable version of execute_query
+    '''
+    logger.debug(
+        '%s - QUERY:\n\n%s', label, query
+    )
 
+    check_breaker(label)
+    try:
+        result = await async_client.query(query)
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    except Exception as e:
+        raise store_error(e, label)
+    breaker.record_success()
+    return result
 
-def select_user_history_by_uuid_SPARQL(username:str):
+def execute_query_rows(query:str, label:str):
     '''
-    Queries rdf graph for user history given username
+    Runs a SELECT query against the triple store and yields its rows lazily
+    Any store error, including one raised while rows are received, is raised as a CustomError
     '''
-    empty_document = Document(namespaces)
-    namespaces_rdf = empty_document.get_rdf_namespaces()
-    namespaces_rdf_query = re_get_namespaces_rdf_query(namespaces_rdf)
-    
-    # SPARQL query template
-    query = '''
-    SELECT ?operationDescription ?timestamp ?datasetUUID ?datasetTitle ?previousDataset ?previousUUID ?associatedUserGroup
-
-    FROM <pistisGraph:v3> 
-    WHERE
-    {
-        ?operation a prov:Activity;
-            prov:used ?dataset;
-            prov:wasAssociatedWith ?User.
-                        
-        ?operation dct:description ?operationDescription;
-            dct:issued ?timestamp.
-        ?dataset dct:identifier ?datasetUUID;
-            dct:title ?datasetTitle.
-        ?User pistisUserGroup:id ?associatedUserGroup.
-
-        # Check if the User variable contains the username
-        ?User foaf:nick ?associatedUser.
-        FILTER(CONTAINS(LCASE(STR(?associatedUser)), LCASE("%1")))
-
-        OPTIONAL {
-            ?dataset prov:wasDerivedFrom ?previousDataset.
-            ?previousDataset dct:identifier ?previousUUID
-        }
-    }
-    '''
-
-    # String replace to insert the username into the query
-    query = namespaces_rdf_query + query.replace("%1", username)
-    
     logger.debug(
-        'GET_USER_HISTORY_UUID_SPARQL - QUERY:\n\n%s', query
-        )
-    
-    sparql.setQuery(query)
+        '%s - QUERY:\n\n%s', label, query
+    )
+
+    check_breaker(label)
     try:
-        return sparql.queryAndConvert()
+        yield from client.query_rows(query)
+    except GeneratorExit:
+        breaker.release()
+        raise
     except Exception as e:
-        logger.error(
-            '500 - ERROR - GET_USER_HISTORY_UUID_SPARQL - VIRTUOSO TRIPLE STORE - %s', str(e)
-        )
-        raise CustomError(
-            str(e),
-            'Virtuoso Triple Store',
-            500
-        )
+        raise store_error(e, label)
+    breaker.record_success()
+
+# Actual SPARQL queries
+def insert_SPARQL(document:TripleDocument):
+    '''
+    Inserts document into rdf graph
+    '''
+    return insert_triples_SPARQL(document.get_triples())
+
+def insert_batch_SPARQL(documents:list):
+    '''
+    Inserts several documents into rdf graph with a single INSERT DATA request
+    '''
+    triples = []
+    for document in documents:
+        triples += document.get_triples()
+    return insert_triples_SPARQL(triples)
+
+def insert_triples_SPARQL(triples:list):
+    '''
+    Inserts triples into rdf graph
+    '''
+    query = to_insert_data(triples)
+
+    logger.debug(
+        'INSERT_SPARQL - QUERY:\n\n%s', query
+    )
+
+    # Executes the update and retrieves results
+    return call_store(client.update, query, 'INSERT_SPARQL')
+
+def replace_versions_SPARQL(versions:list):
+    '''
+    Replaces the version labels of (Dataset, version) pairs in rdf graph
+    '''
+    query = to_replace_versions(versions)
+
+    logger.debug(
+        'REPLACE_VERSIONS_SPARQL - QUERY:\n\n%s', query
+    )
+
+    return call_store(client.update, query, 'REPLACE_VERSIONS_SPARQL')
+
+def get_name_by_uuid_SPARQL(uuid:str):
+    '''
+    Queries rdf graph for dataset name given uuid
+    '''
+    query = render_query('get_name_by_uuid', uuid=uuid)
+    return execute_query(query, 'GET_NAME_BY_UUID_SPARQL')
+
+def render_dataset_history_query(uuid:str, user_group=None, limit=None, after=None) -> str:
+    '''
+    Returns the dataset history query for uuid
+    If limit is provided, at most limit rows after the sort key after (timestamp, operation, nextUUID) are selected
+    '''
+    name = 'select_dataset_history_page_by_uuid' if limit is not None else 'select_dataset_history_by_uuid'
+    params = {'uuid': uuid}
+    if user_group:
+        name += '_and_user_group'
+        params['user_group'] = user_group
+    if limit is not None:
+        params['after_timestamp'], params['after_operation'], params['after_next_uuid'] = after
+        params['limit'] = limit
+    return render_query(name, **params)
+
+def select_dataset_history_by_uuid_SPARQL(uuid: str, user_group=None, limit=None, after=None):
+    '''
+    Queries RDF graph for dataset history given uuid, in chronological order
+    If user_group is provided, only operations of that user group are returned
+    If limit is provided, only a page of operations (see render_dataset_history_query) is returned
+    '''
+    query = render_dataset_history_query(uuid, user_group, limit, after)
+    return execute_query(query, 'SELECT_HISTORY_UUID_SPARQL')
+
+async def select_dataset_history_by_uuid_SPARQL_async(uuid: str, user_group=None, limit=None, after=None):
+    '''
+    Awaitable version of select_dataset_history_by_uuid_SPARQL
+    '''
+    query = render_dataset_history_query(uuid, user_group, limit, after)
+    return await execute_query_async(query, 'SELECT_HISTORY_UUID_SPARQL')
+
+def select_user_history_by_uuid_SPARQL_rows(username:str, limit=None, after=None):
+    '''
+    Queries rdf graph for user history given username
+    Yields the operations one row at a time, in chronological order
+    If limit is provided, at most limit rows after the sort key after (timestamp, operation) are yielded
+    '''
+    if limit is not None:
+        after_timestamp, after_operation = after
+        query = render_query('select_user_history_page_by_username', username=username,
+                             after_timestamp=after_timestamp, after_operation=after_operation, limit=limit)
+    else:
+        query = render_query('select_user_history_by_username', username=username)
+    return execute_query_rows(query, 'GET_USER_HISTORY_UUID_SPARQL')
 
 def select_lineage_by_lineage_id_SPARQL(lineage_id:str):
     '''
     Queries rdf graph for lineage given a lineage_id
     '''
     logger.info("*** Inside select_lineage_by_lineage_id_SPARQL")
-    empty_document = Document(namespaces)
-    namespaces_rdf = empty_document.get_rdf_namespaces()
-    namespaces_rdf_query = re_get_namespaces_rdf_query(namespaces_rdf)
-    
-    query ='''
-    SELECT ?id ?title ?operationDescription ?operationBy ?associatedUserGroup ?titleFrom ?timestamp ?previousUUID
-    FROM <pistisGraph:v3> 
-    WHERE 
-    {
-        ?d a prov:Entity;
-        prov:wasAttributedTo ?attributed;
-        prov:wasGeneratedBy ?operationFrom;
-        dct:identifier ?id;
-        %1;
-        dct:title ?title.
-        ?operationFrom dct:description ?operationDescription.
-
-        OPTIONAL {
-            ?d prov:wasDerivedFrom ?previousDataset.
-            ?previousDataset dct:identifier ?previousUUID
-        }
-
-        ?operationFrom dct:issued ?timestamp.
-        ?attributed foaf:nick ?operationBy.
-        ?attributed pistisUserGroup:id ?associatedUserGroup.
-      }
-    '''
-    query = namespaces_rdf_query + re.sub(r'%1', 'pistisDatasetLineage:id "{}"^^<http://www.w3.org/2001/XMLSchema#string>'.format(lineage_id), query)
+    query = render_query('select_lineage_by_lineage_id', lineage_id=lineage_id)
+    return execute_query(query, 'SELECT_LINEAGE_BY_LINEAGE_ID_SPARQL')
 
-    logger.debug(
-        'SELECT_LINEAGE_BY_LINEAGE_ID_SPARQL - QUERY:\n\n%s', query
-    )
-    
-    sparql.setQuery(query)
-    try:
-        return sparql.queryAndConvert()
-        
+def select_family_tree_by_family_id_SPARQL(family_id:str):
+    '''
+    Queries rdf graph for every dataset of a family (all lineages) given a family_id
+    '''
+    query = render_query('select_family_tree_by_family_id', family_id=family_id)
+    return execute_query(query, 'SELECT_FAMILY_TREE_BY_FAMILY_ID_SPARQL')
 
-    except Exception as e:
-        logger.error(
-            '500 - ERROR - SELECT_LINEAGE_BY_LINEAGE_ID_SPARQL - VIRTUOSO TRIPLE STORE', str(e)
-        )
-        raise CustomError(
-            str(e),
-            'Virtuoso Triple Store',
-            500
-        )
+async def select_family_tree_by_family_id_SPARQL_async(family_id:str):
+    '''
+    Awaitable version of select_family_tree_by_family_id_SPARQL
+    '''
+    query = render_query('select_family_tree_by_family_id', family_id=family_id)
+    return await execute_query_async(query, 'SELECT_FAMILY_TREE_BY_FAMILY_ID_SPARQL')
+
+async def select_descendants_by_uuid_SPARQL_async(uuid:str, max_depth:int=None):
+    '''
+    Queries rdf graph for the datasets derived, directly or transitively, from uuid
+    If max_depth is given, up to DESCENDANTS_MAX_UNROLLED_DEPTH it bounds the path length in the query;
+    beyond that every descendant is returned and the caller has to filter by depth
+    '''
+    if max_depth is not None and max_depth <= DESCENDANTS_MAX_UNROLLED_DEPTH:
+        query = render_query('select_descendants_by_uuid_depth_%d' % max_depth, uuid=uuid)
+    else:
+        query = render_query('select_descendants_by_uuid', uuid=uuid)
+    return await execute_query_async(query, 'SELECT_DESCENDANTS_BY_UUID_SPARQL')
 
 def validate_operation_by_uuid_SPARQL(uuid:str):
     '''
     Queries rdf graph to help validate operations
     '''
-    # Get rdf namespaces in a query-ready format
-    empty_document = Document(namespaces)
-    namespaces_rdf = empty_document.get_rdf_namespaces()
-    namespaces_rdf_query = re_get_namespaces_rdf_query(namespaces_rdf)
-    
-    query ='''
-    SELECT ?operationFrom
-    FROM <pistisGraph:v3> 
-    WHERE 
-    {
-        ?d a prov:Entity;
-        prov:wasGeneratedBy ?operationFrom;
-        %1.
-    }
-    '''
-    query = namespaces_rdf_query + re.sub(r'%1', 'dct:identifier "{}"^^<http://www.w3.org/2001/XMLSchema#string>'.format(uuid), query)
-    logger.debug(
-        'VALIDATE_OPERATION_UUID - QUERY\n\n:\n\n%s', query
-    )
-    
-    sparql.setQuery(query)
-    try:
-        return sparql.queryAndConvert()
-    except Exception as e:
-        logger.error(
-            'ERROR - VALIDATE_OPERATION_UUID - VIRTUOSO TRIPLE STORE - %s', str(e)
-        )
-        raise CustomError(
-            str(e),
-            'Virtuoso Triple Store',
-            500
-        )
+    query = render_query('validate_operation_by_uuid', uuid=uuid)
+    return execute_query(query, 'VALIDATE_OPERATION_UUID')
 
-def check_was_derived_from_SPARQL(uuid:str):
+async def validate_operation_by_uuid_SPARQL_async(uuid:str):
     '''
-    Queries triplestore to determine if any dataset wasDerivedFrom uuid
+    Awaitable version of validate_operation_by_uuid_SPARQL
     '''
-    empty_document = Document(namespaces)
-    namespaces_rdf = empty_document.get_rdf_namespaces()
-    namespaces_rdf_query = re_get_namespaces_rdf_query(namespaces_rdf)
+    query = render_query('validate_operation_by_uuid', uuid=uuid)
+    return await execute_query_async(query, 'VALIDATE_OPERATION_UUID')
 
-    query ='''
-    SELECT ?entity ?operationFrom
-    FROM <pistisGraph:v3>
-    WHERE {
-        ?entity a prov:Entity;
-        prov:wasGeneratedBy ?operationFrom;
-        prov:wasDerivedFrom ?entityDerived.
-        ?entityDerived dct:identifier "%1"^^<http://www.w3.org/2001/XMLSchema#string>.
-    }
+def select_dataset_uuids_SPARQL_rows(limit:int, after:str=''):
+    '''
+    Queries rdf graph for dataset identifiers in sorted order
+    Yields at most limit identifiers greater than after, one row at a time
     '''
-    query = re.sub(r'%1', uuid, query)
-    query = namespaces_rdf_query + query
+    query = render_query('select_dataset_uuids_page', after_uuid=after, limit=limit)
+    return execute_query_rows(query, 'SELECT_DATASET_UUIDS')
 
-    sparql.setQuery(query)
-    try:
-        return sparql.queryAndConvert()
+def select_family_ids_SPARQL_rows(limit:int, after:str=''):
+    '''
+    Queries rdf graph for family ids in sorted order
+    Yields at most limit family ids greater than after, one row at a time
+    '''
+    query = render_query('select_family_ids_page', after_family_id=after, limit=limit)
+    return execute_query_rows(query, 'SELECT_FAMILY_IDS')
 
-    except Exception as e:
-        logger.error(
-            '500 - ERROR - CHECK_WAS_DERIVED_FROM_SPARQL - VIRTUOSO TRIPLE STORE - %s', str(e)
-        )
-        raise CustomError(
-            str(e),
-            'Virtuoso Triple Store',
-            500
-        )
+def get_dataset_history_revision_SPARQL(uuid:str):
+    '''
+    Queries rdf graph for the newest timestamp and number of operations in the history of uuid
+    '''
+    query = render_query('get_dataset_history_revision', uuid=uuid)
+    return execute_query(query, 'GET_DATASET_HISTORY_REVISION')
+
+async def get_dataset_history_revision_SPARQL_async(uuid:str):
+    '''
+    Awaitable version of get_dataset_history_revision_SPARQL
+    '''
+    query = render_query('get_dataset_history_revision', uuid=uuid)
+    return await execute_query_async(query, 'GET_DATASET_HISTORY_REVISION')
+
+def get_lineage_revision_SPARQL(lineage_id:str):
+    '''
+    Queries rdf graph for the newest timestamp and number of operations generating the datasets of a lineage
+    '''
+    query = render_query('get_lineage_revision', lineage_id=lineage_id)
+    return execute_query(query, 'GET_LINEAGE_REVISION')
+
+async def get_family_revision_SPARQL_async(family_id:str):
+    '''
+    Queries rdf graph for the newest timestamp and number of operations generating the datasets of a family
+    '''
+    query = render_query('get_family_revision', family_id=family_id)
+    return await execute_query_async(query, 'GET_FAMILY_REVISION')
+
+def check_was_derived_from_SPARQL(uuid:str):
+    '''
+    Queries triplestore to determine if any dataset wasDerivedFrom uuid
+    '''
+    query = render_query('check_was_derived_from', uuid=uuid)
+    return execute_query(query, 'CHECK_WAS_DERIVED_FROM_SPARQL')
 
 def check_lineage_node_SPARQL(uuid:str):
     '''
     Queries triplestore to determine if the lineage splits and a new lineage_id needs to be created
     Lineage splits if there is already a dataset that wasDerivedFrom uuid
     '''
-    empty_document = Document(namespaces)
-    namespaces_rdf = empty_document.get_rdf_namespaces()
-    namespaces_rdf_query = re_get_namespaces_rdf_query(namespaces_rdf)
-    
-    query ='''
-    SELECT ?d
-    FROM <pistisGraph:v3> 
-    WHERE 
-    {
-        ?d a prov:Entity ;
-        prov:wasDerivedFrom ?from .
-        %1 .
-    }
-    '''
-    query = namespaces_rdf_query + re.sub(r'%1', '?from dct:identifier "{}"^^<http://www.w3.org/2001/XMLSchema#string>'.format(uuid), query)
-    logger.debug(
-        'CHECK_LINEAGE_NODE_SPARQL - QUERY:\n\n%s', query
-    )
-
-    sparql.setQuery(query)
-    try:
-        return sparql.queryAndConvert()
-        
-
-    except Exception as e:
-        logger.error(
-            '500 - ERROR - CHECK_LINEAGE_NODE_SPARQL - VIRTUOSO TRIPLE STORE - %s', str(e)
-        )
-        raise CustomError(
-            str(e),
-            'Virtuoso Triple Store',
-            500
-        )
+    query = render_query('check_lineage_node', uuid=uuid)
+    return execute_query(query, 'CHECK_LINEAGE_NODE_SPARQL')
 
 def get_status_by_uuid_SPARQL(uuid:str):
     '''
     Returns dataset status given a uuid
     '''
-    empty_document = Document(namespaces)
-    namespaces_rdf = empty_document.get_rdf_namespaces()
-    namespaces_rdf_query = re_get_namespaces_rdf_query(namespaces_rdf)
-    
-    query = '''
-    SELECT ?status
-    FROM <pistisGraph:v3> 
-    WHERE 
-    {
-        ?d a prov:Entity;
-        adms:status ?status;
-        %1.
-    }
-    '''
-    query = namespaces_rdf_query + re.sub(r'%1', 'dct:identifier "{}"^^<http://www.w3.org/2001/XMLSchema#string>'.format(uuid), query)
-    logger.debug(
-        'GET_STATUS_UUID_SPARQL - QUERY:\n\n%s', query
-    )
-
-    sparql.setQuery(query)
-    try:
-        return sparql.queryAndConvert()
-        
-    except Exception as e:
-        logger.error(
-            '500 - ERROR - GET_STATUS_UUID_SPARQL - VIRTUOSO TRIPLE STORE - %s', str(e)
-        )
-        raise CustomError(
-            str(e),
-            'Virtuoso Triple Store',
-            500
-        )
+    query = render_query('get_status_by_uuid', uuid=uuid)
+    return execute_query(query, 'GET_STATUS_UUID_SPARQL')
 
 def get_lineage_id_by_uuid_SPARQL(uuid:str):
     '''
     Queries rdf graph for lineage_id given uuid
     '''
-    empty_document = Document(namespaces)
-    namespaces_rdf = empty_document.get_rdf_namespaces()
-    namespaces_rdf_query = re_get_namespaces_rdf_query(namespaces_rdf)
-    
-    query ='''
-    SELECT ?lineageId
-    FROM <pistisGraph:v3> 
-    WHERE 
-    {
-       ?d a prov:Entity;
-        pistisDatasetLineage:id ?lineageId;
-        %1
-    }
-    '''
-    query = re.sub(r'%1', 'dct:identifier "{}"^^<http://www.w3.org/2001/XMLSchema#string>.'.format(uuid), query)
-    query = namespaces_rdf_query + query
-    logger.debug(
-        'GET_LINEAGE_ID_SPARQL - QUERY:\n\n%s', query
-    )
-
-    sparql.setQuery(query)
-    try:
-        return sparql.queryAndConvert()
-    except Exception as e:
-        logger.error(
-            '500 - ERROR - GET_LINEAGE_ID_SPARQL - VIRTUOSO TRIPLE STORE - %s', str(e)
-        )
-        raise CustomError(
-            str(e),
-            'Virtuoso Triple Store',
-            500
-        )
+    query = render_query('get_lineage_id_by_uuid', uuid=uuid)
+    return execute_query(query, 'GET_LINEAGE_ID_SPARQL')
 
 def get_lineage_id_by_family_id_SPARQL(family_id:str):
     '''
     Queries rdf graph for lineage_id given family_id
     '''
-    empty_document = Document(namespaces)
-    namespaces_rdf = empty_document.get_rdf_namespaces()
-    namespaces_rdf_query = re_get_namespaces_rdf_query(namespaces_rdf)
-    
-    query ='''
-    SELECT ?lineageId
-    FROM <pistisGraph:v3> 
-    WHERE 
-    {
-        ?d a prov:Entity ;
-        pistisDatasetLineage:id ?lineageId ;
-        %1
-    }
-    '''
-    query = re.sub(r'%1', 'pistisDatasetFamily:id "{}"^^xsd:string.'.format(family_id), query)
-    query = namespaces_rdf_query + query
-    logger.debug(
-        'GET_LINEAGE_ID_BY_FAMILY_ID_SPARQL - QUERY:\n\n%s', query
-    )
-
-    sparql.setQuery(query)
-    try:
-        return sparql.queryAndConvert()
-    except Exception as e:
-        logger.error(
-            '500 - ERROR - GET_LINEAGE_ID_SPARQL - VIRTUOSO TRIPLE STORE - %s', str(e)
-        )
-        raise CustomError(
-            str(e),
-            'Virtuoso Triple Store',
-            500
-        )
+    query = render_query('get_lineage_id_by_family_id', family_id=family_id)
+    return execute_query(query, 'GET_LINEAGE_ID_BY_FAMILY_ID_SPARQL')
 
 def get_family_id_SPARQL(uuid:str):
     '''
     Queries rdf graph for all uuids in same family as uuid
     '''
-    empty_document = Document(namespaces)
-    namespaces_rdf = empty_document.get_rdf_namespaces()
-    namespaces_rdf_query = re_get_namespaces_rdf_query(namespaces_rdf)
-    
-    query ='''
-    SELECT ?familyId
-    FROM <pistisGraph:v3> 
-    WHERE 
-    {
-        ?d a prov:Entity;
-        pistisDatasetFamily:id ?familyId;
-        %1
-    }
-    '''
-    query = namespaces_rdf_query + re.sub(r'%1', 'dct:identifier "{}"^^<http://www.w3.org/2001/XMLSchema#string>.'.format(uuid), query)
-    logger.debug(
-        'GET_FAMILY_ID_SPARQL - QUERY:\n\n%s', query
-    )
+    query = render_query('get_family_id', uuid=uuid)
+    return execute_query(query, 'GET_FAMILY_ID_SPARQL')
 
-    sparql.setQuery(query)
-    try:
-        return sparql.queryAndConvert()
-    except Exception as e:
-        logger.error(
-            '500 - ERROR - GET_FAMILY_ID_SPARQL - VIRTUOSO TRIPLE STORE - %s', str(e)
-        )
-        raise CustomError(
-            str(e),
-            'Virtuoso Triple Store',
-            500
-        )
+def get_dataset_metadata_SPARQL(uuid:str):
+    '''
+    Queries rdf graph for all metadata needed to validate an operation on uuid:
+    its generating operations, name, lineage_id, family_id and
+    the datasets derived from it together with their generating operations
+    '''
+    query = render_query('get_dataset_metadata', uuid=uuid)
+    return execute_query(query, 'GET_DATASET_METADATA_SPARQL')
+
+async def get_dataset_metadata_SPARQL_async(uuid:str):
+    '''
+    Awaitable version of get_dataset_metadata_SPARQL
+    '''
+    query = render_query('get_dataset_metadata', uuid=uuid)
+    return await execute_query_async(query, 'GET_DATASET_METADATA_SPARQL')
+
+def get_family_metadata_by_uuid_SPARQL(uuid:str):
+    '''
+    Queries rdf graph for uuid, name, lineage_id and family_id of every dataset in the family of uuid
+    '''
+    query = render_query('get_family_metadata_by_uuid', uuid=uuid)
+    return execute_query(query, 'GET_FAMILY_METADATA_BY_UUID_SPARQL')
 
 def get_family_uuids_by_uuid_SPARQL(uuid:str):
     '''
     Queries rdf graph for uuids for entire family of uuid
     '''
-    empty_document = Document(namespaces)
-    namespaces_rdf = empty_document.get_rdf_namespaces()
-    namespaces_rdf_query = re_get_namespaces_rdf_query(namespaces_rdf)
-    
-    try:
-        query = '''
-        SELECT ?uuid
-        FROM <pistisGraph:v3> 
-        WHERE 
-        {{
-            ?dataset a prov:Entity;
-                dct:identifier "{}"^^<http://www.w3.org/2001/XMLSchema#string>;
-                pistisDatasetFamily:id ?familyId.
-            
-            ?otherDataset a prov:Entity;
-                pistisDatasetFamily:id ?familyId;
-                dct:identifier ?uuid.
-        }}
-        '''.format(str(uuid))
-    except Exception as e:
-        logger.debug("Exception: %s", e)
-    
-    query = namespaces_rdf_query + query
-    logger.debug(
-        'GET_FAMILY_UUIDS_SPARQL - QUERY:\n\n%s', query
-    )
-
-    sparql.setQuery(query)
-    try:
-        return sparql.queryAndConvert()
-    except Exception as e:
-        logger.error(
-            '500 - ERROR - GET_FAMILY_ID_SPARQL - VIRTUOSO TRIPLE STORE - %s', str(e)
-        )
-        raise CustomError(
-            str(e),
-            'Virtuoso Triple Store',
-            500
-        )
+    query = render_query('get_family_uuids_by_uuid', uuid=uuid)
+    return execute_query(query, 'GET_FAMILY_UUIDS_SPARQL')
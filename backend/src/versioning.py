@@ -1,88 +1,359 @@
 '''
 The purpose of versioning.py is to add version labels to the get_family_tree api endpoint.
-The dataset uuid's and connection between datasets are stored, but not the version labels.
+Labels are stored with each dataset when it is written (see child_version); add_versioning
+recomputes them for a whole family tree, for data written before labels were stored.
 The Jupyter notebook FamilyTree.ipynb explains this process in detail.
 '''
 
+import sys
+from array import array
 from json import dumps, loads
-from datetime import datetime
 from collections import OrderedDict
+from collections.abc import Mapping
+
+import numpy as np
+
+ROOT_VERSION = '1'
+# Separators of '%Y-%m-%d %H:%M:%S' timestamps
+TIMESTAMP_SEPARATORS = str.maketrans('', '', '-: ')
+# Length and digit positions of '%Y-%m-%d %H:%M:%S' timestamps
+TIMESTAMP_LENGTH = 19
+TIMESTAMP_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+TIMESTAMP_DIGIT_WEIGHTS = 10 ** np.arange(len(TIMESTAMP_DIGITS) - 1, -1, -1, dtype=np.int64)
+
+def timestamp_key(timestamp):
+    '''
+    Returns a '%Y-%m-%d %H:%M:%S' timestamp as the integer YYYYMMDDHHMMSS, which sorts chronologically
+    '''
+    return int(timestamp.translate(TIMESTAMP_SEPARATORS))
+
+def timestamp_keys(timestamps):
+    '''
+    Returns the timestamp_key of every timestamp of a list, as an int64 array
+    The digits of all timestamps are converted at once, unless one of them is not a plain '%Y-%m-%d %H:%M:%S'
+    '''
+    raw = ''.join(timestamps).encode('ascii', 'replace')
+    if len(raw) != TIMESTAMP_LENGTH * len(timestamps):
+        return np.array([timestamp_key(timestamp) for timestamp in timestamps], dtype=np.int64)
+    digits = np.frombuffer(raw, dtype=np.uint8).reshape(-1, TIMESTAMP_LENGTH)[:, TIMESTAMP_DIGITS]
+    return (digits.astype(np.int64) - ord('0')) @ TIMESTAMP_DIGIT_WEIGHTS
+
+def key_timestamp(key):
+    '''
+    Returns the '%Y-%m-%d %H:%M:%S' timestamp of a timestamp_key
+    '''
+    digits = '%014d' % key
+    return f"{digits[0:4]}-{digits[4:6]}-{digits[6:8]} {digits[8:10]}:{digits[10:12]}:{digits[12:14]}"
+
+def intern_string(value):
+    '''
+    Returns the interned copy of value, so repeated usernames, groups and names are stored once
+    '''
+    return sys.intern(value) if isinstance(value, str) else value
+
+def child_version(parent_version, index, num_children):
+    '''
+    Returns the version of the index-th child (by timestamp) of a dataset with num_children children
+    An only child continues the version of its parent, siblings get a branch number
+    '''
+    version = str((int(parent_version[0:1]) + 1)) + parent_version[1:]
+    if num_children > 1:
+        version += '.' + str(index)
+    return version
 
 class FamilyTree:
     '''
-    Family Tree class that contains a dictionary representation of the family tree of datasets
+    Compact family tree of datasets
+    Datasets are numbered 0..n-1 in the order they are added. Parents are an array of indices
+    (-1 for a root) and children are stored CSR-style: the children of dataset i, oldest first,
+    are children[child_offsets[i]:child_offsets[i + 1]]. Repeated strings are interned.
     '''
     def __init__(self):
-        self.nodes = {}
+        # dataset_id <-> index
+        self.ids = []
+        self.index = {}
+        # Columns, by index
+        self.usernames = []
+        self.user_groups = []
+        self.dataset_names = []
+        self.derived_from = []
+        self.operation_descriptions = []
+        self.sort_keys = array('q')
+        self.versions = []
+        # Built by build()
         self.root = None
+        self.parents = None
+        self.child_offsets = None
+        self.children = None
+        # Built by build_index()
+        self.depths = None
+        self.entry = None
+        self.exit = None
+        # Built by build_lifting()
+        self.jumps = None
+
+    @property
+    def nodes(self):
+        '''
+        Read-only mapping of dataset_id to Dataset
+        '''
+        return FamilyTreeNodes(self)
+
+    def add_node(self, dataset_id, username, user_group, dataset_name, derived_from, operation_description, timestamp, version=None):
+        '''
+        Adds a dataset, unless one with the same dataset_id was already added
+        '''
+        if dataset_id in self.index:
+            return
+        self.index[dataset_id] = len(self.ids)
+        self.ids.append(dataset_id)
+        self.usernames.append(intern_string(username))
+        self.user_groups.append(intern_string(user_group))
+        self.dataset_names.append(intern_string(dataset_name))
+        self.derived_from.append(derived_from)
+        self.operation_descriptions.append(intern_string(operation_description))
+        self.sort_keys.append(timestamp_key(timestamp))
+        self.versions.append(version)
 
     def add_dataset(self, dataset):
         '''
-        Adds dataset to nodes dictionary, story by its dataset_id
+        Adds a Dataset, unless one with the same dataset_id was already added
+        '''
+        self.add_node(
+            dataset.dataset_id,
+            dataset.username,
+            dataset.user_group,
+            dataset.dataset_name,
+            dataset.derived_from,
+            dataset.operation_description,
+            dataset.timestamp,
+            dataset.version
+        )
+
+    def build(self):
+        '''
+        Builds the parent and child arrays from derived_from
+        The root is the last dataset without a parent
         '''
-        dataset_id = getattr(dataset, 'dataset_id')
-        if getattr(dataset, 'dataset_id') not in self.nodes:
-            self.nodes[dataset_id] = dataset
+        num_nodes = len(self.ids)
+        index = self.index
+        self.parents = np.array(
+            [-1 if derived_from is None else index[derived_from] for derived_from in self.derived_from],
+            dtype=np.int32
+        )
+        sort_keys = np.array(self.sort_keys, dtype=np.int64)
+
+        roots = np.flatnonzero(self.parents < 0)
+        self.root = int(roots[-1]) if len(roots) > 0 else None
+
+        # Group children by parent, oldest first; lexsort is stable, so ties keep the order they were added in
+        non_roots = np.flatnonzero(self.parents >= 0)
+        order = np.lexsort((sort_keys[non_roots], self.parents[non_roots]))
+        self.children = non_roots[order].astype(np.int32)
+        self.child_offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.parents[non_roots], minlength=num_nodes), out=self.child_offsets[1:])
 
     def update_versioning(self):
         '''
         Adds version numbers to nodes
         Uses BFS to iterate through all nodes and add correct version numbers to each node
         '''
+        self.build()
+        if self.root is None:
+            return
+
+        # Plain lists are much faster than numpy arrays to index one element at a time
+        child_offsets = self.child_offsets.tolist()
+        children = self.children.tolist()
+        versions = self.versions
+
         # Start with root, which is named 1.0
-        root = getattr(self, 'root')
-        setattr(root, 'version', '1')
-        
-        # BFS children, add versions
-        q = [root]
-        while len(q) > 0:
-            # Get/remove first element in q
-            parent = q[0]
-            parent_version = getattr(parent, 'version')
-            q = q[1:]    
-        
-            # Add all children to q
-            # NOTE: Make sure children are sorted by timestamp
-            this_dataset_children_unsorted = getattr(parent, 'children')
-            this_dataset_children = sorted(this_dataset_children_unsorted, key=lambda obj: datetime.strptime(obj.timestamp, '%Y-%m-%d %H:%M:%S'))
-            num_children = len(this_dataset_children)
-            for child in this_dataset_children:
-                q.append(child)
-        
-            # Name versions accordingly, depending on number of children
-            if num_children == 1:
-                child = this_dataset_children[0]
-                child_version = str((int(parent_version[0:1]) + 1)) + parent_version[1:]
-                setattr(this_dataset_children[0], 'version', child_version)
-            elif num_children > 1:
-                for i, child in enumerate(this_dataset_children):
-                    child_version = str((int(parent_version[0:1]) + 1)) + parent_version[1:] + '.' + str(i)
-                    setattr(this_dataset_children[i], 'version', child_version)
+        versions[self.root] = ROOT_VERSION
+
+        # BFS children, add versions; the queue is a list that is read while it grows
+        q = [self.root]
+        for parent in q:
+            start, end = child_offsets[parent], child_offsets[parent + 1]
+            if start == end:
+                continue
+
+            # Children are already sorted by timestamp, name versions accordingly (see child_version)
+            parent_version = versions[parent]
+            version = str((int(parent_version[0:1]) + 1)) + parent_version[1:]
+            if end - start == 1:
+                versions[children[start]] = version
+            else:
+                version += '.'
+                for i in range(start, end):
+                    versions[children[i]] = version + str(i - start)
+            q.extend(children[start:end])
+
+    def build_index(self):
+        '''
+        Numbers datasets in DFS pre-order (Euler tour): entry[i] is the position of dataset i and
+        exit[i] the position of the last dataset of its subtree, so the subtree of i is the interval
+        entry[i]..exit[i]
+        '''
+        if self.parents is None:
+            self.build()
+        num_nodes = len(self.ids)
+        parents = self.parents.tolist()
+        child_offsets = self.child_offsets.tolist()
+        children = self.children.tolist()
+
+        # Datasets that are not reachable from a root keep an empty interval
+        entry = [-1] * num_nodes
+        preorder = []
+        stack = [int(root) for root in np.flatnonzero(self.parents < 0)[::-1]]
+        while stack:
+            i = stack.pop()
+            entry[i] = len(preorder)
+            preorder.append(i)
+            stack.extend(reversed(children[child_offsets[i]:child_offsets[i + 1]]))
+
+        # Depths, parents before children
+        depths = [-1] * num_nodes
+        for i in preorder:
+            depths[i] = depths[parents[i]] + 1 if parents[i] >= 0 else 0
+
+        # Subtree sizes, children before parents
+        sizes = [1] * num_nodes
+        for i in reversed(preorder):
+            if parents[i] >= 0:
+                sizes[parents[i]] += sizes[i]
+
+        self.depths = np.array(depths, dtype=np.int32)
+        entry = np.array(entry, dtype=np.int32)
+        self.exit = entry + np.array(sizes, dtype=np.int32) - 1
+        self.exit[entry < 0] = -2
+        self.entry = entry
+
+    def is_derived_from(self, ancestor_id, descendant_id):
+        '''
+        Returns whether descendant_id was derived, directly or transitively, from ancestor_id
+        A dataset is not derived from itself, nor from a dataset outside of the tree
+        '''
+        if ancestor_id not in self.index or descendant_id not in self.index:
+            return False
+        if self.entry is None:
+            self.build_index()
+        ancestor = self.index[ancestor_id]
+        descendant = self.index[descendant_id]
+        return bool(self.entry[ancestor] < self.entry[descendant] <= self.exit[ancestor])
+
+    def build_lifting(self):
+        '''
+        Builds the binary lifting jump tables: jumps[k][i] is the 2^k-th ancestor of dataset i
+        A root is its own parent, so jumps past a root stay on it
+        '''
+        if self.entry is None:
+            self.build_index()
+        num_nodes = len(self.ids)
+        max_depth = int(self.depths.max()) if num_nodes > 0 else 0
+
+        jumps = np.empty((max(1, max_depth.bit_length()), num_nodes), dtype=np.int32)
+        jumps[0] = np.where(self.parents >= 0, self.parents, np.arange(num_nodes, dtype=np.int32))
+        for k in range(1, len(jumps)):
+            jumps[k] = jumps[k - 1][jumps[k - 1]]
+        self.jumps = jumps
+
+    def get_common_ancestor(self, dataset_id_1, dataset_id_2):
+        '''
+        Returns the dataset_id of the nearest dataset both datasets were derived from (or are), in O(log n)
+        Returns None if the datasets do not share an ancestor in the tree
+        '''
+        if dataset_id_1 not in self.index or dataset_id_2 not in self.index:
+            return None
+        if self.jumps is None:
+            self.build_lifting()
+        jumps = self.jumps
+        a = self.index[dataset_id_1]
+        b = self.index[dataset_id_2]
+        if self.depths[a] < 0 or self.depths[b] < 0:
+            return None
+
+        # Lift the deeper dataset to the depth of the other one
+        if self.depths[a] < self.depths[b]:
+            a, b = b, a
+        difference = int(self.depths[a] - self.depths[b])
+        k = 0
+        while difference > 0:
+            if difference & 1:
+                a = jumps[k][a]
+            difference >>= 1
+            k += 1
+        if a == b:
+            return self.ids[a]
+
+        # Lift both as far as they stay apart, their parents are then the common ancestor
+        for k in reversed(range(len(jumps))):
+            if jumps[k][a] != jumps[k][b]:
+                a = jumps[k][a]
+                b = jumps[k][b]
+        a = jumps[0][a]
+        b = jumps[0][b]
+        return self.ids[a] if a == b else None
 
     def get_version(self, dataset_id):
         '''
         Given the dataset_id, returns the version of that dataset
         '''
-        version = getattr(self.nodes[dataset_id], 'version')
-        return version
-    
-    def display_tree(self, dataset=None, level=0):
+        return self.versions[self.index[dataset_id]]
+
+    def get_children(self, dataset_id):
         '''
-        Displays family tree
+        Given the dataset_id, returns the dataset_ids of its children, oldest first
+        '''
+        i = self.index[dataset_id]
+        return [self.ids[child] for child in self.children[self.child_offsets[i]:self.child_offsets[i + 1]]]
+
+    def dataset(self, i):
         '''
-        if dataset is None:
-            dataset = self.root
-        if dataset is not None:
-            print(' ' * 4 * level + '->', dataset)
-            for child in dataset.children:
-                self.display_tree(child, level + 1)
+        Returns the dataset with index i as a Dataset (without parents and children)
+        '''
+        dataset = Dataset(
+            self.ids[i],
+            self.usernames[i],
+            self.user_groups[i],
+            self.dataset_names[i],
+            self.derived_from[i],
+            self.operation_descriptions[i],
+            key_timestamp(self.sort_keys[i])
+        )
+        dataset.version = self.versions[i]
+        return dataset
 
-    def add_root(self, dataset):
+    def display_tree(self):
         '''
-        Notes a dataset as the root of the family tree
-        A dataset is the root if it has no parents
+        Displays family tree
         '''
-        self.root = dataset
+        if self.root is None:
+            return
+        stack = [(self.root, 0)]
+        while stack:
+            i, level = stack.pop()
+            print(' ' * 4 * level + '->', self.dataset(i))
+            children = self.children[self.child_offsets[i]:self.child_offsets[i + 1]]
+            stack.extend((int(child), level + 1) for child in reversed(children))
+
+class FamilyTreeNodes(Mapping):
+    '''
+    Read-only dataset_id -> Dataset view of a FamilyTree; Datasets are created on access
+    '''
+    def __init__(self, tree):
+        self.tree = tree
+
+    def __getitem__(self, dataset_id):
+        return self.tree.dataset(self.tree.index[dataset_id])
+
+    def __iter__(self):
+        return iter(self.tree.ids)
+
+    def __len__(self):
+        return len(self.tree.ids)
+
+    def __contains__(self, dataset_id):
+        return dataset_id in self.tree.index
 
 class Dataset:
     '''
@@ -99,89 +370,106 @@ class Dataset:
         self.operation_description = operation_description
         self.timestamp = timestamp
         self.version = None
-        # Tree attributes
-        self.parents = []
-        self.children = []
+        # Tree attributes, keyed by dataset_id for constant time dedupe of edges (in insertion order)
+        self.parents = {}
+        self.children = {}
 
     def add_parent(self, parent):
         '''
-        Adds parent to parents list
-        Adds this dataset to parents' childrens list
+        Adds parent to parents
+        Adds this dataset to parents' children
         '''
-        if parent not in self.parents:
-            self.parents.append(parent)
-        if self not in parent.children:
-            parent.children.append(self)
+        self.parents.setdefault(parent.dataset_id, parent)
+        parent.children.setdefault(self.dataset_id, self)
 
     def add_child(self, child):
         '''
-        Adds child to children list
-        Adds this dataset to child's parents list
+        Adds child to children
+        Adds this dataset to child's parents
         '''
-        if child not in self.children:
-            self.children.append(child)
-        if self not in child.parents:
-            child.parents.append(self)
+        self.children.setdefault(child.dataset_id, child)
+        child.parents.setdefault(self.dataset_id, self)
 
     def __repr__(self):
         return f"{self.dataset_id}: Version {self.version}"
 
+def load_family_tree(ft, with_versions=False, with_attributes=True):
+    '''
+    Function that adds every dataset of the json to a new FamilyTree object, without linking them
+    The version labels of the json are kept if with_versions is True
+    If with_attributes is False, only what build() needs is loaded (usernames etc. stay empty)
+    Equivalent to calling add_node for every dataset, but each column is filled in one pass
+    '''
+    ids = [dataset_id for lineage in ft.values() for dataset_id in lineage]
+    datasets = [dataset for lineage in ft.values() for dataset in lineage.values()]
+    index = dict(zip(ids, range(len(ids))))
+    if len(index) < len(ids):
+        # A dataset_id listed in several lineages is added once, from its first lineage
+        first = {}
+        for i, dataset_id in enumerate(ids):
+            first.setdefault(dataset_id, i)
+        ids = list(first)
+        datasets = [datasets[i] for i in first.values()]
+        index = dict(zip(ids, range(len(ids))))
+
+    ft_obj = FamilyTree()
+    ft_obj.ids = ids
+    ft_obj.index = index
+    if with_attributes:
+        ft_obj.usernames = [intern_string(dataset['username']) for dataset in datasets]
+        ft_obj.user_groups = [intern_string(dataset['user_group']) for dataset in datasets]
+        ft_obj.dataset_names = [intern_string(dataset['dataset_name']) for dataset in datasets]
+        ft_obj.operation_descriptions = [intern_string(dataset['operation_description']) for dataset in datasets]
+    ft_obj.derived_from = [dataset['derived_from'] for dataset in datasets]
+    ft_obj.sort_keys = array('q', timestamp_keys([dataset['timestamp'] for dataset in datasets]).tobytes())
+    ft_obj.versions = [dataset.get('version') for dataset in datasets] if with_versions else [None] * len(ids)
+    return ft_obj
+
 def create_family_tree(ft):
     '''
     Function that creates a FamilyTree object from json
     Input: FamilyTree json object
-    Output: FamilyTree object containing Dataset objects for each dataset
+    Output: FamilyTree object with version labels for each dataset
     '''
-    # Iterate through all datasets in ft, create Dataset class for each
-    ft_obj = FamilyTree()
-    
-    # Create Dataset for each dataset, add to ft_dict
-    for lineage_id in ft:
-        this_lineage = ft[lineage_id]
-        for this_dataset_id in this_lineage:
-            this_dataset = this_lineage[this_dataset_id]
-            
-            this_dataset = Dataset(
-                this_dataset_id, 
-                this_dataset['username'], 
-                this_dataset['user_group'], 
-                this_dataset['dataset_name'], 
-                this_dataset['derived_from'], 
-                this_dataset['operation_description'], 
-                this_dataset['timestamp']
-            )
-    
-            ft_obj.add_dataset(this_dataset)
-    
-    # Add relationships between each Dataset in ft_dict
-    ft_nodes = getattr(ft_obj, 'nodes')
-    for dataset_id, dataset in getattr(ft_obj, 'nodes').items():
-        derived_from = getattr(dataset, 'derived_from')
-        if derived_from is not None:
-            dataset.add_parent(ft_nodes[dataset.derived_from])
-        else:
-            ft_obj.add_root(dataset)
-
-    # Update versioning
+    ft_obj = load_family_tree(ft)
+
+    # Link datasets and update versioning
     ft_obj.update_versioning()
 
     return ft_obj
 
+def create_family_structure(ft):
+    '''
+    Function that creates an indexed FamilyTree object from versioned json, for ancestry queries
+    Input: FamilyTree json object with version labels (see add_versioning)
+    Output: FamilyTree object with the version labels of the json
+    '''
+    ft_obj = load_family_tree(ft, with_versions=True)
+
+    # Link datasets and index them
+    ft_obj.build()
+    ft_obj.build_index()
+    ft_obj.build_lifting()
+
+    return ft_obj
+
 def add_versioning(ft):
     '''
     Adds versioning to the family tree json
     Inputs: family tree json
     Output: family tree json with updated versioning
     '''
-    ft_obj = create_family_tree(ft)
+    # Only the version labels are read back, so the other attributes are not loaded
+    ft_obj = load_family_tree(ft, with_attributes=False)
+    ft_obj.update_versioning()
     ft_output = ft
 
     # Update version for each dataset
-    for lineage_id in ft_output:
-        this_lineage = ft_output[lineage_id]
-        for this_dataset_id in this_lineage:
-            this_version = ft_obj.get_version(this_dataset_id)    
-            ft_output[lineage_id][this_dataset_id]['version'] = this_version
+    index = ft_obj.index
+    versions = ft_obj.versions
+    for this_lineage in ft_output.values():
+        for this_dataset_id, this_dataset in this_lineage.items():
+            this_dataset['version'] = versions[index[this_dataset_id]]
 
     return ft_output
 
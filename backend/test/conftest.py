@@ -0,0 +1,82 @@
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+# Backend modules import each other relative to src (e.g., `from tools.error_handler import CustomError`)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+
+class SPARQLEndpointHandler(BaseHTTPRequestHandler):
+    '''
+    Minimal SPARQL endpoint that echoes the received query (or update) back as a single binding
+    CSV results are requested with the Accept header; server.csv_rows replaces the echoed row
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        server.connections.add(self.client_address)
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            length = int(self.headers['Content-Length'])
+            form = parse_qs(self.rfile.read(length).decode('utf-8'))
+            time.sleep(server.delay)
+            parameter = 'update' if 'update' in form else 'query'
+            if self.headers.get('Accept') == 'text/csv':
+                content_type = 'text/csv'
+                rows = server.csv_rows or [['parameter', 'query'], [parameter, form[parameter][0]]]
+                text = io.StringIO(newline='')
+                csv.writer(text, lineterminator='\r\n').writerows(rows)
+                body = text.getvalue().encode('utf-8')
+            else:
+                content_type = 'application/sparql-results+json'
+                body = json.dumps({
+                    'head': {'vars': ['parameter', 'query']},
+                    'results': {'bindings': [{
+                        'parameter': {'type': 'literal', 'value': parameter},
+                        'query': {'type': 'literal', 'value': form[parameter][0]}
+                    }]}
+                }).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def sparql_server():
+    '''
+    Runs a local SPARQL endpoint stand-in and yields the server object
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SPARQLEndpointHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.connections = set()
+    server.active = 0
+    server.max_active = 0
+    server.delay = 0
+    server.csv_rows = None
+    server.url = 'http://127.0.0.1:%d/sparql' % server.server_address[1]
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,18 @@
+from tools.bloom_filter import BloomFilter
+
+
+def test_added_keys_are_always_found():
+    '''
+    Tests that the filter has no false negatives, and few false positives up to its capacity
+    '''
+    known = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        known.add('uuid%d' % i)
+
+    assert all('uuid%d' % i in known for i in range(1000))
+    false_positives = sum('other%d' % i in known for i in range(10000))
+    assert false_positives < 300
+    assert known.count == 1000
+
+    known.clear()
+    assert 'uuid0' not in known and known.count == 0
@@ -0,0 +1,47 @@
+from tools.cache import LRUCache
+
+
+class FakeClock:
+    '''
+    Manually advanced monotonic clock
+    '''
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_evicts_least_recently_used():
+    '''
+    Tests that the least recently used entry is evicted and that lookups are counted
+    '''
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats() == {'size': 2, 'maxsize': 2, 'hits': 3, 'misses': 1, 'hit_ratio': 0.75}
+
+
+def test_entries_expire_after_ttl():
+    '''
+    Tests that entries expire ttl seconds after they were set
+    '''
+    clock = FakeClock()
+    cache = LRUCache(maxsize=10, ttl=5, clock=clock)
+    cache.set('a', 1)
+
+    clock.now = 4.9
+    assert cache.get('a') == 1
+    clock.now = 5
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+    cache.set('b', 2, ttl=1)
+    clock.now = 6
+    assert cache.get('b') is None
@@ -0,0 +1,35 @@
+import os
+
+from tools.disk_cache import DiskCache
+
+
+def test_evicts_least_recently_used_beyond_max_bytes(tmp_path):
+    '''
+    Tests that the least recently used entries are deleted once the files exceed max_bytes
+    '''
+    value = os.urandom(1000)
+    cache = DiskCache(str(tmp_path), max_bytes=2500)
+    cache.set('a', value)
+    cache.set('b', value)
+    assert cache.get('a') == value
+    cache.set('c', value)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == value and cache.get('c') == value
+    assert len(list(tmp_path.iterdir())) == 2
+    assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 1
+
+
+def test_entries_survive_restart(tmp_path):
+    '''
+    Tests that a new cache on the same directory serves and accounts for earlier entries, and drops corrupt ones
+    '''
+    DiskCache(str(tmp_path), max_bytes=10000).set('a', b'table')
+    DiskCache(str(tmp_path), max_bytes=10000).set('b', b'table')
+    with open(DiskCache(str(tmp_path), 0).path('b'), 'wb') as file:
+        file.write(b'corrupt')
+
+    cache = DiskCache(str(tmp_path), max_bytes=10000)
+    assert cache.get('a') == b'table'
+    assert cache.get('b') is None
+    assert cache.stats()['entries'] == 1
@@ -0,0 +1,101 @@
+import json
+import time
+from types import SimpleNamespace
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import identity_manager
+from identity_manager import IdentityManager, IdentityManagerApi
+
+
+@pytest.fixture
+def keycloak(monkeypatch):
+    '''
+    Replaces the Keycloak authorization request, recording the tokens it is asked about
+    '''
+    calls = []
+    monkeypatch.setattr(identity_manager, 'authorization_cache', identity_manager.LRUCache(10))
+    monkeypatch.setattr(
+        IdentityManagerApi,
+        'user_account_authorize',
+        lambda self, keycloak_object, access_token: calls.append(access_token) or SimpleNamespace(
+            status_code=403 if access_token.startswith('denied') else 200
+        )
+    )
+    return calls
+
+
+def test_authorization_is_cached_until_token_expires(keycloak):
+    '''
+    Tests that a granted token is asked about once, while denied and non-expiring tokens are asked every time
+    '''
+    identity_object = IdentityManager('application/x-www-form-urlencoded', 'urn:ietf:params:oauth:grant-type:uma-ticket', '')
+    token = jwt.encode({'exp': int(time.time()) + 60}, 'secret', algorithm='HS256')
+    api = IdentityManagerApi()
+
+    assert api.is_authorized(identity_object, token)
+    assert api.is_authorized(identity_object, token)
+    assert not api.is_authorized(identity_object, 'denied')
+    assert not api.is_authorized(identity_object, 'denied')
+    assert api.is_authorized(identity_object, 'opaque')
+    assert api.is_authorized(identity_object, 'opaque')
+
+    assert keycloak == [token, 'denied', 'denied', 'opaque', 'opaque']
+    assert identity_manager.authorization_cache.stats()['hits'] == 1
+
+
+@pytest.fixture
+def jwks(tmp_path, monkeypatch):
+    '''
+    Serves the realm key set from a JWKS file and switches to local verification
+    Returns a function adding a new signing key to the file
+    '''
+    path = tmp_path / 'jwks.json'
+    keys = []
+
+    def add_key(kid):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+        jwk['kid'] = kid
+        keys.append(jwk)
+        path.write_text(json.dumps({'keys': keys}))
+        return private_key
+
+    add_key('unused')
+    monkeypatch.setattr(identity_manager, 'TOKEN_VERIFICATION', 'local')
+    monkeypatch.setattr(identity_manager, 'jwks_client', jwt.PyJWKClient(path.as_uri()))
+    return add_key
+
+
+def sign(private_key, kid, **claims):
+    '''
+    Signs a token with the realm issuer and audience, valid for a minute unless overridden
+    '''
+    payload = {
+        'iss': identity_manager.KEYCLOAK_ISSUER,
+        'aud': identity_manager.KEYCLOAK_AUDIENCE,
+        'exp': int(time.time()) + 60
+    }
+    payload.update(claims)
+    return jwt.encode(payload, private_key, algorithm='RS256', headers={'kid': kid})
+
+
+def test_local_verification_with_rotated_keys(jwks, keycloak):
+    '''
+    Tests that tokens are verified against the JWKS without Keycloak, including keys added after the first fetch
+    '''
+    identity_object = IdentityManager('application/x-www-form-urlencoded', 'urn:ietf:params:oauth:grant-type:uma-ticket', '')
+    api = IdentityManagerApi()
+    key1 = jwks('key1')
+
+    assert api.is_authorized(identity_object, sign(key1, 'key1'))
+    assert not api.is_authorized(identity_object, sign(key1, 'key1', exp=int(time.time()) - 60))
+    assert not api.is_authorized(identity_object, sign(key1, 'key1', aud='other'))
+    assert not api.is_authorized(identity_object, sign(rsa.generate_private_key(public_exponent=65537, key_size=2048), 'key1'))
+    assert not api.is_authorized(identity_object, 'not a token')
+
+    key2 = jwks('key2')
+    assert api.is_authorized(identity_object, sign(key2, 'key2'))
+    assert keycloak == []
@@ -0,0 +1,545 @@
+import asyncio
+import pytest
+import time
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps, loads
+from types import SimpleNamespace
+
+import logic_layer
+from tools.deadline import deadline
+from tools.disk_cache import DiskCache
+from tools.error_handler import CustomError
+
+
+def literal(value):
+    '''
+    Returns a SPARQL JSON literal term
+    '''
+    return {'type': 'literal', 'value': value}
+
+
+def family_binding(uuid, lineage_id, timestamp, operation_description, previous_uuid=None):
+    '''
+    Builds a binding of the family tree query
+    '''
+    binding = {
+        'id': literal(uuid),
+        'lineageId': literal(lineage_id),
+        'title': literal('name'),
+        'operationDescription': literal(operation_description),
+        'operationBy': literal('user1'),
+        'associatedUserGroup': literal('group1'),
+        'timestamp': literal(timestamp),
+    }
+    if previous_uuid is not None:
+        binding['previousUUID'] = literal(previous_uuid)
+    return binding
+
+
+def test_get_family_tree_groups_by_lineage(monkeypatch):
+    '''
+    Tests that one family query is grouped into lineages, keeping the latest operation per dataset
+    '''
+    bindings = [
+        family_binding('2', 'lineage-b', '2024-09-05 13:23:55', 'update:first', '1'),
+        family_binding('1', 'lineage-a', '2024-09-05 13:23:30', 'create'),
+        family_binding('3', 'lineage-a', '2024-09-05 13:24:10', 'update:second', '1'),
+        family_binding('3', 'lineage-a', '2024-09-05 13:30:00', 'delete', '1'),
+    ]
+    queries = []
+
+    async def get_family_id_async(uuid):
+        return 'family'
+
+    async def select_family_tree_async(family_id):
+        queries.append(family_id)
+        return {'results': {'bindings': bindings}}
+
+    monkeypatch.setattr(logic_layer, 'get_family_id_async', get_family_id_async)
+    monkeypatch.setattr(logic_layer, 'select_family_tree_by_family_id_SPARQL_async', select_family_tree_async)
+
+    family_tree = asyncio.run(logic_layer.get_family_tree_async('1'))
+
+    assert queries == ['family']
+    assert list(family_tree) == ['lineage-a', 'lineage-b']
+    assert list(family_tree['lineage-a']) == ['1', '3']
+    assert family_tree['lineage-a']['1']['derived_from'] is None
+    assert family_tree['lineage-a']['3']['operation_description'] == 'delete'
+    assert family_tree['lineage-b']['2']['update_description'] == 'first'
+
+
+def test_get_family_tree_unknown_dataset(monkeypatch):
+    '''
+    Tests that an unknown dataset raises a 412
+    '''
+    async def get_family_id_async(uuid):
+        return None
+
+    monkeypatch.setattr(logic_layer, 'get_family_id_async', get_family_id_async)
+
+    with pytest.raises(CustomError) as error:
+        asyncio.run(logic_layer.get_family_tree_async('unknown'))
+    assert error.value.status_code == 412
+
+
+def test_get_diff_datasets_async_unknown_dataset(monkeypatch):
+    '''
+    Tests that a missing dataset raises a 412 even when its download fails as well
+    '''
+    async def validate_create_async(uuid):
+        return uuid == 'unknown'
+
+    def fetch_dataset(uuid, label):
+        raise CustomError('Failed to retrieve %s.' % label, 'Lineage Tracker Backend', 404)
+
+    monkeypatch.setattr(logic_layer, 'validate_create_async', validate_create_async)
+    monkeypatch.setattr(logic_layer, 'fetch_dataset', fetch_dataset)
+
+    with pytest.raises(CustomError) as error:
+        asyncio.run(logic_layer.get_diff_datasets_async('known', 'unknown'))
+    assert error.value.status_code == 412
+
+
+def test_delete_family_tree_batches_inserts(monkeypatch):
+    '''
+    Tests that a 500-node family is deleted with one metadata query and chunked inserts
+    '''
+    family = [
+        {'uuid': 'uuid%d' % i, 'name': 'name', 'lineage_id': 'lineage', 'family_id': 'family'}
+        for i in range(500)
+    ]
+    batches = []
+    monkeypatch.setattr(logic_layer, 'DELETE_FAMILY_TREE_CHUNK_SIZE', 200)
+    monkeypatch.setattr(logic_layer, 'validate_delete_family_tree', lambda uuid: {'dataset_exists': True, 'not_deleted': True})
+    monkeypatch.setattr(logic_layer, 'get_family_metadata_by_uuid', lambda uuid: family)
+    monkeypatch.setattr(logic_layer, 'insert_batch_SPARQL', batches.append)
+
+    logic_layer.delete_family_tree('user1', 'group1', 'uuid0')
+
+    assert [len(batch) for batch in batches] == [200, 200, 100]
+    deleted = [document.dataset.uuid for batch in batches for document in batch]
+    assert deleted == [dataset['uuid'] for dataset in family]
+    assert all(document.operation.type_ == 'delete' for batch in batches for document in batch)
+
+
+def test_stream_history_user_matches_history(monkeypatch):
+    '''
+    Tests that the streamed user history is the same document as the eager one
+    '''
+    rows = [
+        {'operationDescription': 'create', 'timestamp': '2024-09-05 13:23:30', 'datasetUUID': '1',
+         'datasetTitle': 'name', 'previousDataset': None, 'previousUUID': None, 'associatedUserGroup': 'group1'},
+        {'operationDescription': 'update:first', 'timestamp': '2024-09-05 13:23:55', 'datasetUUID': '2',
+         'datasetTitle': 'name', 'previousDataset': 'dataset-1', 'previousUUID': '1', 'associatedUserGroup': 'group1'},
+    ]
+    monkeypatch.setattr(logic_layer, 'select_user_history_by_uuid_SPARQL_rows', lambda username: iter(rows))
+
+    streamed = loads(''.join(logic_layer.stream_history_user('user1')))
+
+    assert streamed == logic_layer.get_history_user('user1')
+    assert streamed['user1'][1]['uuid_prev'] == '1'
+    assert streamed['user1'][1]['update_description'] == 'first'
+
+
+def test_stream_history_user_unknown_user(monkeypatch):
+    '''
+    Tests that an unknown user raises a 412 before anything is streamed
+    '''
+    monkeypatch.setattr(logic_layer, 'select_user_history_by_uuid_SPARQL_rows', lambda username: iter([]))
+
+    with pytest.raises(CustomError) as error:
+        logic_layer.stream_history_user('unknown')
+    assert error.value.status_code == 412
+
+
+def test_stream_history_user_reports_errors_midway(monkeypatch):
+    '''
+    Tests that a store error or the deadline passing midway closes the streamed document with an error member
+    '''
+    row = {'operationDescription': 'create', 'timestamp': '2024-09-05 13:23:30', 'datasetUUID': '1',
+           'datasetTitle': 'name', 'previousDataset': None, 'previousUUID': None, 'associatedUserGroup': 'group1'}
+
+    def failing_rows(username):
+        yield row
+        raise CustomError('The triple store could not be reached.', 'Lineage Tracker Backend', 503)
+
+    monkeypatch.setattr(logic_layer, 'select_user_history_by_uuid_SPARQL_rows', failing_rows)
+    streamed = loads(''.join(logic_layer.stream_history_user('user1')))
+    assert len(streamed['user1']) == 1
+    assert streamed['error']['status_code'] == 503
+
+    # The chunks are consumed after the deadline of the request was left, as by the WSGI server
+    monkeypatch.setattr(logic_layer, 'select_user_history_by_uuid_SPARQL_rows', lambda username: iter([row, row]))
+    with deadline(0.05):
+        chunks = logic_layer.stream_history_user('user1')
+    time.sleep(0.1)
+    streamed = loads(''.join(chunks))
+    assert len(streamed['user1']) == 1
+    assert streamed['error']['status_code'] == 504
+
+
+def test_get_history_user_pages(monkeypatch):
+    '''
+    Tests that a user history page returns the cursor of the next page, and that bad cursors are rejected
+    '''
+    rows = [
+        {'operation': 'op%d' % index, 'operationDescription': 'read', 'timestamp': '2024-09-05 13:23:3%d' % index,
+         'datasetUUID': '1', 'datasetTitle': 'name', 'previousDataset': None, 'previousUUID': None, 'associatedUserGroup': 'group1'}
+        for index in range(3)
+    ]
+    queries = []
+
+    def select_rows(username, limit=None, after=None):
+        queries.append((limit, after))
+        rows_after = [row for row in rows if [row['timestamp'], row['operation']] > after]
+        return iter(rows_after[:limit])
+
+    monkeypatch.setattr(logic_layer, 'select_user_history_by_uuid_SPARQL_rows', select_rows)
+
+    first_page = logic_layer.get_history_user('user1', limit=2)
+    last_page = logic_layer.get_history_user('user1', limit=2, cursor=first_page['next_cursor'])
+
+    assert queries == [(3, ['', '']), (3, ['2024-09-05 13:23:31', 'op1'])]
+    assert [entry['timestamp'] for entry in first_page['user1'] + last_page['user1']] == [row['timestamp'] for row in rows]
+    assert last_page['next_cursor'] is None
+
+    with pytest.raises(CustomError) as error:
+        logic_layer.get_history_user('user1', limit=2, cursor='not a cursor')
+    assert error.value.status_code == 400
+
+
+def test_versioned_family_tree_is_cached_until_invalidated(monkeypatch):
+    '''
+    Tests that versioned family trees are served from the cache until a write invalidates their family
+    '''
+    queries = []
+
+    async def get_family_id_async(uuid):
+        return 'family'
+
+    async def select_family_tree_async(family_id):
+        queries.append(family_id)
+        return {'results': {'bindings': [
+            family_binding('1', 'lineage-a', '2024-09-05 13:23:30', 'create')
+        ]}}
+
+    monkeypatch.setattr(logic_layer, 'family_tree_cache', logic_layer.LRUCache(10))
+    monkeypatch.setattr(logic_layer, 'get_family_id_async', get_family_id_async)
+    monkeypatch.setattr(logic_layer, 'add_versioning', lambda family_tree: {'versioned': family_tree})
+    monkeypatch.setattr(logic_layer, 'select_family_tree_by_family_id_SPARQL_async', select_family_tree_async)
+
+    first = asyncio.run(logic_layer.get_versioned_family_tree_async('1'))
+    assert asyncio.run(logic_layer.get_versioned_family_tree_async('2')) is first
+    assert queries == ['family']
+
+    logic_layer.invalidate_family_tree('family')
+    assert asyncio.run(logic_layer.get_versioned_family_tree_async('1')) == first
+    assert queries == ['family', 'family']
+
+
+def test_versioned_family_tree_is_cached_per_revision(monkeypatch):
+    '''
+    Tests that a tree cached at an older revision is not served for a newer one, e.g. after a write by another process
+    '''
+    queries = []
+
+    async def get_family_id_async(uuid):
+        return 'family'
+
+    async def select_family_tree_async(family_id):
+        queries.append(family_id)
+        return {'results': {'bindings': [
+            family_binding('1', 'lineage-a', '2024-09-05 13:23:30', 'create')
+        ]}}
+
+    monkeypatch.setattr(logic_layer, 'family_tree_cache', logic_layer.LRUCache(10))
+    monkeypatch.setattr(logic_layer, 'get_family_id_async', get_family_id_async)
+    monkeypatch.setattr(logic_layer, 'add_versioning', lambda family_tree: {'versioned': family_tree})
+    monkeypatch.setattr(logic_layer, 'select_family_tree_by_family_id_SPARQL_async', select_family_tree_async)
+
+    first = asyncio.run(logic_layer.get_versioned_family_tree_async('1', 'r1'))
+    assert asyncio.run(logic_layer.get_versioned_family_tree_async('1', 'r1')) is first
+    assert queries == ['family']
+
+    assert asyncio.run(logic_layer.get_versioned_family_tree_async('1', 'r2')) is not first
+    assert queries == ['family', 'family']
+
+
+def test_ancestry_queries_use_cached_structure(monkeypatch):
+    '''
+    Tests that ancestry questions about one family are answered from a single family query
+    '''
+    queries = []
+    families = {'1': 'family', '2': 'family', '3': 'family', '4': 'family', 'other': 'other-family'}
+
+    async def get_family_id_async(uuid):
+        return families.get(uuid)
+
+    async def select_family_tree_async(family_id):
+        queries.append(family_id)
+        return {'results': {'bindings': [
+            family_binding('1', 'lineage-a', '2024-09-05 13:23:30', 'create'),
+            family_binding('2', 'lineage-a', '2024-09-05 13:23:31', 'update', '1'),
+            family_binding('3', 'lineage-a', '2024-09-05 13:23:32', 'update', '2'),
+            family_binding('4', 'lineage-b', '2024-09-05 13:23:33', 'update', '2'),
+        ]}}
+
+    monkeypatch.setattr(logic_layer, 'family_tree_cache', logic_layer.LRUCache(10))
+    monkeypatch.setattr(logic_layer, 'family_structure_cache', logic_layer.LRUCache(10))
+    monkeypatch.setattr(logic_layer, 'get_family_id_async', get_family_id_async)
+    monkeypatch.setattr(logic_layer, 'select_family_tree_by_family_id_SPARQL_async', select_family_tree_async)
+
+    assert asyncio.run(logic_layer.is_derived_from_async('1', '3'))
+    assert not asyncio.run(logic_layer.is_derived_from_async('3', '1'))
+    assert not asyncio.run(logic_layer.is_derived_from_async('2', '2'))
+    assert not asyncio.run(logic_layer.is_derived_from_async('other', '3'))
+    common_ancestor = asyncio.run(logic_layer.get_common_ancestor_async('3', '4'))
+    assert (common_ancestor['common_ancestor'], common_ancestor['version']) == ('2', '2')
+    assert asyncio.run(logic_layer.get_common_ancestor_async('3', 'other'))['common_ancestor'] is None
+    assert queries == ['family']
+
+    with pytest.raises(CustomError) as error:
+        asyncio.run(logic_layer.is_derived_from_async('1', 'missing'))
+    assert error.value.status_code == 412
+
+
+def test_descendants_filtered_by_depth():
+    '''
+    Tests that descendants beyond max_depth are left out when the query was not bounded, and that stored labels are kept
+    '''
+    bindings = [
+        family_binding('2', 'lineage-a', '2024-09-05 13:23:31', 'update', '1'),
+        family_binding('3', 'lineage-a', '2024-09-05 13:23:32', 'update', '2'),
+        family_binding('4', 'lineage-b', '2024-09-05 13:23:33', 'update', '1'),
+    ]
+    bindings[0]['version'] = literal('2.0')
+    ret = {'results': {'bindings': bindings}}
+
+    assert logic_layer.descendants_from_result('1', ret, max_depth=1) == {
+        'lineage-a': {'2': {**logic_layer.format_lineage_entry(bindings[0]), 'version': '2.0'}},
+        'lineage-b': {'4': {**logic_layer.format_lineage_entry(bindings[2]), 'version': None}},
+    }
+    assert list(logic_layer.descendants_from_result('1', ret)['lineage-a']) == ['2', '3']
+
+
+def test_descendants_query_runs_with_existence_check(monkeypatch):
+    '''
+    Tests that the descendants query is sent without waiting for the family lookup, and that unknown datasets raise a 412
+    '''
+    started = []
+
+    async def get_family_id_async(uuid):
+        await asyncio.sleep(0.01)
+        started.append('family_id')
+        return None if uuid == 'unknown' else 'family'
+
+    async def select_descendants_async(uuid, max_depth=None):
+        started.append('descendants')
+        return {'results': {'bindings': [family_binding('2', 'lineage-a', '2024-09-05 13:23:31', 'update', uuid)]}}
+
+    monkeypatch.setattr(logic_layer, 'get_family_id_async', get_family_id_async)
+    monkeypatch.setattr(logic_layer, 'select_descendants_by_uuid_SPARQL_async', select_descendants_async)
+
+    assert list(asyncio.run(logic_layer.get_dataset_descendants_async('1'))['lineage-a']) == ['2']
+    assert started == ['descendants', 'family_id']
+
+    with pytest.raises(CustomError) as error:
+        asyncio.run(logic_layer.get_dataset_descendants_async('unknown'))
+    assert error.value.status_code == 412
+
+
+def test_fds_tables_are_downloaded_once(tmp_path, monkeypatch):
+    '''
+    Tests that comparing v3 with v4 and then v4 with v5 downloads the table of v4 only once
+    '''
+    downloads = []
+
+    def get(url, params, headers, timeout):
+        downloads.append(params['asset_uuid'])
+        text = dumps([{'data': {'rows': [[params['asset_uuid']]]}}])
+        return SimpleNamespace(status_code=200, text=text, content=text.encode('utf-8'))
+
+    monkeypatch.setattr(logic_layer.requests, 'get', get)
+    monkeypatch.setattr(logic_layer, 'fds_table_cache', DiskCache(str(tmp_path), max_bytes=10000))
+
+    for uuid_1, uuid_2 in (('v3', 'v4'), ('v4', 'v5')):
+        assert logic_layer.fetch_dataset(uuid_1, 'dataset 1')[0]['data']['rows'] == [[uuid_1]]
+        assert logic_layer.fetch_dataset(uuid_2, 'dataset 2')[0]['data']['rows'] == [[uuid_2]]
+
+    assert downloads == ['v3', 'v4', 'v5']
+
+
+def test_reversed_diff_is_inverted_from_cache(tmp_path, monkeypatch):
+    '''
+    Tests that a repeated or reversed compare is answered from the diff cache, matching a fresh computation
+    '''
+    tables = {
+        'v1': [{'data_model': {'columns': [['id'], ['name'], ['size']]}, 'data': {'rows': [[1, 'a', 10], [2, 'b', 20]]}}],
+        'v2': [{'data_model': {'columns': [['id'], ['name']]}, 'data': {'rows': [[2, 'c'], [3, 'd']]}}],
+    }
+    downloads = []
+
+    async def validate_create_async(uuid):
+        return False
+
+    monkeypatch.setattr(logic_layer, 'validate_create_async', validate_create_async)
+    monkeypatch.setattr(logic_layer, 'fetch_dataset', lambda uuid, label: downloads.append(uuid) or tables[uuid])
+    monkeypatch.setattr(logic_layer, 'diff_cache', DiskCache(str(tmp_path / 'cache'), max_bytes=10000))
+
+    forward = asyncio.run(logic_layer.get_diff_datasets_async('v1', 'v2'))
+    assert asyncio.run(logic_layer.get_diff_datasets_async('v1', 'v2')) == forward
+    reverse = asyncio.run(logic_layer.get_diff_datasets_async('v2', 'v1'))
+    assert sorted(downloads) == ['v1', 'v2']
+
+    assert reverse == logic_layer.diff_datasets(tables['v2'], tables['v1'])
+    assert reverse['diff']['changed'] == [{'key': '2', 'changes': {'name': ['c', 'b']}}]
+
+
+def test_concurrent_diffs_do_not_interfere():
+    '''
+    Tests that diffs computed at the same time each compare their own tables
+    '''
+    tables = [
+        [{'data_model': {'columns': [['id'], ['value']]}, 'data': {'rows': [[row, '%d-%d' % (i, row)] for row in range(50)]}}]
+        for i in range(8)
+    ]
+    pairs = [(tables[i], tables[(i + 1) % 8]) for i in range(8)]
+    expected = [logic_layer.diff_datasets(*pair) for pair in pairs]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(executor.map(lambda pair: logic_layer.diff_datasets(*pair), pairs)) == expected
+
+
+def test_stored_versions_are_projected():
+    '''
+    Tests that valid stored version labels are used as stored, and computed when a dataset has none or one is invalid
+    '''
+    bindings = [
+        dict(family_binding('1', 'lineage-a', '2024-09-05 13:23:30', 'create'), version=literal('1')),
+        dict(family_binding('2', 'lineage-a', '2024-09-05 13:23:55', 'update:first', '1'), version=literal('2.1')),
+        dict(family_binding('3', 'lineage-b', '2024-09-05 13:23:56', 'update:second', '1'), version=literal('2.0')),
+    ]
+
+    family_tree = logic_layer.versioned_family_tree_from_result({'results': {'bindings': bindings}})
+    assert (family_tree['lineage-a']['2']['version'], family_tree['lineage-b']['3']['version']) == ('2.1', '2.0')
+
+    for version in (None, '2.2', '3.1'):
+        if version is None:
+            del bindings[1]['version']
+        else:
+            bindings[1]['version'] = literal(version)
+        family_tree = logic_layer.versioned_family_tree_from_result({'results': {'bindings': bindings}})
+        assert (family_tree['lineage-a']['2']['version'], family_tree['lineage-b']['3']['version']) == ('2.0', '2.1')
+
+
+def test_computed_versions_order_siblings_by_creation():
+    '''
+    Tests that labels computed when read order siblings by creation, like relabel_family, and keep the latest timestamps
+    '''
+    bindings = [
+        family_binding('1', 'lineage-a', '2024-09-05 13:23:30', 'create'),
+        family_binding('2', 'lineage-a', '2024-09-05 13:23:55', 'update:first', '1'),
+        family_binding('2', 'lineage-a', '2024-09-05 13:40:00', 'delete', '1'),
+        family_binding('3', 'lineage-b', '2024-09-05 13:30:00', 'update:second', '1'),
+    ]
+
+    family_tree = logic_layer.versioned_family_tree_from_result({'results': {'bindings': bindings}})
+
+    assert (family_tree['lineage-a']['2']['version'], family_tree['lineage-b']['3']['version']) == ('2.0', '2.1')
+    assert family_tree['lineage-a']['2']['timestamp'] == '2024-09-05 13:40:00'
+
+
+def test_duplicate_sibling_versions_are_recomputed():
+    '''
+    Tests that siblings stored with the same label (concurrent updates of their parent) are relabelled when read
+    '''
+    bindings = [
+        dict(family_binding('1', 'lineage-a', '2024-09-05 13:23:30', 'create'), version=literal('1')),
+        dict(family_binding('2', 'lineage-a', '2024-09-05 13:23:55', 'update:first', '1'), version=literal('2')),
+        dict(family_binding('3', 'lineage-b', '2024-09-05 13:23:56', 'update:second', '1'), version=literal('2')),
+    ]
+
+    family_tree = logic_layer.versioned_family_tree_from_result({'results': {'bindings': bindings}})
+    assert (family_tree['lineage-a']['2']['version'], family_tree['lineage-b']['3']['version']) == ('2.0', '2.1')
+
+
+def test_relabel_family_writes_changed_labels(monkeypatch):
+    '''
+    Tests that a second child relabels the first one, with siblings ordered by creation despite later deletes
+    '''
+    bindings = [
+        dict(family_binding('1', 'lineage-a', '2024-09-05 13:23:30', 'create'), version=literal('1')),
+        dict(family_binding('2', 'lineage-a', '2024-09-05 13:23:55', 'update:first', '1'), version=literal('2')),
+        dict(family_binding('2', 'lineage-a', '2024-09-05 13:40:00', 'delete', '1'), version=literal('2')),
+        dict(family_binding('3', 'lineage-b', '2024-09-05 13:30:00', 'update:second', '1'), version=literal('2.1')),
+        family_binding('4', 'lineage-a', '2024-09-05 13:35:00', 'update:third', '2'),
+    ]
+    written = []
+    monkeypatch.setattr(logic_layer, 'select_family_tree_by_family_id_SPARQL', lambda family_id: {'results': {'bindings': bindings}})
+    monkeypatch.setattr(logic_layer, 'replace_versions_SPARQL', written.extend)
+
+    assert logic_layer.relabel_family('family') == 2
+    assert sorted((dataset.uuid, dataset.lineage_id, version) for dataset, version in written) == [
+        ('2', 'lineage-a', '2.0'),
+        ('4', 'lineage-a', '3.0'),
+    ]
+
+
+def test_update_stores_appended_version(monkeypatch):
+    '''
+    Tests that an update labels the new dataset as the last child, and relabels the family when it gets a second child
+    '''
+    metadata = {'dataset_exists': True, 'deleted': False, 'name': 'name', 'lineage_id': 'lineage', 'family_id': 'family',
+                'has_children': True, 'has_undeleted_children': True, 'num_children': 1, 'version': '2'}
+    documents = []
+    relabelled = []
+    monkeypatch.setattr(logic_layer, 'get_dataset_metadata', lambda uuid: metadata)
+    monkeypatch.setattr(logic_layer, 'insert_SPARQL', documents.append)
+    monkeypatch.setattr(logic_layer, 'relabel_family', relabelled.append)
+    monkeypatch.setattr(logic_layer, 'add_known_dataset', lambda uuid: None)
+
+    logic_layer.update('user1', 'group1', 'uuid3', 'uuid2', 'description')
+    metadata['num_children'] = 2
+    logic_layer.update('user1', 'group1', 'uuid4', 'uuid2', 'description')
+
+    assert [document.version for document in documents] == ['3.1', '3.2']
+    assert relabelled == ['family']
+
+
+def test_update_survives_failed_relabel(monkeypatch):
+    '''
+    Tests that a documented update succeeds and invalidates the cached family tree even if relabelling fails,
+    and that the family is then served with computed labels instead of the stale stored ones
+    '''
+    metadata = {'dataset_exists': True, 'deleted': False, 'name': 'name', 'lineage_id': 'lineage', 'family_id': 'family',
+                'has_children': True, 'has_undeleted_children': True, 'num_children': 1, 'version': '2'}
+    invalidated = []
+    documents = []
+
+    def relabel_family(family_id):
+        raise CustomError('Store unavailable', 'Lineage Tracker Backend', 503)
+
+    monkeypatch.setattr(logic_layer, 'get_dataset_metadata', lambda uuid: metadata)
+    monkeypatch.setattr(logic_layer, 'insert_SPARQL', documents.append)
+    monkeypatch.setattr(logic_layer, 'relabel_family', relabel_family)
+    monkeypatch.setattr(logic_layer, 'invalidate_family_tree', invalidated.append)
+    monkeypatch.setattr(logic_layer, 'add_known_dataset', lambda uuid: None)
+
+    assert logic_layer.update('user1', 'group1', 'uuid3', 'uuid2', 'description') == 'updating the dataset successfully documented.'
+    assert invalidated == ['family']
+
+    # Stored labels: uuid5 and its child uuid6 still carry the labels of an only child next to the new uuid3
+    bindings = [
+        dict(family_binding('uuid1', 'lineage', '2024-09-05 13:00:00', 'create'), version=literal('1')),
+        dict(family_binding('uuid2', 'lineage', '2024-09-05 13:00:01', 'update:a', 'uuid1'), version=literal('2')),
+        dict(family_binding('uuid5', 'lineage', '2024-09-05 13:00:02', 'update:b', 'uuid2'), version=literal('3')),
+        dict(family_binding('uuid6', 'lineage', '2024-09-05 13:00:03', 'update:c', 'uuid5'), version=literal('4')),
+        dict(family_binding('uuid3', 'lineage-b', '2024-09-05 13:00:04', 'update:d', 'uuid2'),
+             version=literal(documents[0].version)),
+    ]
+
+    family_tree = logic_layer.versioned_family_tree_from_result({'results': {'bindings': bindings}})
+
+    assert {uuid: entry['version'] for lineage in family_tree.values() for uuid, entry in lineage.items()} == {
+        'uuid1': '1', 'uuid2': '2', 'uuid5': '3.0', 'uuid6': '4.0', 'uuid3': '3.1'
+    }
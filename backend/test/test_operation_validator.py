@@ -0,0 +1,203 @@
+import pytest
+import threading
+
+import tools.operation_validator as operation_validator
+from tools.bloom_filter import BloomFilter
+
+
+def binding(**values):
+    '''
+    Builds a SPARQL JSON result binding of literals
+    '''
+    return {key: {'type': 'literal', 'value': value} for key, value in values.items()}
+
+
+@pytest.fixture(autouse=True)
+def empty_metadata_cache():
+    '''
+    Starts every test with an empty metadata cache
+    '''
+    operation_validator.metadata_cache.clear()
+    yield
+    operation_validator.metadata_cache.clear()
+
+
+@pytest.fixture
+def metadata_result(monkeypatch):
+    '''
+    Replaces the metadata query with canned bindings
+    '''
+    def set_bindings(bindings):
+        monkeypatch.setattr(
+            operation_validator,
+            'get_dataset_metadata_SPARQL',
+            lambda uuid: {'results': {'bindings': bindings}}
+        )
+    return set_bindings
+
+
+def test_metadata_dataset_does_not_exist(metadata_result):
+    '''
+    Tests metadata and read conditions of an unknown uuid
+    '''
+    metadata_result([])
+
+    metadata = operation_validator.get_dataset_metadata('uuid1')
+
+    assert not metadata['dataset_exists']
+    assert metadata['name'] is None
+    assert operation_validator.validate_read('uuid1', metadata) == {'dataset_exists': False, 'not_deleted': True}
+
+
+def test_metadata_with_deleted_and_undeleted_children(metadata_result):
+    '''
+    Tests that a dataset with one undeleted child cannot be deleted
+    '''
+    common = dict(name='name', lineageId='lineage1', familyId='family1')
+    metadata_result([
+        binding(operationFrom='pistisOperation:create-uuid1', **common,
+                child='pistisDataset:name-uuid2', childOperation='pistisOperation:update-uuid2'),
+        binding(operationFrom='pistisOperation:create-uuid1', **common,
+                child='pistisDataset:name-uuid2', childOperation='pistisOperation:delete-uuid2'),
+        binding(operationFrom='pistisOperation:create-uuid1', **common,
+                child='pistisDataset:name-uuid3', childOperation='pistisOperation:update-uuid3'),
+    ])
+
+    metadata = operation_validator.get_dataset_metadata('uuid1')
+
+    assert metadata['dataset_exists'] and not metadata['deleted']
+    assert (metadata['name'], metadata['lineage_id'], metadata['family_id']) == ('name', 'lineage1', 'family1')
+    assert metadata['has_children'] and metadata['has_undeleted_children']
+    assert operation_validator.validate_delete('uuid1', metadata)['not_undeleted_was_derived_from'] is False
+
+
+def test_metadata_deleted_dataset_with_deleted_children(metadata_result):
+    '''
+    Tests the delete conditions of an already deleted dataset whose children are deleted
+    '''
+    common = dict(name='name', lineageId='lineage1', familyId='family1',
+                  child='pistisDataset:name-uuid2', childOperation='pistisOperation:delete-uuid2')
+    metadata_result([
+        binding(operationFrom='pistisOperation:create-uuid1', **common),
+        binding(operationFrom='pistisOperation:delete-uuid1', **common),
+    ])
+
+    metadata = operation_validator.get_dataset_metadata('uuid1')
+
+    assert metadata['deleted']
+    assert metadata['has_children'] and not metadata['has_undeleted_children']
+    assert operation_validator.validate_delete('uuid1', metadata) == {
+        'dataset_exists': True,
+        'not_deleted': False,
+        'not_undeleted_was_derived_from': True
+    }
+
+
+def test_immutable_metadata_is_read_through_cache(monkeypatch):
+    '''
+    Tests that name, lineage_id and family_id are queried once, and that later reads only query the operations
+    '''
+    queries = []
+    bindings = [binding(operationFrom='pistisOperation:create-uuid1', name='name', lineageId='lineage1', familyId='family1')]
+    monkeypatch.setattr(
+        operation_validator,
+        'get_dataset_metadata_SPARQL',
+        lambda uuid: queries.append('metadata') or {'results': {'bindings': bindings}}
+    )
+    monkeypatch.setattr(
+        operation_validator,
+        'validate_operation_by_uuid_SPARQL',
+        lambda uuid: queries.append('operations') or {'results': {'bindings': [
+            binding(operationFrom='pistisOperation:create-uuid1'),
+            binding(operationFrom='pistisOperation:delete-uuid1'),
+        ]}}
+    )
+
+    assert operation_validator.get_family_id('uuid1') == 'family1'
+    assert operation_validator.get_lineage_id_by_uuid('uuid1') == 'lineage1'
+    assert operation_validator.get_name_by_uuid('uuid1') == 'name'
+    metadata = operation_validator.get_dataset_metadata('uuid1', with_children=False)
+
+    assert queries == ['metadata', 'operations']
+    assert metadata['deleted'] and metadata['family_id'] == 'family1'
+    assert operation_validator.metadata_cache.stats()['hits'] == 3
+
+
+def test_unknown_dataset_is_not_cached(metadata_result):
+    '''
+    Tests that a missing dataset is not cached, as it can still be created
+    '''
+    metadata_result([])
+
+    assert operation_validator.get_family_id('uuid1') is None
+    assert len(operation_validator.metadata_cache) == 0
+
+
+def test_known_datasets_skip_existence_query(monkeypatch):
+    '''
+    Tests that once the store is scanned, creating an unseen uuid validates without a query,
+    while existence checks for reads still query the store
+    '''
+    monkeypatch.setattr(operation_validator, 'known_datasets', BloomFilter(100))
+    monkeypatch.setattr(operation_validator, 'known_datasets_loaded', threading.Event())
+    monkeypatch.setattr(operation_validator, 'KNOWN_DATASETS_ENABLED', True)
+    monkeypatch.setattr(operation_validator, 'KNOWN_DATASETS_PAGE_SIZE', 2)
+    stored = ['uuid1', 'uuid2', 'uuid3']
+    monkeypatch.setattr(
+        operation_validator,
+        'select_dataset_uuids_SPARQL_rows',
+        lambda limit, after: iter([{'uuid': uuid} for uuid in stored if uuid > after][:limit])
+    )
+    queries = []
+    monkeypatch.setattr(
+        operation_validator,
+        'validate_operation_by_uuid_SPARQL',
+        lambda uuid: queries.append(uuid) or {'results': {'bindings': [
+            binding(operationFrom='pistisOperation:create-' + uuid)
+        ] if uuid in stored else []}}
+    )
+
+    assert operation_validator.validate_create('uuid4', use_known_datasets=True)
+    assert queries == ['uuid4']
+
+    operation_validator.load_known_datasets()
+    operation_validator.add_known_dataset('uuid5')
+
+    assert operation_validator.validate_create('uuid4', use_known_datasets=True)
+    assert not operation_validator.validate_create('uuid3', use_known_datasets=True)
+    assert operation_validator.validate_create('uuid5', use_known_datasets=True)
+    assert queries == ['uuid4', 'uuid3', 'uuid5']
+
+    # A dataset created through another process is not in the filter, but exists for reads
+    stored.append('uuid6')
+    assert not operation_validator.validate_create('uuid6')
+    assert queries == ['uuid4', 'uuid3', 'uuid5', 'uuid6']
+    assert operation_validator.known_datasets_stats()['size'] == 4
+
+
+def test_known_datasets_disabled_for_several_workers(monkeypatch):
+    '''
+    Tests that with several workers the filter is not loaded, so every create queries the store
+    '''
+    monkeypatch.setattr(operation_validator, 'known_datasets', BloomFilter(100))
+    monkeypatch.setattr(operation_validator, 'known_datasets_loaded', threading.Event())
+    monkeypatch.setattr(operation_validator, 'KNOWN_DATASETS_ENABLED', False)
+    scanned = []
+    monkeypatch.setattr(
+        operation_validator,
+        'select_dataset_uuids_SPARQL_rows',
+        lambda limit, after: scanned.append(after) or iter([])
+    )
+    queries = []
+    monkeypatch.setattr(
+        operation_validator,
+        'validate_operation_by_uuid_SPARQL',
+        lambda uuid: queries.append(uuid) or {'results': {'bindings': []}}
+    )
+
+    operation_validator.load_known_datasets()
+
+    assert operation_validator.validate_create('uuid1', use_known_datasets=True)
+    assert scanned == []
+    assert queries == ['uuid1']
+    assert not operation_validator.known_datasets_stats()['loaded']
@@ -0,0 +1,161 @@
+import pytest
+import rdflib.plugins.sparql
+from rdflib import Dataset as RDFDataset
+
+from tools.rdf.graph_builder import namespaces, Dataset, Document, Operation, User
+from tools.rdf.triple_builder import TripleDocument, to_insert_data
+from tools.sparql.groundlevel_tools.regex_query_builder import re_get_namespaces_rdf_query
+from tools.sparql.query_templates import PREFIXES, XSD_STRING, QueryTemplate, render_query
+
+
+def test_prefix_block_matches_prov_namespaces():
+    '''
+    Tests that the cached PREFIX block equals the one derived from a prov document
+    '''
+    empty_document = Document(namespaces)
+    expected = re_get_namespaces_rdf_query(empty_document.get_rdf_namespaces())
+
+    assert PREFIXES.replace(' ', '') == expected.replace(' ', '')
+
+
+def test_render_binds_typed_string():
+    '''
+    Tests that uuids are bound as xsd:string literals
+    '''
+    query = render_query('get_name_by_uuid', uuid='123abc')
+
+    assert query.startswith(PREFIXES)
+    assert 'dct:identifier "123abc"^^<http://www.w3.org/2001/XMLSchema#string>;' in query
+
+
+def test_render_escapes_injection():
+    '''
+    Tests that quotes and backslashes cannot break out of a literal
+    '''
+    username = 'x")) } DROP GRAPH <pistisGraph:v3> #\\'
+    query = render_query('select_user_history_by_username', username=username)
+
+    assert 'LCASE("x\\")) } DROP GRAPH <pistisGraph:v3> #\\\\")' in query
+
+
+def test_optional_user_group_filter():
+    '''
+    Tests that the user group filter is only present in the user group variant
+    '''
+    query = render_query('select_dataset_history_by_uuid', uuid='123abc')
+    query_group = render_query('select_dataset_history_by_uuid_and_user_group', uuid='123abc', user_group='FHG')
+
+    assert 'associatedUserGroup) =' not in query
+    assert 'FILTER(STR(?associatedUserGroup) = "FHG")' in query_group
+
+
+def test_template_validation():
+    '''
+    Tests that undeclared and missing parameters are rejected
+    '''
+    with pytest.raises(ValueError):
+        QueryTemplate('broken', 'SELECT * { ?s ?p %(o)s }', {})
+
+    template = QueryTemplate('limit', 'SELECT * { ?s ?p ?o } LIMIT %(limit)s', {'limit': 'integer'})
+    with pytest.raises(ValueError):
+        template.bind()
+    with pytest.raises(TypeError):
+        template.bind(limit='10; DROP')
+    assert template.bind(limit=10).endswith('LIMIT 10')
+
+
+def history_store():
+    '''
+    Returns an rdflib store with the operations on uuid-1, several of them sharing a timestamp
+    uuid-1 has two children, so its operations appear once per child in the dataset history
+    '''
+    dataset = Dataset('uuid-1', 'name', 'lineage-1', 'family-1')
+    children = [Dataset('uuid-2', 'name', 'lineage-1', 'family-1'), Dataset('uuid-3', 'name', 'lineage-2', 'family-1')]
+    operations = [('create', dataset, None, '2024-09-05 13:23:30')]
+    operations += [('read', dataset, None, '2024-09-05 13:23:40')] * 3
+    operations += [('update', child, dataset, '2024-09-05 13:23:50') for child in children]
+
+    triples = []
+    for index, (type_, involved_dataset, dataset_prev, timestamp) in enumerate(operations):
+        user = User('user%d' % index, 'group1')
+        operation = Operation(type_, involved_dataset, user, 'cleaned' if type_ == 'update' else None)
+        operation.timestamp = timestamp
+        triples += TripleDocument(user, involved_dataset, operation, dataset_prev).get_triples()
+
+    store = RDFDataset(default_union=True)
+    store.update(to_insert_data(triples))
+    return store
+
+
+def run_query(store, query:str) -> list:
+    '''
+    Runs a query on an rdflib store
+    rdflib, unlike Virtuoso, distinguishes simple and xsd:string literals and has no built-in dcterms prefix
+    '''
+    query = query.replace('^^' + XSD_STRING, '').replace('dcterms:', 'dct:')
+    return [{str(variable): str(value) for variable, value in row.asdict().items()} for row in store.query(query)]
+
+
+def test_history_pages_cover_every_operation_once(monkeypatch):
+    '''
+    Tests that keyset pages with timestamp ties concatenate to the full ordered history
+    '''
+    monkeypatch.setattr(rdflib.plugins.sparql, 'SPARQL_LOAD_GRAPHS', False)
+    store = history_store()
+    full = run_query(store, render_query('select_dataset_history_by_uuid', uuid='uuid-1'))
+
+    pages = []
+    after = ['', '', '']
+    while True:
+        page = run_query(store, render_query(
+            'select_dataset_history_page_by_uuid', uuid='uuid-1', limit=2,
+            after_timestamp=after[0], after_operation=after[1], after_next_uuid=after[2]
+        ))
+        pages += page
+        if len(page) < 2:
+            break
+        after = [page[-1]['timestamp'], page[-1]['operation'], page[-1].get('nextUUID', '')]
+
+    assert len(full) == 10
+    assert [row['timestamp'] for row in full] == sorted(row['timestamp'] for row in full)
+    assert pages == full
+
+
+def test_revisions_count_operations_per_scope(monkeypatch):
+    '''
+    Tests that the revision queries count the operations that show up in a history, lineage or family tree
+    '''
+    monkeypatch.setattr(rdflib.plugins.sparql, 'SPARQL_LOAD_GRAPHS', False)
+    store = history_store()
+
+    assert run_query(store, render_query('get_dataset_history_revision', uuid='uuid-1')) == [
+        {'lastIssued': '2024-09-05 13:23:50', 'operations': '6'}
+    ]
+    assert run_query(store, render_query('get_lineage_revision', lineage_id='lineage-1'))[0]['operations'] == '2'
+    assert run_query(store, render_query('get_family_revision', family_id='family-1'))[0]['operations'] == '3'
+    assert run_query(store, render_query('get_family_revision', family_id='unknown')) == [{'operations': '0'}]
+
+
+def test_descendants_are_bounded_by_depth(monkeypatch):
+    '''
+    Tests that the descendant queries follow derivations transitively, up to max_depth when unrolled
+    '''
+    monkeypatch.setattr(rdflib.plugins.sparql, 'SPARQL_LOAD_GRAPHS', False)
+    datasets = [Dataset('uuid-%d' % index, 'name', 'lineage-1', 'family-1') for index in range(4)]
+    triples = []
+    for index, dataset in enumerate(datasets):
+        user = User('user1', 'group1')
+        operation = Operation('update' if index > 0 else 'create', dataset, user, 'cleaned' if index > 0 else None)
+        operation.timestamp = '2024-09-05 13:23:3%d' % index
+        triples += TripleDocument(user, dataset, operation, datasets[index - 1] if index > 0 else None).get_triples()
+    store = RDFDataset(default_union=True)
+    store.update(to_insert_data(triples))
+
+    def descendants(query_name:str, uuid:str) -> set:
+        return {row['id'] for row in run_query(store, render_query(query_name, uuid=uuid))}
+
+    assert descendants('select_descendants_by_uuid', 'uuid-0') == {'uuid-1', 'uuid-2', 'uuid-3'}
+    assert descendants('select_descendants_by_uuid', 'uuid-2') == {'uuid-3'}
+    assert descendants('select_descendants_by_uuid', 'uuid-3') == set()
+    assert descendants('select_descendants_by_uuid_depth_1', 'uuid-0') == {'uuid-1'}
+    assert descendants('select_descendants_by_uuid_depth_2', 'uuid-0') == {'uuid-1', 'uuid-2'}
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from tools.deadline import DeadlineExceeded, deadline
+from tools.single_flight import SingleFlight
+
+
+def run_concurrently(target, count:int) -> list:
+    '''
+    Runs target in count threads and returns their results (or raised errors) in thread order
+    '''
+    results = [None] * count
+
+    def run(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_identical_calls_share_one_computation():
+    '''
+    Tests that concurrent identical calls (sync, and async on separate event loops) run once and share the result
+    '''
+    flights = SingleFlight()
+    calls = []
+
+    @flights.coalesced
+    def read(uuid):
+        calls.append(uuid)
+        time.sleep(0.2)
+        return {'uuid': uuid}
+
+    @flights.coalesced
+    async def read_async(uuid):
+        calls.append(uuid)
+        await asyncio.sleep(0.2)
+        return {'uuid': uuid}
+
+    assert run_concurrently(lambda: read('uuid1'), 5) == [{'uuid': 'uuid1'}] * 5
+    assert run_concurrently(lambda: asyncio.run(read_async('uuid2')), 5) == [{'uuid': 'uuid2'}] * 5
+    assert calls == ['uuid1', 'uuid2']
+    assert flights.stats()['read']['calls'] == 5 and flights.stats()['read']['shared'] == 4
+    assert 0 < flights.stats()['read_async']['max_wait_seconds'] < 1
+
+
+def test_errors_are_shared_and_waits_bounded_by_deadline():
+    '''
+    Tests that the error of a shared call reaches every caller, and that waiting callers respect their deadline
+    '''
+    flights = SingleFlight()
+
+    @flights.coalesced
+    def fail():
+        time.sleep(0.2)
+        raise ValueError('store error')
+
+    assert all(isinstance(result, ValueError) for result in run_concurrently(fail, 3))
+
+    def wait_briefly():
+        time.sleep(0.05)
+        with deadline(0.05):
+            return fail()
+
+    results = []
+    leader = threading.Thread(target=lambda: results.extend(run_concurrently(fail, 1)))
+    leader.start()
+    with pytest.raises(DeadlineExceeded):
+        wait_briefly()
+    leader.join()
+
+    assert isinstance(results[0], ValueError)
+    assert flights.calls == {}
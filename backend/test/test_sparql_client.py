@@ -0,0 +1,87 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tools.sparql.client import AsyncSPARQLClient, SPARQLClient
+
+
+def test_concurrent_queries_keep_their_own_state(sparql_server):
+    '''
+    Tests that queries sent concurrently through one client do not overwrite each other
+    '''
+    client = SPARQLClient(sparql_server.url, pool_size=4)
+    queries = ['SELECT ?s WHERE { ?s ?p %d }' % i for i in range(40)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(client.query, queries))
+
+    for query, result in zip(queries, results):
+        assert result['results']['bindings'][0]['query']['value'] == query
+    client.close()
+
+
+def test_connection_pool_is_bounded_and_reused(sparql_server):
+    '''
+    Tests that the client never opens more connections than its pool size
+    '''
+    sparql_server.delay = 0.01
+    client = SPARQLClient(sparql_server.url, pool_size=2)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(client.query, ['ASK { ?s ?p ?o }'] * 20))
+
+    assert sparql_server.max_active <= 2
+    assert len(sparql_server.connections) <= 2
+    client.close()
+
+
+def test_update_uses_update_parameter(sparql_server):
+    '''
+    Tests that SPARQL updates are sent as updates and not as queries
+    '''
+    client = SPARQLClient(sparql_server.url)
+    result = client.update('INSERT DATA { <a> <b> <c> }')
+
+    binding = result['results']['bindings'][0]
+    assert binding['parameter']['value'] == 'update'
+    assert binding['query']['value'] == 'INSERT DATA { <a> <b> <c> }'
+    client.close()
+
+
+def test_async_queries_run_concurrently(sparql_server):
+    '''
+    Tests that queries awaited together are sent concurrently and keep their own results
+    '''
+    sparql_server.delay = 0.2
+    async_client = AsyncSPARQLClient(SPARQLClient(sparql_server.url, pool_size=4))
+    queries = ['SELECT ?s WHERE { ?s ?p %d }' % i for i in range(4)]
+
+    async def run_queries():
+        return await asyncio.gather(*(async_client.query(query) for query in queries))
+
+    start = time.perf_counter()
+    results = asyncio.run(run_queries())
+    elapsed = time.perf_counter() - start
+
+    for query, result in zip(queries, results):
+        assert result['results']['bindings'][0]['query']['value'] == query
+    assert sparql_server.max_active > 1
+    assert elapsed < 4 * 0.2
+    async_client.client.close()
+
+
+def test_query_rows_decodes_csv_results(sparql_server):
+    '''
+    Tests that CSV results are decoded row by row, including quoted values and unbound variables
+    '''
+    sparql_server.csv_rows = [
+        ['uuid', 'title', 'previousUUID'],
+        ['1', 'a, "quoted"\nmulti-line title', ''],
+        ['2', 'plain', '1'],
+    ]
+    client = SPARQLClient(sparql_server.url)
+    rows = client.query_rows('SELECT ?uuid ?title ?previousUUID WHERE { }')
+
+    assert next(rows) == {'uuid': '1', 'title': 'a, "quoted"\nmulti-line title', 'previousUUID': None}
+    assert list(rows) == [{'uuid': '2', 'title': 'plain', 'previousUUID': '1'}]
+    client.close()
@@ -0,0 +1,55 @@
+import pytest
+from rdflib import Dataset as RDFDataset, Graph, URIRef
+
+from tools.rdf.graph_builder import namespaces, Dataset, Document, Operation, User
+from tools.rdf.triple_builder import TripleDocument, to_insert_data
+
+
+def prov_graph(document:Document) -> set:
+    '''
+    Returns the triples of the prov serialization of a document
+    '''
+    dataset = RDFDataset()
+    dataset.parse(data=document.get_serialized_rdf_graph(), format='trig')
+    return set(dataset.triples((None, None, None)))
+
+
+def operation_objects(type_):
+    '''
+    Returns user, dataset, operation and dataset_prev of an operation, with names that need escaping
+    '''
+    user = User(name='user "one" é', group='group/1')
+    dataset = Dataset('uuid-2', 'dataset name\n"quoted" \\ ü', 'lineage-1', 'family-1')
+    dataset_prev = Dataset('uuid-1', 'dataset name\n"quoted" \\ ü', 'lineage-1', 'family-1')
+    description = 'cleaned "rows"' if type_ == 'update' else None
+    operation = Operation(type_=type_, involved_dataset=dataset, involved_user=user, description=description)
+    return user, dataset, operation, dataset_prev
+
+
+@pytest.mark.parametrize('type_', ['create', 'read', 'update', 'delete'])
+def test_ntriples_match_prov_graph(type_):
+    '''
+    Tests that the direct serializer produces the same graph as the prov path
+    '''
+    user, dataset, operation, dataset_prev = operation_objects(type_)
+    expected = prov_graph(Document(namespaces, user, dataset, operation, dataset_prev))
+
+    ntriples = TripleDocument(user, dataset, operation, dataset_prev).get_ntriples()
+    graph = Graph()
+    graph.parse(data=ntriples, format='nt')
+
+    assert set(graph) == expected
+
+
+@pytest.mark.parametrize('type_', ['create', 'update'])
+def test_insert_data_matches_prov_graph(type_):
+    '''
+    Tests that the INSERT DATA statement inserts the prov graph into pistisGraph:v3
+    '''
+    user, dataset, operation, dataset_prev = operation_objects(type_)
+    expected = prov_graph(Document(namespaces, user, dataset, operation, dataset_prev))
+
+    store = RDFDataset()
+    store.update(to_insert_data(TripleDocument(user, dataset, operation, dataset_prev).get_triples()))
+
+    assert set(store.graph(URIRef('pistisGraph:v3'))) == expected
@@ -1,5 +1,5 @@
 import pytest
-from src.versioning import add_versioning
+from src.versioning import add_versioning, create_family_tree, load_family_tree, Dataset, FamilyTree
 
 sample_ft = {
   "32463890-4f0f-43b9-a697-86ced79c166d": {
@@ -165,3 +165,124 @@ def test_versioning():
             this_dataset = ft[lineage_id][dataset_id]
             assert dataset_id == this_dataset['version']
 
+
+def test_family_tree_nodes():
+    '''
+    Tests that the compact family tree returns the datasets and versions of the json it was built from
+    '''
+    ft_obj = create_family_tree(sample_ft)
+
+    dataset_ids = [dataset_id for lineage in sample_ft.values() for dataset_id in lineage]
+    assert list(ft_obj.nodes) == dataset_ids
+    for lineage in sample_ft.values():
+        for dataset_id, entry in lineage.items():
+            dataset = ft_obj.nodes[dataset_id]
+            assert ft_obj.get_version(dataset_id) == dataset.version == dataset_id
+            assert (dataset.username, dataset.user_group, dataset.dataset_name, dataset.derived_from, dataset.timestamp) == \
+                (entry['username'], entry['user_group'], entry['dataset_name'], entry['derived_from'], entry['timestamp'])
+    assert ft_obj.get_children('3.2') == ['4.2.0', '4.2.1']
+    assert 'missing' not in ft_obj.nodes
+
+def test_is_derived_from():
+    '''
+    Tests ancestry queries answered from the Euler tour index
+    '''
+    ft_obj = create_family_tree(sample_ft)
+    ft_obj.build_index()
+
+    assert ft_obj.is_derived_from('1', '5.2.1')
+    assert ft_obj.is_derived_from('3.2', '4.2.0')
+    assert not ft_obj.is_derived_from('3.2', '4.0')
+    assert not ft_obj.is_derived_from('5.2.1', '1')
+    assert not ft_obj.is_derived_from('3.2', '3.2')
+    assert not ft_obj.is_derived_from('missing', '3.2')
+
+def test_get_common_ancestor():
+    '''
+    Tests lowest common ancestor queries answered from the binary lifting tables
+    '''
+    ft_obj = create_family_tree(sample_ft)
+
+    assert ft_obj.get_common_ancestor('4.2.0', '5.2.1') == '3.2'
+    assert ft_obj.get_common_ancestor('5.2.1', '4.0') == '2'
+    assert ft_obj.get_common_ancestor('3.2', '5.2.1') == '3.2'
+    assert ft_obj.get_common_ancestor('1', '1') == '1'
+    assert ft_obj.get_common_ancestor('1', 'missing') is None
+
+def family_node(derived_from, timestamp):
+    '''
+    Returns a dataset of a family tree json
+    '''
+    return {
+        "username": "user1",
+        "user_group": "group1",
+        "dataset_name": "random_name",
+        "derived_from": derived_from,
+        "operation_description": "update" if derived_from else "create",
+        "timestamp": timestamp
+    }
+
+def test_versioning_deep_chain_and_ties():
+    '''
+    Tests that a long chain is labelled without recursion, and that siblings created in the same second keep their order
+    '''
+    chain = {"0": family_node(None, "2024-09-05 13:00:00")}
+    for i in range(1, 20000):
+        chain[str(i)] = family_node(str(i - 1), "2024-09-05 13:00:00")
+    chain["b"] = family_node("0", "2024-09-05 12:59:59")
+    chain["c"] = family_node("0", "2024-09-05 12:59:59")
+
+    ft = add_versioning({"lineage": chain})
+
+    assert ft["lineage"]["b"]["version"] == "2.0"
+    assert ft["lineage"]["c"]["version"] == "2.1"
+    assert ft["lineage"]["1"]["version"] == "2.2"
+    assert ft["lineage"]["2"]["version"] == "3.2"
+
+    ft_obj = create_family_tree(ft)
+    assert ft_obj.get_common_ancestor("19999", "c") == "0"
+    assert ft_obj.get_common_ancestor("19999", "10000") == "10000"
+
+def test_load_family_tree_matches_add_node():
+    '''
+    Tests that loading a json column by column gives the tree add_node builds, for datasets listed
+    in several lineages, also when a timestamp has another length than '%Y-%m-%d %H:%M:%S'
+    '''
+    ft = {
+        "lineage-a": {"1": family_node(None, "2024-09-05 13:00:00"), "2": family_node("1", "2024-09-05 13:00:02")},
+        "lineage-b": {"2": family_node("1", "2024-09-05 13:00:09"), "3": family_node("1", "2024-09-05 13:00:01")},
+    }
+    for timestamp in ("2024-09-05 13:00:03", "2024-9-5 13:00:03"):
+        ft["lineage-b"]["3"]["timestamp"] = timestamp
+        expected = FamilyTree()
+        for lineage in ft.values():
+            for dataset_id, entry in lineage.items():
+                expected.add_node(dataset_id, entry['username'], entry['user_group'], entry['dataset_name'],
+                                  entry['derived_from'], entry['operation_description'], entry['timestamp'])
+
+        ft_obj = load_family_tree(ft)
+
+        assert ft_obj.ids == expected.ids == ["1", "2", "3"]
+        assert ft_obj.index == expected.index
+        assert list(ft_obj.sort_keys) == list(expected.sort_keys)
+        assert ft_obj.derived_from == expected.derived_from
+        assert ft_obj.usernames == expected.usernames
+
+    ft["lineage-b"]["3"]["timestamp"] = "2024-09-05 13:00:03"
+    add_versioning(ft)
+    assert ft["lineage-a"]["2"]["version"] == ft["lineage-b"]["2"]["version"] == "2.0"
+    assert ft["lineage-b"]["3"]["version"] == "2.1"
+
+def test_dataset_edges_deduplicated():
+    '''
+    Tests that adding the same edge twice, from either end, keeps a single edge
+    '''
+    parent = Dataset("p", "user1", "group1", "name", None, "create", "2024-09-05 13:00:00")
+    child = Dataset("c", "user1", "group1", "name", "p", "update", "2024-09-05 13:00:01")
+
+    child.add_parent(parent)
+    parent.add_child(child)
+    child.add_parent(parent)
+
+    assert list(parent.children.values()) == [child]
+    assert list(child.parents.values()) == [parent]
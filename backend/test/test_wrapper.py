@@ -0,0 +1,74 @@
+import pytest
+import time
+
+import tools.sparql.wrapper as wrapper
+from tools.deadline import deadline
+from tools.error_handler import CustomError, ServiceUnavailableError
+from tools.rdf.graph_builder import Dataset, Operation, User
+from tools.rdf.triple_builder import TripleDocument
+from tools.sparql.circuit_breaker import CircuitBreaker
+from tools.sparql.client import SPARQLClient
+
+
+def test_insert_batch_sends_one_update(sparql_server, monkeypatch):
+    '''
+    Tests that a batch of documents is inserted with a single INSERT DATA request
+    '''
+    monkeypatch.setattr(wrapper, 'client', SPARQLClient(sparql_server.url))
+    user = User(name='user1', group='group1')
+    documents = []
+    for i in range(3):
+        dataset = Dataset('uuid%d' % i, 'name', 'lineage', 'family')
+        documents.append(TripleDocument(user, dataset, Operation('delete', dataset, user)))
+
+    result = wrapper.insert_batch_SPARQL(documents)
+
+    update = result['results']['bindings'][0]['query']['value']
+    assert result['results']['bindings'][0]['parameter']['value'] == 'update'
+    assert update.count('INSERT DATA') == 1
+    assert 'GRAPH <pistisGraph:v3>' in update
+    for i in range(3):
+        assert '<http://purl.org/dc/terms/identifier> "uuid%d" .' % i in update
+
+
+def test_open_breaker_fails_fast(sparql_server, monkeypatch):
+    '''
+    Tests that the breaker opens after failures and then answers with a 503 without calling the store
+    '''
+    monkeypatch.setattr(wrapper, 'client', SPARQLClient('http://127.0.0.1:1/sparql', connect_timeout=1))
+    monkeypatch.setattr(wrapper, 'breaker', CircuitBreaker(failure_threshold=2, reset_timeout=30))
+
+    for _ in range(2):
+        with pytest.raises(CustomError) as error:
+            wrapper.get_name_by_uuid_SPARQL('uuid')
+        assert error.value.status_code == 500
+
+    monkeypatch.setattr(wrapper, 'client', SPARQLClient(sparql_server.url))
+    with pytest.raises(ServiceUnavailableError) as error:
+        wrapper.get_name_by_uuid_SPARQL('uuid')
+    assert error.value.status_code == 503
+    assert 0 < error.value.retry_after <= 30
+    assert sparql_server.connections == set()
+
+
+def test_deadline_bounds_store_calls(sparql_server, monkeypatch):
+    '''
+    Tests that a slow store call is cut off at the deadline of the request with a 504
+    '''
+    sparql_server.delay = 1
+    monkeypatch.setattr(wrapper, 'client', SPARQLClient(sparql_server.url))
+    monkeypatch.setattr(wrapper, 'breaker', CircuitBreaker(failure_threshold=5, reset_timeout=30))
+
+    start = time.perf_counter()
+    with deadline(0.2):
+        with pytest.raises(CustomError) as error:
+            wrapper.get_name_by_uuid_SPARQL('uuid')
+        assert error.value.status_code == 504
+
+        time.sleep(0.2)
+        with pytest.raises(CustomError) as error:
+            wrapper.get_name_by_uuid_SPARQL('uuid')
+        assert error.value.status_code == 504
+
+    assert time.perf_counter() - start < 1
+    assert wrapper.breaker.failures == 1